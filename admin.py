@@ -8,8 +8,12 @@ from aiogram import types, Dispatcher, F
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from config import DB_NAME, DB_TIMEOUT, ADMIN_ROLE, CHANNEL_ID, ADMIN_IDS
-from utils import make_keyboard, format_uz_datetime, parse_uz_datetime, notify_admin, get_main_menu, get_ads_menu, get_requests_menu
+from config import ADMIN_ROLE, CHANNEL_ID, ADMIN_IDS
+from db_pool import pool
+from repositories import PaymentRepo, ProductRepo, RequestRepo, UserRepo
+from profile_cache import user_profiles
+from subscription_cache import subscription_cache
+from utils import make_keyboard, format_uz_datetime, parse_uz_datetime, to_epoch, notify_admin, get_main_menu, get_ads_menu, get_requests_menu
 from common import send_subscription_info
 
 logger = logging.getLogger(__name__)
@@ -142,9 +146,8 @@ async def process_users_menu(message: types.Message, state: FSMContext):
         await list_users_command(message, state)
     elif text == "Фойдаланувчини ўчириш":
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute("SELECT id FROM users WHERE id != ?", (user_id,)) as cursor:
-                    users = [str(row[0]) for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                users = [str(other_id) for other_id in await UserRepo.ids(conn, exclude_id=user_id)]
             if not users:
                 await message.answer("Фойдаланувчилар йўқ.", reply_markup=get_main_menu(ADMIN_ROLE))
                 await state.set_state(AdminStates.main_menu)
@@ -186,9 +189,8 @@ async def process_products_menu(message: types.Message, state: FSMContext):
         await list_products_command(message, state)
     elif text == "Эълонларни ўчириш":
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute("SELECT unique_id FROM products WHERE TRIM(LOWER(status)) = 'active'") as cursor:
-                    products = [row[0] for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                products = await ProductRepo.active_ids(conn)
             if not products:
                 await message.answer("Фаол эълонлар йўқ.", reply_markup=get_ads_menu(is_admin=True))
                 await state.set_state(AdminStates.products_menu)
@@ -207,9 +209,8 @@ async def process_products_menu(message: types.Message, state: FSMContext):
             await state.set_state(AdminStates.main_menu)
     elif text == "Эълонларни архивга ўтказиш":
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute("SELECT unique_id FROM products WHERE TRIM(LOWER(status)) = 'active'") as cursor:
-                    products = [row[0] for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                products = await ProductRepo.active_ids(conn)
             if not products:
                 await message.answer("Фаол эълонлар йўқ.", reply_markup=get_ads_menu(is_admin=True))
                 await state.set_state(AdminStates.products_menu)
@@ -254,9 +255,8 @@ async def process_requests_menu(message: types.Message, state: FSMContext):
         await list_requests_command(message, state)
     elif text == "Сўровларни ўчириш":
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute("SELECT unique_id FROM requests WHERE status = 'active'") as cursor:
-                    requests = [row[0] for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                requests = await RequestRepo.active_ids(conn)
             if not requests:
                 await message.answer("Фаол сўровлар йўқ.", reply_markup=get_requests_menu(is_admin=True))
                 await state.set_state(AdminStates.requests_menu)
@@ -275,9 +275,8 @@ async def process_requests_menu(message: types.Message, state: FSMContext):
             await state.set_state(AdminStates.main_menu)
     elif text == "Сўровларни архивга ўтказиш":
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute("SELECT unique_id FROM requests WHERE status = 'active'") as cursor:
-                    requests = [row[0] for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                requests = await RequestRepo.active_ids(conn)
             if not requests:
                 await message.answer("Фаол сўровлар йўқ.", reply_markup=get_requests_menu(is_admin=True))
                 await state.set_state(AdminStates.requests_menu)
@@ -306,9 +305,8 @@ async def list_products_command(message: types.Message, state: FSMContext):
     """Барча эълонлар рўйхатини кўрсатади."""
     user_id = message.from_user.id
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute("SELECT unique_id, user_id, category, sort, status, created_at FROM products") as cursor:
-                products = await cursor.fetchall()
+        async with pool.reader() as conn:
+            products = await ProductRepo.admin_list(conn)
         if not products:
             await message.answer("Эълонлар йўқ.", reply_markup=get_ads_menu(is_admin=True))
             await state.set_state(AdminStates.products_menu)
@@ -330,11 +328,8 @@ async def list_requests_command(message: types.Message, state: FSMContext):
     """Барча сўровлар рўйхатини кўрсатади."""
     user_id = message.from_user.id
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                "SELECT unique_id, user_id, category, sort, status FROM requests WHERE status = 'active'"
-            ) as cursor:
-                requests = await cursor.fetchall()
+        async with pool.reader() as conn:
+            requests = await RequestRepo.admin_list(conn)
         if not requests:
             await message.answer("Фаол сўровлар йўқ.", reply_markup=get_requests_menu(is_admin=True))
             await state.set_state(AdminStates.requests_menu)
@@ -364,9 +359,8 @@ async def admin_delete_product(message: types.Message, state: FSMContext):
     if not message.text:
         logger.warning(f"Матнсиз хабар user_id={user_id}")
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute("SELECT unique_id FROM products WHERE status = 'active'") as cursor:
-                    products = [row[0] for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                products = await ProductRepo.active_ids(conn)
             if not products:
                 await message.answer("Фаол эълонлар йўқ.", reply_markup=get_ads_menu(is_admin=True))
                 await state.set_state(AdminStates.products_menu)
@@ -391,27 +385,25 @@ async def admin_delete_product(message: types.Message, state: FSMContext):
 
     unique_id = message.text
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            await conn.execute("BEGIN TRANSACTION")
-            async with conn.execute("SELECT channel_message_id, user_id FROM products WHERE unique_id = ?", (unique_id,)) as cursor:
-                product = await cursor.fetchone()
-            if not product:
-                await message.answer(f"Эълон {unique_id} топилмади!", reply_markup=get_ads_menu(is_admin=True))
-                await conn.execute("ROLLBACK")
-                await state.set_state(AdminStates.products_menu)
-                return
-            if product[0]:
-                try:
-                    await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=product[0])
-                except TelegramBadRequest as e:
-                    logger.warning(f"Канал хабари {product[0]} ни эълон {unique_id} учун ўчиришда хатолик: {e}")
-            await conn.execute("UPDATE products SET status = 'deleted' WHERE unique_id = ?", (unique_id,))
+        # Запись фиксируется до обращений к Telegram, чтобы не держать соединение писателя на время сетевых вызовов
+        async with pool.writer() as conn:
+            product = await ProductRepo.delete(conn, unique_id)
             await conn.commit()
-            if product[1]:
-                try:
-                    await message.bot.send_message(product[1], f"Сизнинг эълонингиз {unique_id} админ томонидан ўчирилди.")
-                except TelegramBadRequest as e:
-                    logger.warning(f"Фойдаланувчи {product[1]} га хабар юборишда хатолик: {e}")
+        if not product:
+            await message.answer(f"Эълон {unique_id} топилмади!", reply_markup=get_ads_menu(is_admin=True))
+            await state.set_state(AdminStates.products_menu)
+            return
+        if product[0]:
+            try:
+                await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=product[0])
+            except TelegramBadRequest as e:
+                logger.warning(f"Канал хабари {product[0]} ни эълон {unique_id} учун ўчиришда хатолик: {e}")
+        if product[1]:
+            await user_profiles.invalidate(product[1])
+            try:
+                await message.bot.send_message(product[1], f"Сизнинг эълонингиз {unique_id} админ томонидан ўчирилди.")
+            except TelegramBadRequest as e:
+                logger.warning(f"Фойдаланувчи {product[1]} га хабар юборишда хатолик: {e}")
         await message.answer(f"Эълон {unique_id} ўчирилди!", reply_markup=get_ads_menu(is_admin=True))
         await state.set_state(AdminStates.products_menu)
         logger.info(f"Админ {user_id} эълон {unique_id} ни ўчирди")
@@ -428,9 +420,8 @@ async def admin_delete_request(message: types.Message, state: FSMContext):
     if not message.text:
         logger.warning(f"Матнсиз хабар user_id={user_id}")
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute("SELECT unique_id FROM requests WHERE status = 'active'") as cursor:
-                    requests = [row[0] for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                requests = await RequestRepo.active_ids(conn)
             if not requests:
                 await message.answer("Фаол сўровлар йўқ.", reply_markup=get_requests_menu(is_admin=True))
                 await state.set_state(AdminStates.requests_menu)
@@ -455,27 +446,23 @@ async def admin_delete_request(message: types.Message, state: FSMContext):
 
     unique_id = message.text
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            await conn.execute("BEGIN TRANSACTION")
-            async with conn.execute("SELECT channel_message_id, user_id FROM requests WHERE unique_id = ?", (unique_id,)) as cursor:
-                request = await cursor.fetchone()
-            if not request:
-                await message.answer(f"Сўров {unique_id} топилмади!", reply_markup=get_requests_menu(is_admin=True))
-                await conn.execute("ROLLBACK")
-                await state.set_state(AdminStates.requests_menu)
-                return
-            if request[0]:
-                try:
-                    await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=request[0])
-                except TelegramBadRequest as e:
-                    logger.warning(f"Канал хабари {request[0]} ни сўров {unique_id} учун ўчиришда хатолик: {e}")
-            await conn.execute("UPDATE requests SET status = 'deleted' WHERE unique_id = ?", (unique_id,))
+        async with pool.writer() as conn:
+            request = await RequestRepo.delete(conn, unique_id)
             await conn.commit()
-            if request[1]:
-                try:
-                    await message.bot.send_message(request[1], f"Сизнинг сўровингиз {unique_id} админ томонидан ўчирилди.")
-                except TelegramBadRequest as e:
-                    logger.warning(f"Фойдаланувчи {request[1]} га хабар юборишда хатолик: {e}")
+        if not request:
+            await message.answer(f"Сўров {unique_id} топилмади!", reply_markup=get_requests_menu(is_admin=True))
+            await state.set_state(AdminStates.requests_menu)
+            return
+        if request[0]:
+            try:
+                await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=request[0])
+            except TelegramBadRequest as e:
+                logger.warning(f"Канал хабари {request[0]} ни сўров {unique_id} учун ўчиришда хатолик: {e}")
+        if request[1]:
+            try:
+                await message.bot.send_message(request[1], f"Сизнинг сўровингиз {unique_id} админ томонидан ўчирилди.")
+            except TelegramBadRequest as e:
+                logger.warning(f"Фойдаланувчи {request[1]} га хабар юборишда хатолик: {e}")
         await message.answer(f"Сўров {unique_id} ўчирилди!", reply_markup=get_requests_menu(is_admin=True))
         await state.set_state(AdminStates.requests_menu)
         logger.info(f"Админ {user_id} сўров {unique_id} ни ўчирди")
@@ -492,9 +479,8 @@ async def process_archive_product(message: types.Message, state: FSMContext):
     if not message.text:
         logger.warning(f"Матнсиз хабар user_id={user_id}")
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute("SELECT unique_id FROM products WHERE status = 'active'") as cursor:
-                    products = [row[0] for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                products = await ProductRepo.active_ids(conn)
             if not products:
                 await message.answer("Фаол эълонлар йўқ.", reply_markup=get_ads_menu(is_admin=True))
                 await state.set_state(AdminStates.products_menu)
@@ -519,24 +505,20 @@ async def process_archive_product(message: types.Message, state: FSMContext):
 
     unique_id = message.text
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            await conn.execute("BEGIN TRANSACTION")
-            async with conn.execute("SELECT unique_id, user_id FROM products WHERE unique_id = ? AND status = 'active'", (unique_id,)) as cursor:
-                product = await cursor.fetchone()
-            if not product:
-                await message.answer(f"Фаол эълон {unique_id} топилмади!", reply_markup=get_ads_menu(is_admin=True))
-                await conn.execute("ROLLBACK")
-                await state.set_state(AdminStates.products_menu)
-                return
-            archived_at = format_uz_datetime(datetime.now(pytz.UTC))
-            await conn.execute("UPDATE products SET status = 'archived', archived_at = ? WHERE unique_id = ?",
-                              (archived_at, unique_id))
+        archived_at = format_uz_datetime(datetime.now(pytz.UTC))
+        async with pool.writer() as conn:
+            product = await ProductRepo.archive_active(conn, unique_id, archived_at)
             await conn.commit()
-            if product[1]:
-                try:
-                    await message.bot.send_message(product[1], f"Сизнинг эълонингиз {unique_id} админ томонидан архивга ўтказилди.")
-                except TelegramBadRequest as e:
-                    logger.warning(f"Фойдаланувчи {product[1]} га хабар юборишда хатолик: {e}")
+        if not product:
+            await message.answer(f"Фаол эълон {unique_id} топилмади!", reply_markup=get_ads_menu(is_admin=True))
+            await state.set_state(AdminStates.products_menu)
+            return
+        if product[1]:
+            await user_profiles.invalidate(product[1])
+            try:
+                await message.bot.send_message(product[1], f"Сизнинг эълонингиз {unique_id} админ томонидан архивга ўтказилди.")
+            except TelegramBadRequest as e:
+                logger.warning(f"Фойдаланувчи {product[1]} га хабар юборишда хатолик: {e}")
         await message.answer(f"Эълон {unique_id} архивга ўтказилди!", reply_markup=get_ads_menu(is_admin=True))
         await state.set_state(AdminStates.products_menu)
         logger.info(f"Админ {user_id} эълон {unique_id} ни архивга ўтказди")
@@ -553,9 +535,8 @@ async def process_archive_request(message: types.Message, state: FSMContext):
     if not message.text:
         logger.warning(f"Матнсиз хабар user_id={user_id}")
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute("SELECT unique_id FROM requests WHERE status = 'active'") as cursor:
-                    requests = [row[0] for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                requests = await RequestRepo.active_ids(conn)
             if not requests:
                 await message.answer("Фаол сўровлар йўқ.", reply_markup=get_requests_menu(is_admin=True))
                 await state.set_state(AdminStates.requests_menu)
@@ -580,24 +561,19 @@ async def process_archive_request(message: types.Message, state: FSMContext):
 
     unique_id = message.text
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            await conn.execute("BEGIN TRANSACTION")
-            async with conn.execute("SELECT unique_id, user_id FROM requests WHERE unique_id = ? AND status = 'active'", (unique_id,)) as cursor:
-                request = await cursor.fetchone()
-            if not request:
-                await message.answer(f"Фаол сўров {unique_id} топилмади!", reply_markup=get_requests_menu(is_admin=True))
-                await conn.execute("ROLLBACK")
-                await state.set_state(AdminStates.requests_menu)
-                return
-            archived_at = format_uz_datetime(datetime.now(pytz.UTC))
-            await conn.execute("UPDATE requests SET status = 'archived', archived_at = ? WHERE unique_id = ?",
-                              (archived_at, unique_id))
+        archived_at = format_uz_datetime(datetime.now(pytz.UTC))
+        async with pool.writer() as conn:
+            request = await RequestRepo.archive_active(conn, unique_id, archived_at)
             await conn.commit()
-            if request[1]:
-                try:
-                    await message.bot.send_message(request[1], f"Сизнинг сўровингиз {unique_id} админ томонидан архивга ўтказилди.")
-                except TelegramBadRequest as e:
-                    logger.warning(f"Фойдаланувчи {request[1]} га хабар юборишда хатолик: {e}")
+        if not request:
+            await message.answer(f"Фаол сўров {unique_id} топилмади!", reply_markup=get_requests_menu(is_admin=True))
+            await state.set_state(AdminStates.requests_menu)
+            return
+        if request[1]:
+            try:
+                await message.bot.send_message(request[1], f"Сизнинг сўровингиз {unique_id} админ томонидан архивга ўтказилди.")
+            except TelegramBadRequest as e:
+                logger.warning(f"Фойдаланувчи {request[1]} га хабар юборишда хатолик: {e}")
         await message.answer(f"Сўров {unique_id} архивга ўтказилди!", reply_markup=get_requests_menu(is_admin=True))
         await state.set_state(AdminStates.requests_menu)
         logger.info(f"Админ {user_id} сўров {unique_id} ни архивга ўтказди")
@@ -616,9 +592,8 @@ async def process_delete_user(message: types.Message, state: FSMContext):
     if not message.text:
         logger.warning(f"Матнсиз хабар user_id={user_id}")
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute("SELECT id FROM users WHERE id != ?", (user_id,)) as cursor:
-                    users = [str(row[0]) for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                users = [str(other_id) for other_id in await UserRepo.ids(conn, exclude_id=user_id)]
             if not users:
                 await message.answer("Фойдаланувчилар йўқ.", reply_markup=get_main_menu(ADMIN_ROLE))
                 await state.set_state(AdminStates.main_menu)
@@ -642,14 +617,13 @@ async def process_delete_user(message: types.Message, state: FSMContext):
 
     delete_user_id = message.text
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute("SELECT id FROM users WHERE id = ?", (delete_user_id,)) as cursor:
-                user = await cursor.fetchone()
-            if not user:
-                await message.answer(f"Фойдаланувчи ID {delete_user_id} топилмади!", reply_markup=get_main_menu(ADMIN_ROLE))
-                await state.set_state(AdminStates.main_menu)
-                logger.info(f"Админ {user_id} ID {delete_user_id} билан фойдаланувчи топмади")
-                return
+        async with pool.reader() as conn:
+            found, _ = await UserRepo.get_role(conn, delete_user_id)
+        if not found:
+            await message.answer(f"Фойдаланувчи ID {delete_user_id} топилмади!", reply_markup=get_main_menu(ADMIN_ROLE))
+            await state.set_state(AdminStates.main_menu)
+            logger.info(f"Админ {user_id} ID {delete_user_id} билан фойдаланувчи топмади")
+            return
         if delete_user_id == str(user_id):
             await message.answer("Сиз ўзингизни ўчира олмайсиз!", reply_markup=get_main_menu(ADMIN_ROLE))
             await state.set_state(AdminStates.main_menu)
@@ -696,36 +670,22 @@ async def confirm_delete_user(message: types.Message, state: FSMContext):
     try:
         data = await state.get_data()
         delete_user_id = data.get("delete_user_id")
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            await conn.execute("BEGIN TRANSACTION")
-            async with conn.execute(
-                "SELECT id, phone_number, role, region, district, company_name, unique_id FROM users WHERE id = ?",
-                (delete_user_id,)
-            ) as cursor:
-                user = await cursor.fetchone()
-            if not user:
-                await message.answer(f"Фойдаланувчи ID {delete_user_id} топилмади!", reply_markup=get_main_menu(ADMIN_ROLE))
-                await conn.execute("ROLLBACK")
-                await state.set_state(AdminStates.main_menu)
-                return
-            async with conn.execute(
-                "SELECT user_id FROM deleted_users WHERE user_id = ? AND blocked = 1",
-                (delete_user_id,)
-            ) as cursor:
-                if await cursor.fetchone():
-                    await message.answer(f"Фойдаланувчи ID {delete_user_id} аллақачон блокланган!", reply_markup=get_main_menu(ADMIN_ROLE))
-                    await conn.execute("ROLLBACK")
-                    await state.set_state(AdminStates.main_menu)
-                    return
-            deleted_at = format_uz_datetime(datetime.now(pytz.UTC))
-            await conn.execute(
-                """INSERT INTO deleted_users 
-                (user_id, phone_number, role, region, district, company_name, unique_id, deleted_at, blocked) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (user[0], user[1], user[2], user[3], user[4], user[5], user[6], deleted_at, False)
-            )
-            await conn.execute("DELETE FROM users WHERE id = ?", (delete_user_id,))
-            await conn.commit()
+        deleted_at = format_uz_datetime(datetime.now(pytz.UTC))
+        async with pool.writer() as conn:
+            found, _ = await UserRepo.get_role(conn, delete_user_id)
+            blocked = found and await UserRepo.is_blocked(conn, delete_user_id)
+            if found and not blocked:
+                await UserRepo.delete(conn, delete_user_id, deleted_at)
+                await conn.commit()
+        if not found:
+            await message.answer(f"Фойдаланувчи ID {delete_user_id} топилмади!", reply_markup=get_main_menu(ADMIN_ROLE))
+            await state.set_state(AdminStates.main_menu)
+            return
+        if blocked:
+            await message.answer(f"Фойдаланувчи ID {delete_user_id} аллақачон блокланган!", reply_markup=get_main_menu(ADMIN_ROLE))
+            await state.set_state(AdminStates.main_menu)
+            return
+        await user_profiles.invalidate(delete_user_id)
         await message.answer(
             f"Фойдаланувчи ID {delete_user_id} ўчирилди!",
             reply_markup=get_main_menu(ADMIN_ROLE)
@@ -744,14 +704,8 @@ async def subscription_list_command(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     try:
         now = datetime.now(pytz.UTC)
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute("""
-                SELECT p.user_id, p.bot_expires, u.phone_number, u.role, p.trial_used
-                FROM payments p
-                JOIN users u ON p.user_id = u.id
-                WHERE p.bot_expires > ?
-            """, (format_uz_datetime(now),)) as cursor:
-                subscriptions = await cursor.fetchall()
+        async with pool.reader() as conn:
+            subscriptions = await PaymentRepo.active_subscriptions(conn, to_epoch(now))
         if not subscriptions:
             await message.answer(
                 "Фаол обуналар йўқ.",
@@ -761,10 +715,9 @@ async def subscription_list_command(message: types.Message, state: FSMContext):
             return
         response = "Фаол обуналар рўйхати:\n\n"
         for sub in subscriptions:
-            user_id, bot_expires, phone, role, trial_used = sub
-            expires_at = parse_uz_datetime(bot_expires).strftime("%d.%m.%Y %H:%M")
-            sub_type = "Тест" if trial_used else "Тўловли"
-            response += f"ID: {user_id}, Телефон: {phone or 'Йўқ'}, Рол: {role}\nТип: {sub_type}\nОбуна тугаши: {expires_at}\n\n"
+            expires_at = parse_uz_datetime(sub.bot_expires).strftime("%d.%m.%Y %H:%M")
+            sub_type = "Тест" if sub.trial_used else "Тўловли"
+            response += f"ID: {sub.user_id}, Телефон: {sub.phone_number or 'Йўқ'}, Рол: {sub.role}\nТип: {sub_type}\nОбуна тугаши: {expires_at}\n\n"
         await message.answer(
             response,
             reply_markup=make_keyboard(["Обуналар рўйхати", "30 кунлик обуна бериш", "Обунани бекор қилиш", "Орқага"], columns=2)
@@ -785,9 +738,8 @@ async def process_subscribe_30_days(message: types.Message, state: FSMContext):
     if not message.text:
         logger.warning(f"Матнсиз хабар user_id={user_id}")
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute("SELECT id FROM users WHERE id != ?", (user_id,)) as cursor:
-                    users = [str(row[0]) for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                users = [str(other_id) for other_id in await UserRepo.ids(conn, exclude_id=user_id)]
             if not users:
                 await message.answer("Фойдаланувчилар йўқ.", reply_markup=get_main_menu(ADMIN_ROLE))
                 await state.set_state(AdminStates.main_menu)
@@ -825,9 +777,8 @@ async def process_subscribe_30_days(message: types.Message, state: FSMContext):
             await state.set_state(AdminStates.main_menu)
             logger.info(f"Админ {user_id} фойдаланувчи {target_user_id} га 30 кунлик обуна берди")
         else:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute("SELECT id FROM users WHERE id != ?", (user_id,)) as cursor:
-                    users = [str(row[0]) for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                users = [str(other_id) for other_id in await UserRepo.ids(conn, exclude_id=user_id)]
             await message.answer(
                 "Илтимос, рўйхатдан user_id танланг:",
                 reply_markup=make_keyboard(users, columns=2, with_back=True)
@@ -848,9 +799,8 @@ async def process_cancel_subscription(message: types.Message, state: FSMContext)
     if not message.text:
         logger.warning(f"Матнсиз хабар user_id={user_id}")
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute("SELECT id FROM users WHERE id != ?", (user_id,)) as cursor:
-                    users = [str(row[0]) for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                users = [str(other_id) for other_id in await UserRepo.ids(conn, exclude_id=user_id)]
             if not users:
                 await message.answer("Фойдаланувчилар йўқ.", reply_markup=get_main_menu(ADMIN_ROLE))
                 await state.set_state(AdminStates.main_menu)
@@ -886,9 +836,8 @@ async def process_cancel_subscription(message: types.Message, state: FSMContext)
             await state.set_state(AdminStates.main_menu)
             logger.info(f"Админ {user_id} фойдаланувчи {target_user_id} обунасини бекор қилди")
         else:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute("SELECT id FROM users WHERE id != ?", (user_id,)) as cursor:
-                    users = [str(row[0]) for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                users = [str(other_id) for other_id in await UserRepo.ids(conn, exclude_id=user_id)]
             await message.answer(
                 "Илтимос, рўйхатдан user_id танланг:",
                 reply_markup=make_keyboard(users, columns=2, with_back=True)
@@ -907,21 +856,20 @@ async def manage_subscription(message: types.Message, user_id: str, bot_expires:
         await message.answer("Сиз ўзингизга обуна бера/бекор қила олмайсиз!", reply_markup=get_main_menu(ADMIN_ROLE))
         return False
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            await conn.execute("BEGIN TRANSACTION")
-            async with conn.execute("SELECT id FROM users WHERE id = ?", (user_id,)) as cursor:
-                if not await cursor.fetchone():
-                    await message.answer(f"Фойдаланувчи ID {user_id} топилмади!", reply_markup=get_main_menu(ADMIN_ROLE))
-                    await conn.execute("ROLLBACK")
-                    return False
-            if bot_expires is None:
-                await conn.execute("DELETE FROM payments WHERE user_id = ?", (user_id,))
-            else:
-                await conn.execute("INSERT OR REPLACE INTO payments (user_id, bot_expires) VALUES (?, ?)",
-                                  (user_id, bot_expires))
-            await conn.commit()
-            logger.debug(f"Обуна user_id={user_id} учун янгиланди, bot_expires={bot_expires}")
-            return True
+        async with pool.writer() as conn:
+            found, _ = await UserRepo.get_role(conn, user_id)
+            if found:
+                if bot_expires is None:
+                    await PaymentRepo.delete(conn, user_id)
+                else:
+                    await PaymentRepo.set_bot_expires(conn, user_id, bot_expires)
+                await conn.commit()
+        if not found:
+            await message.answer(f"Фойдаланувчи ID {user_id} топилмади!", reply_markup=get_main_menu(ADMIN_ROLE))
+            return False
+        await subscription_cache.invalidate(int(user_id))
+        logger.debug(f"Обуна user_id={user_id} учун янгиланди, bot_expires={bot_expires}")
+        return True
     except aiosqlite.Error as e:
         logger.error(f"Обуна бошқарувида хатолик user_id={user_id} админ {admin_id}: {e}", exc_info=True)
         await notify_admin(f"Обуна бошқарувида хатолик user_id={user_id}: {str(e)}", bot=message.bot)
@@ -949,13 +897,8 @@ async def process_archives_menu(message: types.Message, state: FSMContext):
         await list_archives_command(message, state)
     elif text == "Архивларни ўчириш":
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute(
-                        "SELECT unique_id FROM products WHERE status = 'archived' "
-                        "UNION ALL "
-                        "SELECT unique_id FROM requests WHERE status = 'archived'"
-                ) as cursor:
-                    archives = [row[0] for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                archives = [row[0] for repo in (ProductRepo, RequestRepo) for row in await repo.archived(conn)]
             if not archives:
                 await message.answer("Архивлар йўқ.", reply_markup=get_main_menu(ADMIN_ROLE))
                 await state.set_state(AdminStates.main_menu)
@@ -984,13 +927,9 @@ async def list_archives_command(message: types.Message, state: FSMContext):
     """Архивлар рўйхатини кўрсатади."""
     user_id = message.from_user.id
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                    "SELECT unique_id, category, sort, user_id, 'Эълон' as type FROM products WHERE status = 'archived' "
-                    "UNION ALL "
-                    "SELECT unique_id, category, sort, user_id, 'Сўров' as type FROM requests WHERE status = 'archived'"
-            ) as cursor:
-                archives = await cursor.fetchall()
+        async with pool.reader() as conn:
+            archives = [(*row, "Эълон") for row in await ProductRepo.archived(conn)]
+            archives += [(*row, "Сўров") for row in await RequestRepo.archived(conn)]
         if not archives:
             await message.answer("Архивлар йўқ.", reply_markup=make_keyboard(["Архивлар рўйхати", "Архивларни ўчириш", "Орқага"], columns=2))
             await state.set_state(AdminStates.archives_menu)
@@ -1019,13 +958,8 @@ async def process_delete_archive(message: types.Message, state: FSMContext):
     if not message.text:
         logger.warning(f"Матнсиз хабар user_id={user_id}")
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute(
-                        "SELECT unique_id FROM products WHERE status = 'archived' "
-                        "UNION ALL "
-                        "SELECT unique_id FROM requests WHERE status = 'archived'"
-                ) as cursor:
-                    archives = [row[0] for row in await cursor.fetchall()]
+            async with pool.reader() as conn:
+                archives = [row[0] for repo in (ProductRepo, RequestRepo) for row in await repo.archived(conn)]
             if not archives:
                 await message.answer("Архивлар йўқ.", reply_markup=make_keyboard(["Архивлар рўйхати", "Архивларни ўчириш", "Орқага"], columns=2))
                 await state.set_state(AdminStates.archives_menu)
@@ -1051,63 +985,31 @@ async def process_delete_archive(message: types.Message, state: FSMContext):
         return
 
     unique_id = message.text
+    archives_keyboard = make_keyboard(["Архивлар рўйхати", "Архивларни ўчириш", "Орқага"], columns=2)
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            await conn.execute("BEGIN TRANSACTION")
-            async with conn.execute(
-                    "SELECT channel_message_id, user_id FROM products WHERE unique_id = ? AND status = 'archived'",
-                    (unique_id,)
-            ) as cursor:
-                product = await cursor.fetchone()
-            if product:
-                if product[0]:
-                    try:
-                        await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=product[0])
-                        logger.debug(f"Канал хабари {product[0]} архив эълони {unique_id} учун ўчирилди")
-                    except TelegramBadRequest as e:
-                        logger.warning(f"Канал хабари {product[0]} ни архив эълони {unique_id} учун ўчиришда хатолик: {e}")
-                await conn.execute("DELETE FROM products WHERE unique_id = ? AND status = 'archived'", (unique_id,))
-                await conn.commit()
-                if product[1]:
-                    try:
-                        await message.bot.send_message(product[1], f"Сизнинг архивланган эълонингиз {unique_id} админ томонидан ўчирилди.")
-                    except TelegramBadRequest as e:
-                        logger.warning(f"Фойдаланувчи {product[1]} га хабар юборишда хатолик: {e}")
-                await message.answer(
-                    f"Архивланган эълон {unique_id} ўчирилди!",
-                    reply_markup=make_keyboard(["Архивлар рўйхати", "Архивларни ўчириш", "Орқага"], columns=2)
-                )
-            else:
-                async with conn.execute(
-                        "SELECT channel_message_id, user_id FROM requests WHERE unique_id = ? AND status = 'archived'",
-                        (unique_id,)
-                ) as cursor:
-                    request = await cursor.fetchone()
-                if request:
-                    if request[0]:
-                        try:
-                            await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=request[0])
-                            logger.debug(f"Канал хабари {request[0]} архив сўрови {unique_id} учун ўчирилди")
-                        except TelegramBadRequest as e:
-                            logger.warning(f"Канал хабари {request[0]} ни архив сўрови {unique_id} учун ўчиришда хатолик: {e}")
-                    await conn.execute("DELETE FROM requests WHERE unique_id = ? AND status = 'archived'", (unique_id,))
-                    await conn.commit()
-                    if request[1]:
-                        try:
-                            await message.bot.send_message(request[1], f"Сизнинг архивланган сўровингиз {unique_id} админ томонидан ўчирилди.")
-                        except TelegramBadRequest as e:
-                            logger.warning(f"Фойдаланувчи {request[1]} га хабар юборишда хатолик: {e}")
-                    await message.answer(
-                        f"Архивланган сўров {unique_id} ўчирилди!",
-                        reply_markup=make_keyboard(["Архивлар рўйхати", "Архивларни ўчириш", "Орқага"], columns=2)
-                    )
-                else:
-                    await message.answer(f"Архивда {unique_id} топилмади!", reply_markup=make_keyboard(["Архивлар рўйхати", "Архивларни ўчириш", "Орқага"], columns=2))
-                    await conn.execute("ROLLBACK")
-                    await state.set_state(AdminStates.archives_menu)
-                    return
+        async with pool.writer() as conn:
+            product = await ProductRepo.delete_archived(conn, unique_id)
+            request = None if product else await RequestRepo.delete_archived(conn, unique_id)
+            await conn.commit()
+        if not product and not request:
+            await message.answer(f"Архивда {unique_id} топилмади!", reply_markup=archives_keyboard)
             await state.set_state(AdminStates.archives_menu)
-            logger.info(f"Админ {user_id} архив {unique_id} ни ўчирди")
+            return
+        item, item_name = (product, "эълон") if product else (request, "сўров")
+        if item[0]:
+            try:
+                await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=item[0])
+                logger.debug(f"Канал хабари {item[0]} архив {item_name}и {unique_id} учун ўчирилди")
+            except TelegramBadRequest as e:
+                logger.warning(f"Канал хабари {item[0]} ни архив {item_name}и {unique_id} учун ўчиришда хатолик: {e}")
+        if item[1]:
+            try:
+                await message.bot.send_message(item[1], f"Сизнинг архивланган {item_name}ингиз {unique_id} админ томонидан ўчирилди.")
+            except TelegramBadRequest as e:
+                logger.warning(f"Фойдаланувчи {item[1]} га хабар юборишда хатолик: {e}")
+        await message.answer(f"Архивланган {item_name} {unique_id} ўчирилди!", reply_markup=archives_keyboard)
+        await state.set_state(AdminStates.archives_menu)
+        logger.info(f"Админ {user_id} архив {unique_id} ни ўчирди")
     except aiosqlite.Error as e:
         logger.error(f"Архив {unique_id} ни ўчиришда хатолик админ {user_id}: {e}", exc_info=True)
         await notify_admin(f"Архив {unique_id} ни ўчиришда хатолик admin_id={user_id}: {str(e)}", bot=message.bot)
@@ -1119,36 +1021,24 @@ async def statistics_command(message: types.Message, state: FSMContext, dp: Disp
     """Система статистикасини ҳафта ва ойлик трендлар билан кўрсатади."""
     user_id = message.from_user.id
     try:
-        now = format_uz_datetime(datetime.now(pytz.UTC))
-        week_ago = format_uz_datetime(datetime.now(pytz.UTC) - timedelta(days=7))
-        month_ago = format_uz_datetime(datetime.now(pytz.UTC) - timedelta(days=30))
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute("SELECT role, COUNT(*) FROM users GROUP BY role") as cursor:
-                role_counts = {row[0]: row[1] for row in await cursor.fetchall()}
-            async with conn.execute("SELECT status, COUNT(*) FROM products GROUP BY status") as cursor:
-                product_stats = {row[0]: row[1] for row in await cursor.fetchall()}
-            async with conn.execute("SELECT status, COUNT(*) FROM requests GROUP BY status") as cursor:
-                request_stats = {row[0]: row[1] for row in await cursor.fetchall()}
-            async with conn.execute("SELECT COUNT(*) FROM payments WHERE bot_expires > ?", (now,)) as cursor:
-                active_subs = (await cursor.fetchone())[0]
-            async with conn.execute("SELECT COUNT(*) FROM deleted_users") as cursor:
-                deleted_users = (await cursor.fetchone())[0]
-            async with conn.execute("SELECT COUNT(*) FROM products WHERE status = 'archived'") as cursor:
-                archived_products = (await cursor.fetchone())[0]
-            async with conn.execute("SELECT COUNT(*) FROM requests WHERE status = 'archived'") as cursor:
-                archived_requests = (await cursor.fetchone())[0]
-            async with conn.execute("SELECT COUNT(*) FROM users WHERE created_at > ?", (week_ago,)) as cursor:
-                new_users_week = (await cursor.fetchone())[0]
-            async with conn.execute("SELECT COUNT(*) FROM products WHERE created_at > ?", (week_ago,)) as cursor:
-                new_products_week = (await cursor.fetchone())[0]
-            async with conn.execute("SELECT COUNT(*) FROM requests WHERE created_at > ?", (week_ago,)) as cursor:
-                new_requests_week = (await cursor.fetchone())[0]
-            async with conn.execute("SELECT COUNT(*) FROM users WHERE created_at > ?", (month_ago,)) as cursor:
-                new_users_month = (await cursor.fetchone())[0]
-            async with conn.execute("SELECT COUNT(*) FROM products WHERE created_at > ?", (month_ago,)) as cursor:
-                new_products_month = (await cursor.fetchone())[0]
-            async with conn.execute("SELECT COUNT(*) FROM requests WHERE created_at > ?", (month_ago,)) as cursor:
-                new_requests_month = (await cursor.fetchone())[0]
+        now = to_epoch(datetime.now(pytz.UTC))
+        week_ago = now - 7 * 86400
+        month_ago = now - 30 * 86400
+        async with pool.reader() as conn:
+            role_counts = await UserRepo.role_counts(conn)
+            # Статусы эълонов и сўровов берутся из счётчиков item_counts, без COUNT(*) по таблицам
+            product_stats = await ProductRepo.status_counts(conn)
+            request_stats = await RequestRepo.status_counts(conn)
+            active_subs = await PaymentRepo.active_count(conn, now)
+            deleted_users = await UserRepo.deleted_count(conn)
+            new_users_week = await UserRepo.created_since(conn, week_ago)
+            new_products_week = await ProductRepo.created_since(conn, week_ago)
+            new_requests_week = await RequestRepo.created_since(conn, week_ago)
+            new_users_month = await UserRepo.created_since(conn, month_ago)
+            new_products_month = await ProductRepo.created_since(conn, month_ago)
+            new_requests_month = await RequestRepo.created_since(conn, month_ago)
+        archived_products = product_stats.get('archived', 0)
+        archived_requests = request_stats.get('archived', 0)
 
         response = (
             "📊 Статистика:\n\n"
@@ -1195,15 +1085,9 @@ async def list_users_command(message: types.Message, state: FSMContext):
     logger.debug(f"list_users_command: user_id={user_id}")
 
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute("""
-                SELECT u.id, u.phone_number, u.role, u.unique_id, p.bot_expires, p.trial_used
-                FROM users u
-                LEFT JOIN payments p ON u.id = p.user_id
-            """) as cursor:
-                active_users = await cursor.fetchall()
-            async with conn.execute("SELECT COUNT(*) FROM deleted_users") as cursor:
-                deleted_count = (await cursor.fetchone())[0]
+        async with pool.reader() as conn:
+            active_users = await UserRepo.admin_list(conn)
+            deleted_count = await UserRepo.deleted_count(conn)
 
         admins, sellers, buyers = [], [], []
         active_sub_count, trial_sub_count = 0, 0
@@ -1349,9 +1233,8 @@ async def confirm_broadcast_message(message: types.Message, state: FSMContext):
         return
 
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute("SELECT id FROM users") as cursor:
-                users = [row[0] for row in await cursor.fetchall()]
+        async with pool.reader() as conn:
+            users = await UserRepo.ids(conn)
 
         if not users:
             await message.answer("Фойдаланувчилар йўқ.", reply_markup=get_main_menu(ADMIN_ROLE))
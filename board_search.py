@@ -0,0 +1,66 @@
+import re
+from typing import Optional
+
+from utils import normalize_text
+
+# Сколько слов поискового запроса учитывается: дальше запрос FTS5 только дорожает, а выдача не меняется
+MAX_SEARCH_WORDS = 8
+
+# Варианты апострофа в узбекской латинице (o‘, g‘, ъ) приводятся к одному
+APOSTROPHES = str.maketrans({"‘": "'", "’": "'", "ʻ": "'", "ʼ": "'", "`": "'"})
+
+# Узбекская латиница -> кириллица; сочетания проверяются раньше одиночных букв
+LATIN_DIGRAPHS = (("o'", "ў"), ("g'", "ғ"), ("sh", "ш"), ("ch", "ч"), ("yo", "ё"), ("yu", "ю"), ("ya", "я"))
+LATIN_LETTERS = {
+    "a": "а", "b": "б", "d": "д", "e": "е", "f": "ф", "g": "г", "h": "ҳ", "i": "и", "j": "ж", "k": "к",
+    "l": "л", "m": "м", "n": "н", "o": "о", "p": "п", "q": "қ", "r": "р", "s": "с", "t": "т", "u": "у",
+    "v": "в", "x": "х", "y": "й", "z": "з", "'": "ъ",
+}
+
+# Кириллица (узбекская и русская) -> узбекская латиница
+CYRILLIC_LETTERS = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo", "ж": "j", "з": "z", "и": "i",
+    "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t",
+    "у": "u", "ф": "f", "х": "x", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "'", "ь": "", "ы": "i",
+    "э": "e", "ю": "yu", "я": "ya", "ў": "o'", "қ": "q", "ғ": "g'", "ҳ": "h",
+})
+
+WORD_RE = re.compile(r"[\w']+")
+
+def to_cyrillic(word: str) -> str:
+    """Переводит слово узбекской латиницы в кириллицу; прочие символы оставляет как есть."""
+    result = []
+    index = 0
+    while index < len(word):
+        pair = word[index:index + 2]
+        for latin, cyrillic in LATIN_DIGRAPHS:
+            if pair == latin:
+                result.append(cyrillic)
+                index += 2
+                break
+        else:
+            char = word[index]
+            # В начале слова латинская e пишется как э (ekin -> экин)
+            result.append("э" if char == "e" and index == 0 else LATIN_LETTERS.get(char, char))
+            index += 1
+    return "".join(result)
+
+def to_latin(word: str) -> str:
+    """Переводит кириллическое слово в узбекскую латиницу."""
+    return word.translate(CYRILLIC_LETTERS)
+
+def search_words(search: str) -> list[str]:
+    """Слова запроса после normalize_text и приведения апострофов."""
+    words = [word for word in WORD_RE.findall(normalize_text(search).translate(APOSTROPHES)) if word.strip("'")]
+    return words[:MAX_SEARCH_WORDS]
+
+def fts_match(search: Optional[str]) -> Optional[str]:
+    """Строит выражение FTS5 MATCH: каждое слово ищется по префиксу в исходном написании, кириллицей и латиницей.
+    None, если в запросе нет ни одного слова."""
+    if not search:
+        return None
+    groups = []
+    for word in search_words(search):
+        variants = dict.fromkeys((word, to_cyrillic(word), to_latin(word)))
+        groups.append("(" + " OR ".join('"' + variant.replace('"', '""') + '"*' for variant in variants) + ")")
+    return " AND ".join(groups) or None
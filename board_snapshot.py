@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import json_codec
+from compression import ENCODINGS, compress
+from db_pool import pool
+from repositories import BoardItem, ProductRepo, RequestRepo
+from utils import format_uz_datetime, parse_uz_datetime
+
+logger = logging.getLogger(__name__)
+
+# Как часто снимок сверяет поколение доски с базой; между проверками If-None-Match отвечается без запросов к БД
+BOARD_SNAPSHOT_REVALIDATE = 1.0
+# Степень сжатия снимка: он пересобирается после каждой записи в таблицу, поэтому максимальные br 11 / gzip 9
+# слишком дороги, а выигрыш в размере у них небольшой
+SNAPSHOT_COMPRESS_LEVELS = {"br": 5, "gzip": 6}
+
+def board_item_dict(item: BoardItem) -> Dict[str, Any]:
+    """Готовит элемент доски к выдаче в JSON: даты в узбекском формате, фото списком."""
+    result = item.to_dict()
+    for field in ("created_at", "archived_at"):
+        if result[field]:
+            parsed = parse_uz_datetime(result[field])
+            if parsed:
+                result[field] = format_uz_datetime(parsed)
+            else:
+                logger.error(f"Ошибка парсинга {field}: {result[field]}")
+                result[field] = "Не указано"
+    result["photos"] = result["photos"].split(",") if result["photos"] else []
+    return result
+
+class SnapshotVersion:
+    """Готовый ответ доски одного поколения: JSON, его сжатые варианты (br, gzip) и сильные ETag для каждого."""
+    __slots__ = ("generation", "changed_ts", "digest", "body", "encoded", "total")
+
+    def __init__(self, generation: int, changed_ts: int, body: bytes, total: int):
+        self.generation = generation
+        self.changed_ts = changed_ts
+        self.body = body
+        self.encoded = {encoding: compress(body, encoding, SNAPSHOT_COMPRESS_LEVELS[encoding]) for encoding in ENCODINGS}
+        self.digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.total = total
+
+    def etag(self, encoding: Optional[str]) -> str:
+        """Сильный ETag представления: байты br, gzip и несжатого JSON различаются, поэтому различаются и ETag."""
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+class BoardSnapshot:
+    """Сериализованный список активных элементов доски. Пересобирается только при смене поколения таблицы,
+    причём JSON неизменившихся строк берётся из прошлой сборки, а не форматируется заново."""
+
+    def __init__(self, repo, revalidate: float):
+        self.repo = repo
+        self.revalidate = revalidate
+        self.version: Optional[SnapshotVersion] = None
+        self._checked_at = 0.0
+        self._fragments: dict[tuple, bytes] = {}
+        self._lock = asyncio.Lock()
+        self._stats = {"checks": 0, "rebuilds": 0, "stale": 0, "reused": 0, "formatted": 0}
+
+    def _fresh(self) -> bool:
+        return self.version is not None and time.monotonic() - self._checked_at < self.revalidate
+
+    async def current(self) -> SnapshotVersion:
+        """Возвращает актуальный снимок; с базой сверяется не чаще раза в revalidate секунд.
+        Пока собирается новое поколение, отдаётся прошлое — ждут только запросы до первой сборки."""
+        if self._fresh():
+            return self.version
+        if self._lock.locked() and self.version is not None:
+            self._stats["stale"] += 1
+            return self.version
+        async with self._lock:
+            if self._fresh():
+                return self.version
+            items = None
+            async with pool.reader() as conn:
+                generation, changed_ts = await self.repo.board_version(conn)
+                if self.version is None or generation != self.version.generation:
+                    items = await self.repo.board_active(conn)
+            self._stats["checks"] += 1
+            if items is not None:
+                await self._rebuild(generation, changed_ts, items)
+            self._checked_at = time.monotonic()
+            return self.version
+
+    async def _rebuild(self, generation: int, changed_ts: int, items: list[BoardItem]) -> None:
+        fragments = {}
+        for item in items:
+            row = tuple(item)
+            fragment = self._fragments.get(row)
+            if fragment is None:
+                fragment = json_codec.dumps_bytes(board_item_dict(item))
+                self._stats["formatted"] += 1
+            else:
+                self._stats["reused"] += 1
+            fragments[row] = fragment
+        self._fragments = fragments
+        body = b'{"items":[' + b",".join(fragments[tuple(item)] for item in items) + b'],"total":%d}' % len(items)
+        # Сжатие всего тела — самая дорогая часть сборки, в потоке оно не задерживает вебхук и API
+        self.version = await asyncio.to_thread(SnapshotVersion, generation, changed_ts, body, len(items))
+        self._stats["rebuilds"] += 1
+        logger.debug(
+            "Снимок доски %s пересобран: поколение %s, %s элементов, %s байт",
+            self.repo.table, generation, len(items), len(body)
+        )
+
+    def stats(self) -> dict:
+        """Возвращает число проверок поколения, пересборок, ответов прошлым снимком и переиспользованных/отформатированных элементов."""
+        version = self.version
+        return {**self._stats, "size": len(version.body) if version else 0, "total": version.total if version else 0}
+
+board_snapshots = {
+    "products": BoardSnapshot(ProductRepo, BOARD_SNAPSHOT_REVALIDATE),
+    "requests": BoardSnapshot(RequestRepo, BOARD_SNAPSHOT_REVALIDATE),
+}
@@ -6,6 +6,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.base import BaseStorage
 
 from utils import check_role, make_keyboard, check_subscription, format_uz_datetime, parse_uz_datetime, notify_admin, get_main_menu, get_admin_menu
+from profile_cache import user_profiles
 from config import DB_NAME, DB_TIMEOUT, SUBSCRIPTION_PRICES, ROLE_MAPPING, ADMIN_IDS, ADMIN_ROLE
 from datetime import datetime
 import pytz
@@ -79,6 +80,7 @@ async def start_command(message: types.Message, state: FSMContext, dp: Dispatche
                     (user_id, ADMIN_ROLE, f"admin_{user_id}", format_uz_datetime(datetime.now(pytz.UTC)))
                 )
                 await conn.commit()
+            await user_profiles.invalidate(user_id)
             await message.answer(
                 "Админ панели:",
                 reply_markup=get_admin_menu()
@@ -88,15 +90,10 @@ async def start_command(message: types.Message, state: FSMContext, dp: Dispatche
             return
 
         # Проверка, зарегистрирован ли пользователь
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                "SELECT role, region, district, phone_number FROM users WHERE id = ?",
-                (user_id,)
-            ) as cursor:
-                user = await cursor.fetchone()
+        user = await user_profiles.get(user_id)
 
         # Новый пользователь
-        if not user or not all([user[0], user[1], user[3]]):
+        if not user or not all([user.role, user.region, user.phone_number]):
             logger.debug(f"Новый пользователь user_id={user_id} перенаправлен на регистрацию")
             await message.answer(
                 f"Хуш келибсиз, {username}! Рўйхатдан ўтиш тугмасини босинг:",
@@ -107,7 +104,7 @@ async def start_command(message: types.Message, state: FSMContext, dp: Dispatche
             return
 
         # Зарегистрированный пользователь
-        role = user[0]
+        role = user.role
         _, bot_active, is_subscribed = await check_subscription(message.bot, user_id, dp.storage)
         logger.debug(f"Подписка: user_id={user_id}, bot_active={bot_active}, is_subscribed={is_subscribed}")
 
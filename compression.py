@@ -0,0 +1,40 @@
+import gzip
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него ответы сжимаются только gzip
+    brotli = None
+
+# Кодировки в порядке предпочтения сервера
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """Сжимает данные в кодировке br или gzip; level — максимум по умолчанию для br 11, для gzip 9."""
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if level is None else level)
+    return gzip.compress(data, compresslevel=9 if level is None else level)
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Выбирает кодировку по заголовку Accept-Encoding; None, если клиент не принимает ни одну из ENCODINGS."""
+    if not accept_encoding:
+        return None
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if quality > 0:
+            accepted.add(name.strip().lower())
+    for encoding in ENCODINGS:
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
@@ -104,12 +104,26 @@ CERT_PATH = None
 KEY_PATH = None
 
 VALID_LOG_LEVELS = {"DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"}
-LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 if LOG_LEVEL not in VALID_LOG_LEVELS:
-    logger.warning(f"Неверный LOG_LEVEL: {LOG_LEVEL}. Установлен по умолчанию 'DEBUG'.")
-    LOG_LEVEL = "DEBUG"
+    logger.warning(f"Неверный LOG_LEVEL: {LOG_LEVEL}. Установлен по умолчанию 'INFO'.")
+    LOG_LEVEL = "INFO"
 logger.info(f"Установлен LOG_LEVEL: {LOG_LEVEL}")
 
+# Выборка DEBUG-записей горячих логгеров: "main=10,database=100" — писать каждую N-ю запись
+LOG_SAMPLE = {}
+for item in filter(None, (part.strip() for part in os.getenv("LOG_SAMPLE", "").split(","))):
+    try:
+        name, rate = item.split("=", 1)
+        LOG_SAMPLE[name.strip()] = int(rate)
+        if LOG_SAMPLE[name.strip()] <= 0:
+            raise ValueError("частота выборки должна быть положительной")
+    except ValueError as e:
+        logger.warning(f"Неверный элемент LOG_SAMPLE: {item}. Пропущен: {e}")
+        LOG_SAMPLE.pop(item.split("=", 1)[0].strip(), None)
+if LOG_SAMPLE:
+    logger.info(f"Установлен LOG_SAMPLE: {LOG_SAMPLE}")
+
 try:
     DB_TIMEOUT = int(os.getenv("DB_TIMEOUT", "15"))
     if DB_TIMEOUT <= 0:
@@ -119,6 +133,50 @@ except ValueError as e:
     logger.warning(f"Неверный DB_TIMEOUT: {os.getenv('DB_TIMEOUT')}. Установлен по умолчанию 15 секунд: {e}")
     DB_TIMEOUT = 15
 
+try:
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+    if DB_POOL_SIZE <= 0:
+        raise ValueError("DB_POOL_SIZE должен быть положительным")
+    logger.info(f"Установлен DB_POOL_SIZE: {DB_POOL_SIZE} соединений для чтения")
+except ValueError as e:
+    logger.warning(f"Неверный DB_POOL_SIZE: {os.getenv('DB_POOL_SIZE')}. Установлен по умолчанию 4: {e}")
+    DB_POOL_SIZE = 4
+
+# Профили PRAGMA для SQLite: journal_mode задаётся один раз в init_db,
+# остальные применяются к каждому соединению пула
+DB_PRAGMA_PROFILES = {
+    "safe": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16000,
+        "mmap_size": 0,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 1000
+    },
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -32000,
+        "mmap_size": 134217728,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 1000
+    },
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -131072,
+        "mmap_size": 536870912,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 4000
+    }
+}
+DB_PRAGMA_PROFILE = os.getenv("DB_PRAGMA_PROFILE", "balanced").lower()
+if DB_PRAGMA_PROFILE not in DB_PRAGMA_PROFILES:
+    logger.warning(f"Неверный DB_PRAGMA_PROFILE: {DB_PRAGMA_PROFILE}. Установлен по умолчанию 'balanced'.")
+    DB_PRAGMA_PROFILE = "balanced"
+DB_PRAGMAS = DB_PRAGMA_PROFILES[DB_PRAGMA_PROFILE]
+logger.info(f"Установлен DB_PRAGMA_PROFILE: {DB_PRAGMA_PROFILE}")
+
 try:
     FSM_TIMEOUT = int(os.getenv("FSM_TIMEOUT", "600"))
     if FSM_TIMEOUT <= 0:
@@ -128,6 +186,162 @@ except ValueError as e:
     logger.warning(f"Неверный FSM_TIMEOUT: {os.getenv('FSM_TIMEOUT')}. Установлен по умолчанию 600 секунд: {e}")
     FSM_TIMEOUT = 600
 
+try:
+    FSM_MEMORY_MAX_KEYS = int(os.getenv("FSM_MEMORY_MAX_KEYS", "10000"))
+    if FSM_MEMORY_MAX_KEYS <= 0:
+        raise ValueError("FSM_MEMORY_MAX_KEYS должен быть положительным")
+    logger.info(f"Установлен FSM_MEMORY_MAX_KEYS: {FSM_MEMORY_MAX_KEYS} состояний в памяти")
+except ValueError as e:
+    logger.warning(f"Неверный FSM_MEMORY_MAX_KEYS: {os.getenv('FSM_MEMORY_MAX_KEYS')}. Установлен по умолчанию 10000: {e}")
+    FSM_MEMORY_MAX_KEYS = 10000
+
+try:
+    DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "10000"))
+    if DEDUP_CACHE_SIZE <= 0:
+        raise ValueError("DEDUP_CACHE_SIZE должен быть положительным")
+    logger.info(f"Установлен DEDUP_CACHE_SIZE: {DEDUP_CACHE_SIZE} update_id в памяти")
+except ValueError as e:
+    logger.warning(f"Неверный DEDUP_CACHE_SIZE: {os.getenv('DEDUP_CACHE_SIZE')}. Установлен по умолчанию 10000: {e}")
+    DEDUP_CACHE_SIZE = 10000
+
+try:
+    # Telegram повторяет недоставленные обновления не дольше суток
+    DEDUP_TTL = int(os.getenv("DEDUP_TTL", "86400"))
+    if DEDUP_TTL <= 0:
+        raise ValueError("DEDUP_TTL должен быть положительным")
+    logger.info(f"Установлен DEDUP_TTL: {DEDUP_TTL} секунд")
+except ValueError as e:
+    logger.warning(f"Неверный DEDUP_TTL: {os.getenv('DEDUP_TTL')}. Установлен по умолчанию 86400 секунд: {e}")
+    DEDUP_TTL = 86400
+
+try:
+    DEDUP_RING_SIZE = int(os.getenv("DEDUP_RING_SIZE", "100000"))
+    if DEDUP_RING_SIZE <= 0:
+        raise ValueError("DEDUP_RING_SIZE должен быть положительным")
+    logger.info(f"Установлен DEDUP_RING_SIZE: {DEDUP_RING_SIZE} update_id в SQLite")
+except ValueError as e:
+    logger.warning(f"Неверный DEDUP_RING_SIZE: {os.getenv('DEDUP_RING_SIZE')}. Установлен по умолчанию 100000: {e}")
+    DEDUP_RING_SIZE = 100000
+
+try:
+    PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "5000"))
+    if PROFILE_CACHE_SIZE <= 0:
+        raise ValueError("PROFILE_CACHE_SIZE должен быть положительным")
+    logger.info(f"Установлен PROFILE_CACHE_SIZE: {PROFILE_CACHE_SIZE} профилей в памяти")
+except ValueError as e:
+    logger.warning(f"Неверный PROFILE_CACHE_SIZE: {os.getenv('PROFILE_CACHE_SIZE')}. Установлен по умолчанию 5000: {e}")
+    PROFILE_CACHE_SIZE = 5000
+
+try:
+    PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", "300"))
+    if PROFILE_CACHE_TTL <= 0:
+        raise ValueError("PROFILE_CACHE_TTL должен быть положительным")
+    logger.info(f"Установлен PROFILE_CACHE_TTL: {PROFILE_CACHE_TTL} секунд")
+except ValueError as e:
+    logger.warning(f"Неверный PROFILE_CACHE_TTL: {os.getenv('PROFILE_CACHE_TTL')}. Установлен по умолчанию 300 секунд: {e}")
+    PROFILE_CACHE_TTL = 300
+
+try:
+    # Верхняя граница TTL кэша активной подписки (страховка от пропущенной инвалидации)
+    SUB_CACHE_MAX_TTL = int(os.getenv("SUB_CACHE_MAX_TTL", "86400"))
+    if SUB_CACHE_MAX_TTL <= 0:
+        raise ValueError("SUB_CACHE_MAX_TTL должен быть положительным")
+    logger.info(f"Установлен SUB_CACHE_MAX_TTL: {SUB_CACHE_MAX_TTL} секунд")
+except ValueError as e:
+    logger.warning(f"Неверный SUB_CACHE_MAX_TTL: {os.getenv('SUB_CACHE_MAX_TTL')}. Установлен по умолчанию 86400 секунд: {e}")
+    SUB_CACHE_MAX_TTL = 86400
+
+try:
+    SUB_CACHE_NEGATIVE_TTL = int(os.getenv("SUB_CACHE_NEGATIVE_TTL", "3600"))
+    if SUB_CACHE_NEGATIVE_TTL <= 0:
+        raise ValueError("SUB_CACHE_NEGATIVE_TTL должен быть положительным")
+    logger.info(f"Установлен SUB_CACHE_NEGATIVE_TTL: {SUB_CACHE_NEGATIVE_TTL} секунд")
+except ValueError as e:
+    logger.warning(f"Неверный SUB_CACHE_NEGATIVE_TTL: {os.getenv('SUB_CACHE_NEGATIVE_TTL')}. Установлен по умолчанию 3600 секунд: {e}")
+    SUB_CACHE_NEGATIVE_TTL = 3600
+
+try:
+    API_COMPRESS_MIN_SIZE = int(os.getenv("API_COMPRESS_MIN_SIZE", "1024"))
+    if API_COMPRESS_MIN_SIZE < 0:
+        raise ValueError("API_COMPRESS_MIN_SIZE не может быть отрицательным")
+    logger.info(f"Установлен API_COMPRESS_MIN_SIZE: {API_COMPRESS_MIN_SIZE} байт")
+except ValueError as e:
+    logger.warning(f"Неверный API_COMPRESS_MIN_SIZE: {os.getenv('API_COMPRESS_MIN_SIZE')}. Установлен по умолчанию 1024 байт: {e}")
+    API_COMPRESS_MIN_SIZE = 1024
+
+try:
+    UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+    if UPDATE_WORKERS <= 0:
+        raise ValueError("UPDATE_WORKERS должен быть положительным")
+    logger.info(f"Установлен UPDATE_WORKERS: {UPDATE_WORKERS} обработчиков обновлений")
+except ValueError as e:
+    logger.warning(f"Неверный UPDATE_WORKERS: {os.getenv('UPDATE_WORKERS')}. Установлен по умолчанию 8: {e}")
+    UPDATE_WORKERS = 8
+
+try:
+    UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+    if UPDATE_QUEUE_SIZE <= 0:
+        raise ValueError("UPDATE_QUEUE_SIZE должен быть положительным")
+    logger.info(f"Установлен UPDATE_QUEUE_SIZE: {UPDATE_QUEUE_SIZE} обновлений в очереди")
+except ValueError as e:
+    logger.warning(f"Неверный UPDATE_QUEUE_SIZE: {os.getenv('UPDATE_QUEUE_SIZE')}. Установлен по умолчанию 1000: {e}")
+    UPDATE_QUEUE_SIZE = 1000
+
+# Приём обновлений: "local" — очередь в этом процессе, "stream" — Redis Stream с группой потребителей
+UPDATE_INGEST_MODE = os.getenv("UPDATE_INGEST_MODE", "local").strip().lower()
+if UPDATE_INGEST_MODE not in ("local", "stream"):
+    logger.warning(f"Неверный UPDATE_INGEST_MODE: {UPDATE_INGEST_MODE}. Установлен по умолчанию local")
+    UPDATE_INGEST_MODE = "local"
+logger.info(f"Установлен UPDATE_INGEST_MODE: {UPDATE_INGEST_MODE}")
+UPDATE_STREAM_KEY = os.getenv("UPDATE_STREAM_KEY", "updates:stream")
+UPDATE_STREAM_GROUP = os.getenv("UPDATE_STREAM_GROUP", "bot")
+
+try:
+    UPDATE_STREAM_MAXLEN = int(os.getenv("UPDATE_STREAM_MAXLEN", "100000"))
+    if UPDATE_STREAM_MAXLEN <= 0:
+        raise ValueError("UPDATE_STREAM_MAXLEN должен быть положительным")
+    logger.info(f"Установлен UPDATE_STREAM_MAXLEN: {UPDATE_STREAM_MAXLEN} записей")
+except ValueError as e:
+    logger.warning(f"Неверный UPDATE_STREAM_MAXLEN: {os.getenv('UPDATE_STREAM_MAXLEN')}. Установлен по умолчанию 100000: {e}")
+    UPDATE_STREAM_MAXLEN = 100000
+
+try:
+    # Через сколько миллисекунд без XACK обновление забирается у упавшего потребителя
+    UPDATE_STREAM_CLAIM_IDLE = int(os.getenv("UPDATE_STREAM_CLAIM_IDLE", "60000"))
+    if UPDATE_STREAM_CLAIM_IDLE <= 0:
+        raise ValueError("UPDATE_STREAM_CLAIM_IDLE должен быть положительным")
+    logger.info(f"Установлен UPDATE_STREAM_CLAIM_IDLE: {UPDATE_STREAM_CLAIM_IDLE} мс")
+except ValueError as e:
+    logger.warning(f"Неверный UPDATE_STREAM_CLAIM_IDLE: {os.getenv('UPDATE_STREAM_CLAIM_IDLE')}. Установлен по умолчанию 60000 мс: {e}")
+    UPDATE_STREAM_CLAIM_IDLE = 60000
+
+try:
+    BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", "21600"))
+    if BACKUP_INTERVAL <= 0:
+        raise ValueError("BACKUP_INTERVAL должен быть положительным")
+    logger.info(f"Установлен BACKUP_INTERVAL: {BACKUP_INTERVAL} секунд")
+except ValueError as e:
+    logger.warning(f"Неверный BACKUP_INTERVAL: {os.getenv('BACKUP_INTERVAL')}. Установлен по умолчанию 21600 секунд: {e}")
+    BACKUP_INTERVAL = 21600
+
+try:
+    BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "5"))
+    if BACKUP_KEEP <= 0:
+        raise ValueError("BACKUP_KEEP должен быть положительным")
+    logger.info(f"Установлен BACKUP_KEEP: {BACKUP_KEEP} копий")
+except ValueError as e:
+    logger.warning(f"Неверный BACKUP_KEEP: {os.getenv('BACKUP_KEEP')}. Установлен по умолчанию 5: {e}")
+    BACKUP_KEEP = 5
+
+try:
+    BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+    if BACKUP_PAGES_PER_STEP <= 0:
+        raise ValueError("BACKUP_PAGES_PER_STEP должен быть положительным")
+    logger.info(f"Установлен BACKUP_PAGES_PER_STEP: {BACKUP_PAGES_PER_STEP} страниц")
+except ValueError as e:
+    logger.warning(f"Неверный BACKUP_PAGES_PER_STEP: {os.getenv('BACKUP_PAGES_PER_STEP')}. Установлен по умолчанию 256: {e}")
+    BACKUP_PAGES_PER_STEP = 256
+
 try:
     PORT = int(os.getenv("PORT", "8443"))
     if not (0 < PORT < 65536):
@@ -248,14 +462,24 @@ if __name__ == "__main__":
     print("--- Проверка конфигурации ---")
     print(f"BOT_TOKEN: {'***' + BOT_TOKEN[-6:] if BOT_TOKEN else 'НЕ ЗАДАН!'}")
     print(f"LOG_LEVEL: {LOG_LEVEL}")
+    print(f"LOG_SAMPLE: {LOG_SAMPLE}")
     print(f"ADMIN_IDS: {ADMIN_IDS}")
     print(f"DB_NAME: {DB_NAME}")
     print(f"DB_TIMEOUT: {DB_TIMEOUT} сек")
+    print(f"DB_POOL_SIZE: {DB_POOL_SIZE}")
+    print(f"DB_PRAGMA_PROFILE: {DB_PRAGMA_PROFILE} {DB_PRAGMAS}")
     print(f"CHANNEL_ID: {CHANNEL_ID}")
     print(f"WEBAPP_URL: {WEBAPP_URL if WEBAPP_URL else 'Не задан'}")
     print(f"WEBHOOK_PATH: {WEBHOOK_PATH}")
     print(f"PORT: {PORT}")
-    print(f"FSM_TIMEOUT: {FSM_TIMEOUT} сек")
+    print(f"FSM_TIMEOUT: {FSM_TIMEOUT} сек, FSM_MEMORY_MAX_KEYS: {FSM_MEMORY_MAX_KEYS}")
+    print(f"BACKUP: каждые {BACKUP_INTERVAL} сек, хранить {BACKUP_KEEP}, {BACKUP_PAGES_PER_STEP} страниц за шаг")
+    print(f"DEDUP: cache={DEDUP_CACHE_SIZE}, ttl={DEDUP_TTL} сек, ring={DEDUP_RING_SIZE}")
+    print(f"PROFILE_CACHE: size={PROFILE_CACHE_SIZE}, ttl={PROFILE_CACHE_TTL} сек")
+    print(f"SUB_CACHE: max_ttl={SUB_CACHE_MAX_TTL} сек, negative_ttl={SUB_CACHE_NEGATIVE_TTL} сек")
+    print(f"API_COMPRESS_MIN_SIZE: {API_COMPRESS_MIN_SIZE} байт")
+    print(f"UPDATE_WORKERS: {UPDATE_WORKERS}, UPDATE_QUEUE_SIZE: {UPDATE_QUEUE_SIZE}")
+    print(f"UPDATE_INGEST_MODE: {UPDATE_INGEST_MODE}, stream={UPDATE_STREAM_KEY}, group={UPDATE_STREAM_GROUP}, maxlen={UPDATE_STREAM_MAXLEN}, claim_idle={UPDATE_STREAM_CLAIM_IDLE} мс")
     print(f"MAX_COMPANY_NAME_LENGTH: {MAX_COMPANY_NAME_LENGTH}")
     print(f"SUBSCRIPTION_PRICES: {SUBSCRIPTION_PRICES}")
     print("-" * 20)
@@ -1,43 +1,218 @@
 import asyncio
 import aiosqlite
 import logging
-import shutil
-from config import DB_NAME, DB_TIMEOUT, CATEGORIES, SELLER_ROLE, BUYER_ROLE, ADMIN_ROLE, SELLER_BASE_ID, BUYER_BASE_ID, ADMIN_BASE_ID
+import glob
+import os
+import sqlite3
+import time
+from config import DB_NAME, DB_TIMEOUT, DB_PRAGMAS, BACKUP_INTERVAL, BACKUP_KEEP, BACKUP_PAGES_PER_STEP, CATEGORIES, SELLER_ROLE, BUYER_ROLE, ADMIN_ROLE, SELLER_BASE_ID, BUYER_BASE_ID, ADMIN_BASE_ID
 from datetime import datetime, timedelta
 import pytz
-from utils import format_uz_datetime, notify_admin, parse_uz_datetime
+from utils import format_uz_datetime, notify_admin, parse_uz_datetime, to_epoch, TASHKENT_UTC_OFFSET
+from db_pool import pool
+from query_plans import check_query_plans
+from subscription_cache import subscription_cache
+from fsm_storage import PipelinedRedisStorage
 from aiogram.fsm.storage.redis import RedisStorage
 from aiogram import Bot
+from typing import Any, Awaitable, Callable, Optional
 
 logger = logging.getLogger(__name__)
-db_lock = asyncio.Lock()
+
+# Очередь задач записи: одна фоновая задача выполняет их пачками в одной транзакции
+WRITE_QUEUE_SIZE = 1000
+WRITE_BATCH_SIZE = 64
+_write_queue: Optional[asyncio.Queue] = None
+_writer_task: Optional[asyncio.Task] = None
+
+# Процесс-обработчик (--worker) схему не мигрирует, а ждёт, пока это сделает основной процесс
+MIGRATION_WAIT_POLL = 1.0
+MIGRATION_WAIT_TIMEOUT = 300
+
+# Номера счётчиков выдаются из зарезервированных в базе блоков: name -> [следующий, последний]
+ID_BLOCK_SIZE = 20
+_id_blocks: dict[str, list[int]] = {}
+_id_block_locks: dict[str, asyncio.Lock] = {}
+
+# Текстовые даты и их целочисленные (Unix epoch) копии для индексируемых диапазонных запросов.
+# Для ISO-строк указано смещение: users.created_at заполняется datetime('now') в UTC,
+# остальные ISO-даты получены _migrate_dates из ташкентского времени.
+EPOCH_COLUMNS = {
+    "users": [("created_at", "created_ts", 0)],
+    "products": [("created_at", "created_ts", TASHKENT_UTC_OFFSET),
+                 ("archived_at", "archived_ts", TASHKENT_UTC_OFFSET),
+                 ("completed_at", "completed_ts", TASHKENT_UTC_OFFSET)],
+    "requests": [("created_at", "created_ts", TASHKENT_UTC_OFFSET),
+                 ("archived_at", "archived_ts", TASHKENT_UTC_OFFSET)],
+    "payments": [("channel_expires", "channel_expires_ts", TASHKENT_UTC_OFFSET),
+                 ("bot_expires", "bot_expires_ts", TASHKENT_UTC_OFFSET)],
+}
+EPOCH_INDEXES = {
+    "idx_users_created_ts": "users(created_ts)",
+    "idx_products_created_ts": "products(created_ts)",
+    "idx_requests_created_ts": "requests(created_ts)",
+    "idx_payments_bot_expires_ts": "payments(bot_expires_ts)",
+}
+
+# Пауза между порциями страниц онлайн-бэкапа, чтобы не занимать диск целиком
+BACKUP_STEP_SLEEP = 0.05
+# Срок, после которого активный эълон без final_price блокирует пользователя (секунды)
+FINAL_PRICE_DEADLINE = 48 * 3600
 
 VALID_ROLES = (SELLER_ROLE, BUYER_ROLE, ADMIN_ROLE)
+ITEM_ID_COUNTERS = ("products", "requests")
+USER_ID_COUNTERS = {
+    BUYER_ROLE: ("buyers", BUYER_BASE_ID),
+    SELLER_ROLE: ("sellers", SELLER_BASE_ID),
+    ADMIN_ROLE: ("admins", ADMIN_BASE_ID)
+}
 VALID_STATUSES = ('active', 'pending_response', 'archived', 'deleted')
 
-async def backup_db() -> None:
-    """Создаёт резервную копию базы данных."""
+def _run_backup(backup_path: str) -> int:
+    """Копирует живую базу через sqlite3 backup API порциями страниц; выполняется в отдельном потоке."""
+    tmp_path = f"{backup_path}.tmp"
     try:
-        backup_path = f"{DB_NAME}.bak"
-        shutil.copyfile(DB_NAME, backup_path)
-        logger.info(f"Резервная копия базы данных создана: {backup_path}")
-    except FileNotFoundError:
+        source = sqlite3.connect(DB_NAME, timeout=DB_TIMEOUT)
+        try:
+            target = sqlite3.connect(tmp_path)
+            try:
+                source.backup(target, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP)
+            finally:
+                target.close()
+        finally:
+            source.close()
+        os.replace(tmp_path, backup_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.getsize(backup_path)
+
+def _rotate_backups() -> None:
+    """Удаляет старые снимки, оставляя BACKUP_KEEP последних."""
+    backups = sorted(glob.glob(f"{glob.escape(DB_NAME)}.*.bak"))
+    for old_path in backups[:-BACKUP_KEEP]:
+        try:
+            os.remove(old_path)
+            logger.info(f"Удалена старая резервная копия: {old_path}")
+        except OSError as e:
+            logger.warning(f"Не удалось удалить старую резервную копию {old_path}: {e}")
+
+async def backup_db() -> Optional[str]:
+    """Создаёт снимок базы данных с отметкой времени, не блокируя цикл событий и писателей."""
+    if not os.path.exists(DB_NAME):
         logger.warning(f"База данных {DB_NAME} не найдена, пропуск резервного копирования")
+        return None
+    timestamp = datetime.now(pytz.timezone('Asia/Tashkent')).strftime('%Y%m%d_%H%M%S')
+    backup_path = f"{DB_NAME}.{timestamp}.bak"
+    started = time.perf_counter()
+    try:
+        size = await asyncio.to_thread(_run_backup, backup_path)
     except Exception as e:
         logger.error(f"Ошибка создания резервной копии базы данных: {e}")
         raise
+    logger.info(
+        f"Резервная копия базы данных создана: {backup_path}, "
+        f"{size / 1024 / 1024:.2f} МБ за {time.perf_counter() - started:.2f} сек"
+    )
+    _rotate_backups()
+    return backup_path
 
-async def init_db(bot: Bot = None) -> None:
-    """Инициализирует базу данных."""
+async def backup_loop(bot: Bot = None) -> None:
+    """Фоновая задача: снимок базы сразу при запуске и затем каждые BACKUP_INTERVAL секунд."""
+    logger.info("Фоновая задача резервного копирования запущена")
     try:
-        logger.info("Маълумотлар базасини инициализация қилиш")
-        await backup_db()
+        while True:
+            try:
+                await backup_db()
+            except Exception as e:
+                logger.error(f"Ошибка фонового резервного копирования: {e}", exc_info=True)
+                await notify_admin(f"Ошибка фонового резервного копирования: {str(e)}", bot=bot)
+            await asyncio.sleep(BACKUP_INTERVAL)
+    except asyncio.CancelledError:
+        logger.info("Фоновая задача резервного копирования отменена")
+        raise
 
+async def init_db(bot: Bot = None, migrate: bool = True) -> None:
+    """Инициализирует базу данных. С migrate=False миграции не применяются: ждём, пока схему
+    обновит основной процесс, — иначе одновременный запуск процессов гоняет одни и те же ALTER TABLE."""
+    try:
+        logger.info("Маълумотлар базасини инициализация қилиш")
         async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
+            await _configure_journal(conn, bot=bot)
             await conn.execute("PRAGMA foreign_keys = ON")
-            logger.debug("Создание таблицы users")
+            if migrate:
+                await _run_migrations(conn, bot=bot)
+            else:
+                await _wait_for_migrations(conn)
+
+            logger.debug("Инициализация категорий")
+            await conn.executemany(
+                "INSERT OR IGNORE INTO categories (name) VALUES (?)",
+                [(cat,) for cat in CATEGORIES]
+            )
+            await conn.commit()
+
+            async with conn.execute("SELECT name FROM sqlite_master WHERE type='table'") as cursor:
+                tables = [row[0] for row in await cursor.fetchall()]
+                logger.debug(f"Созданы таблицы: {tables}")
+                if 'users' not in tables or 'payments' not in tables:
+                    logger.error("Таблицы users или payments не созданы")
+                    await notify_admin("Таблицы users или payments не созданы", bot=bot)
+                    raise aiosqlite.Error("Таблицы users или payments не созданы")
+        await pool.open()
+        logger.info("Маълумотлар базаси муваффақиятли инициализация қилинди")
+    except aiosqlite.Error as e:
+        logger.error(f"Хатолик: Маълумотлар базасини инициализация қилишда: {e}")
+        await notify_admin(f"Хатолик: Маълумотлар базасини инициализация қилишда: {str(e)}", bot=bot)
+        raise
+    except Exception as e:
+        logger.error(f"Кутмаган хатолик: Маълумотлар базасини инициализация қилишда: {e}")
+        await notify_admin(f"Кутмаган хатолик: Маълумотлар базасини инициализация қилишда: {str(e)}", bot=bot)
+        raise
+
+def _split_sql(script: str) -> list[str]:
+    """Делит SQL-скрипт на отдельные выражения (тела триггеров BEGIN ... END остаются целыми)."""
+    statements = []
+    buffer = ""
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            statements.append(buffer.strip())
+            buffer = ""
+    return statements
+
+async def _execute_script(conn: aiosqlite.Connection, script: str) -> None:
+    """Выполняет SQL-скрипт по выражениям в текущей транзакции; executescript здесь не подходит — он сам делает COMMIT."""
+    for statement in _split_sql(script):
+        await conn.execute(statement)
+
+async def _migration_base_schema(conn: aiosqlite.Connection, bot: Bot = None) -> None:
+    """Миграция 1: таблицы, индексы и приведение старых баз к исходной схеме."""
+    logger.debug("Создание таблицы users")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS users
+        (
+            id INTEGER PRIMARY KEY,
+            phone_number TEXT NOT NULL UNIQUE,
+            role TEXT,
+            region TEXT,
+            district TEXT,
+            company_name TEXT,
+            unique_id TEXT UNIQUE,
+            created_at TEXT DEFAULT (datetime('now'))
+        )
+    """)
+
+    # Миграция: убрать NOT NULL из role, если оно присутствует
+    logger.debug("Проверка и миграция таблицы users для удаления NOT NULL из role")
+    async with conn.execute("PRAGMA table_info(users)") as cursor:
+        columns = await cursor.fetchall()
+        role_column = next((col for col in columns if col[1] == 'role'), None)
+        if role_column and role_column[2] == 'TEXT' and role_column[3] == 1:  # NOT NULL присутствует
+            logger.info("Обнаружено NOT NULL на поле role, выполняется миграция")
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS users
+                CREATE TABLE users_temp
                 (
                     id INTEGER PRIMARY KEY,
                     phone_number TEXT NOT NULL UNIQUE,
@@ -49,220 +224,547 @@ async def init_db(bot: Bot = None) -> None:
                     created_at TEXT DEFAULT (datetime('now'))
                 )
             """)
-
-            # Миграция: убрать NOT NULL из role, если оно присутствует
-            logger.debug("Проверка и миграция таблицы users для удаления NOT NULL из role")
-            async with conn.execute("PRAGMA table_info(users)") as cursor:
-                columns = await cursor.fetchall()
-                role_column = next((col for col in columns if col[1] == 'role'), None)
-                if role_column and role_column[2] == 'TEXT' and role_column[3] == 1:  # NOT NULL присутствует
-                    logger.info("Обнаружено NOT NULL на поле role, выполняется миграция")
-                    await conn.execute("""
-                        CREATE TABLE users_temp
-                        (
-                            id INTEGER PRIMARY KEY,
-                            phone_number TEXT NOT NULL UNIQUE,
-                            role TEXT,
-                            region TEXT,
-                            district TEXT,
-                            company_name TEXT,
-                            unique_id TEXT UNIQUE,
-                            created_at TEXT DEFAULT (datetime('now'))
-                        )
-                    """)
-                    await conn.execute("""
-                        INSERT INTO users_temp (id, phone_number, role, region, district, company_name, unique_id, created_at)
-                        SELECT id, phone_number, role, region, district, company_name, unique_id, created_at FROM users
-                    """)
-                    await conn.execute("DROP TABLE users")
-                    await conn.execute("ALTER TABLE users_temp RENAME TO users")
-                    await conn.commit()
-                    logger.info("Миграция таблицы users завершена: NOT NULL удалён из role")
-
-            logger.debug("Создание таблицы products")
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS products
-                (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    category TEXT NOT NULL,
-                    sort TEXT NOT NULL,
-                    volume_ton REAL NOT NULL CHECK (volume_ton > 0),
-                    price REAL NOT NULL CHECK (price > 0),
-                    photos TEXT,
-                    unique_id TEXT UNIQUE NOT NULL,
-                    status TEXT DEFAULT 'active' CHECK (status IN ('active', 'pending_response', 'archived', 'deleted')),
-                    created_at TEXT DEFAULT (datetime('now')),
-                    channel_message_id INTEGER,
-                    channel_message_ids TEXT,
-                    final_price REAL,
-                    archived_at TEXT,
-                    region TEXT NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-                )
+                INSERT INTO users_temp (id, phone_number, role, region, district, company_name, unique_id, created_at)
+                SELECT id, phone_number, role, region, district, company_name, unique_id, created_at FROM users
             """)
+            await conn.execute("DROP TABLE users")
+            await conn.execute("ALTER TABLE users_temp RENAME TO users")
+            logger.info("Миграция таблицы users завершена: NOT NULL удалён из role")
 
-            logger.debug("Создание таблицы requests")
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS requests
-                (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    category TEXT NOT NULL,
-                    sort TEXT NOT NULL,
-                    volume_ton REAL NOT NULL CHECK (volume_ton > 0),
-                    price REAL NOT NULL CHECK (price > 0),
-                    region TEXT NOT NULL,
-                    unique_id TEXT UNIQUE NOT NULL,
-                    channel_message_id INTEGER,
-                    status TEXT DEFAULT 'active' CHECK (status IN ('active', 'pending_response', 'archived', 'deleted')),
-                    created_at TEXT DEFAULT (datetime('now')),
-                    final_price REAL,
-                    archived_at TEXT,
-                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-                )
-            """)
+    logger.debug("Создание таблицы products")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS products
+        (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            sort TEXT NOT NULL,
+            volume_ton REAL NOT NULL CHECK (volume_ton > 0),
+            price REAL NOT NULL CHECK (price > 0),
+            photos TEXT,
+            unique_id TEXT UNIQUE NOT NULL,
+            status TEXT DEFAULT 'active' CHECK (status IN ('active', 'pending_response', 'archived', 'deleted')),
+            created_at TEXT DEFAULT (datetime('now')),
+            channel_message_id INTEGER,
+            channel_message_ids TEXT,
+            final_price REAL,
+            archived_at TEXT,
+            region TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    """)
 
-            logger.debug("Создание таблицы counters")
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS counters
-                (
-                    name TEXT PRIMARY KEY,
-                    value INTEGER NOT NULL DEFAULT 0
-                )
-            """)
+    logger.debug("Создание таблицы requests")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS requests
+        (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            sort TEXT NOT NULL,
+            volume_ton REAL NOT NULL CHECK (volume_ton > 0),
+            price REAL NOT NULL CHECK (price > 0),
+            region TEXT NOT NULL,
+            unique_id TEXT UNIQUE NOT NULL,
+            channel_message_id INTEGER,
+            status TEXT DEFAULT 'active' CHECK (status IN ('active', 'pending_response', 'archived', 'deleted')),
+            created_at TEXT DEFAULT (datetime('now')),
+            final_price REAL,
+            archived_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    """)
 
-            logger.debug("Создание таблицы categories")
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS categories
-                (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT UNIQUE NOT NULL
-                )
-            """)
+    logger.debug("Создание таблицы counters")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS counters
+        (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    """)
 
-            logger.debug("Создание таблицы payments")
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS payments
-                (
-                    user_id INTEGER PRIMARY KEY,
-                    channel_expires TEXT,
-                    bot_expires TEXT,
-                    trial_used INTEGER DEFAULT 0
-                )
-            """)
+    logger.debug("Создание таблицы categories")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS categories
+        (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL
+        )
+    """)
 
-            logger.debug("Создание таблицы deleted_users")
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS deleted_users
-                (
-                    deleted_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    phone_number TEXT,
-                    role TEXT,
-                    region TEXT,
-                    district TEXT,
-                    company_name TEXT,
-                    unique_id TEXT,
-                    deleted_at TEXT DEFAULT (datetime('now')),
-                    blocked INTEGER DEFAULT 0
-                )
-            """)
+    logger.debug("Создание таблицы payments")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS payments
+        (
+            user_id INTEGER PRIMARY KEY,
+            channel_expires TEXT,
+            bot_expires TEXT,
+            trial_used INTEGER DEFAULT 0
+        )
+    """)
 
-            logger.debug("Создание таблицы pending_items")
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS pending_items
-                (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    item_type TEXT NOT NULL CHECK (item_type IN ('product', 'request')),
-                    unique_id TEXT NOT NULL,
-                    created_at TEXT DEFAULT (datetime('now')),
-                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-                )
-            """)
+    logger.debug("Создание таблицы deleted_users")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS deleted_users
+        (
+            deleted_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            phone_number TEXT,
+            role TEXT,
+            region TEXT,
+            district TEXT,
+            company_name TEXT,
+            unique_id TEXT,
+            deleted_at TEXT DEFAULT (datetime('now')),
+            blocked INTEGER DEFAULT 0
+        )
+    """)
 
-            logger.debug("Создание таблицы processed_updates")
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS processed_updates
-                (
-                    update_id INTEGER PRIMARY KEY
-                )
+    logger.debug("Создание таблицы pending_items")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS pending_items
+        (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            item_type TEXT NOT NULL CHECK (item_type IN ('product', 'request')),
+            unique_id TEXT NOT NULL,
+            created_at TEXT DEFAULT (datetime('now')),
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    """)
+
+    logger.debug("Создание таблицы processed_updates")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS processed_updates
+        (
+            update_id INTEGER PRIMARY KEY
+        )
+    """)
+
+    logger.debug("Создание индексов")
+    await _execute_script(conn, """
+        CREATE INDEX IF NOT EXISTS idx_products_user_id ON products(user_id);
+        CREATE INDEX IF NOT EXISTS idx_products_unique_id ON products(unique_id);
+        CREATE INDEX IF NOT EXISTS idx_products_status ON products(status);
+        CREATE INDEX IF NOT EXISTS idx_requests_user_id ON requests(user_id);
+        CREATE INDEX IF NOT EXISTS idx_requests_unique_id ON requests(unique_id);
+        CREATE INDEX IF NOT EXISTS idx_requests_status ON requests(status);
+        CREATE INDEX IF NOT EXISTS idx_pending_items_user_id ON pending_items(user_id);
+        CREATE INDEX IF NOT EXISTS idx_users_phone_number ON users(phone_number);
+        CREATE INDEX IF NOT EXISTS idx_users_id ON users(id);
+    """)
+
+    await _migrate_table(conn, "products", {
+        "channel_message_id": "INTEGER",
+        "channel_message_ids": "TEXT",
+        "status": "TEXT DEFAULT 'active'",
+        "final_price": "REAL",
+        "created_at": "TEXT",
+        "archived_at": "TEXT",
+        "region": "TEXT NOT NULL DEFAULT 'Не указан'",
+        "archived_photos": "TEXT",
+        "completed_at": "TEXT"
+    }, bot=bot)
+    await _migrate_table(conn, "requests", {
+        "channel_message_id": "INTEGER",
+        "status": "TEXT DEFAULT 'active'",
+        "final_price": "REAL",
+        "created_at": "TEXT",
+        "archived_at": "TEXT",
+        "region": "TEXT NOT NULL DEFAULT 'Не указан'"
+    }, bot=bot)
+    await _migrate_table(conn, "deleted_users", {
+        "blocked": "INTEGER DEFAULT 0"
+    }, bot=bot)
+    await _migrate_table(conn, "pending_items", {
+        "item_type": "TEXT NOT NULL",
+        "unique_id": "TEXT NOT NULL",
+        "created_at": "TEXT"
+    }, bot=bot)
+
+    await _migrate_dates(conn, bot=bot)
+
+    logger.debug("Инициализация счетчиков")
+    await conn.executemany(
+        "INSERT OR IGNORE INTO counters (name, value) VALUES (?, ?)",
+        [("products", 0), ("requests", 0), ("sellers", 0), ("buyers", 0), ("admins", 0)]
+    )
+
+async def _migration_epoch_columns(conn: aiosqlite.Connection, bot: Bot = None) -> None:
+    """Миграция 2: целочисленные epoch-колонки для диапазонных запросов по датам."""
+    await _migrate_table(conn, "users", {
+        "created_ts": "INTEGER"
+    }, bot=bot)
+    await _migrate_table(conn, "products", {
+        "created_ts": "INTEGER",
+        "archived_ts": "INTEGER",
+        "completed_ts": "INTEGER"
+    }, bot=bot)
+    await _migrate_table(conn, "requests", {
+        "created_ts": "INTEGER",
+        "archived_ts": "INTEGER"
+    }, bot=bot)
+    await _migrate_table(conn, "payments", {
+        "channel_expires_ts": "INTEGER",
+        "bot_expires_ts": "INTEGER"
+    }, bot=bot)
+    await _migrate_epoch_columns(conn, bot=bot)
+
+async def _migration_sync_id_counters(conn: aiosqlite.Connection, bot: Bot = None) -> None:
+    """Миграция 3: счётчики ID не ниже уже выданных номеров перед переходом на блоки."""
+    await _sync_id_counters(conn, bot=bot)
+
+async def _migration_query_indexes(conn: aiosqlite.Connection, bot: Bot = None) -> None:
+    """Миграция 4: составные и частичные индексы под реальные запросы вместо одноколоночных."""
+    await _execute_script(conn, """
+        CREATE INDEX IF NOT EXISTS idx_products_user_status ON products(user_id, status);
+        CREATE INDEX IF NOT EXISTS idx_products_status_created_ts ON products(status, created_ts);
+        CREATE INDEX IF NOT EXISTS idx_requests_user_status ON requests(user_id, status);
+        CREATE INDEX IF NOT EXISTS idx_requests_status_created_ts ON requests(status, created_ts);
+        CREATE INDEX IF NOT EXISTS idx_requests_active_duplicate
+            ON requests(user_id, category, sort, region) WHERE status = 'active';
+        CREATE INDEX IF NOT EXISTS idx_pending_items_user_created ON pending_items(user_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_deleted_users_user_blocked ON deleted_users(user_id, blocked);
+
+        -- Покрыты левыми префиксами составных индексов выше
+        DROP INDEX IF EXISTS idx_products_user_id;
+        DROP INDEX IF EXISTS idx_products_status;
+        DROP INDEX IF EXISTS idx_requests_user_id;
+        DROP INDEX IF EXISTS idx_requests_status;
+        DROP INDEX IF EXISTS idx_pending_items_user_id;
+        -- Дублируют INTEGER PRIMARY KEY и автоматические индексы ограничений UNIQUE
+        DROP INDEX IF EXISTS idx_users_id;
+        DROP INDEX IF EXISTS idx_users_phone_number;
+        DROP INDEX IF EXISTS idx_products_unique_id;
+        DROP INDEX IF EXISTS idx_requests_unique_id;
+    """)
+    await conn.execute("ANALYZE")
+
+async def _migration_final_price_due(conn: aiosqlite.Connection, bot: Bot = None) -> None:
+    """Миграция 5: таблица эълонов, ждущих final_price, вместо проверки дат на каждом сообщении."""
+    # Строки добавляет check_expired_items, когда активный эълон без final_price переходит 48-часовой срок;
+    # триггеры удаляют строку, как только эълон получил final_price, сменил статус или удалён.
+    await _execute_script(conn, f"""
+        CREATE TABLE IF NOT EXISTS final_price_due (
+            unique_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            due_ts INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_final_price_due_user ON final_price_due(user_id);
+
+        CREATE TRIGGER IF NOT EXISTS trg_products_final_price_due_update
+        AFTER UPDATE OF final_price, status ON products
+        WHEN NEW.final_price IS NOT NULL OR NEW.status != 'active'
+        BEGIN
+            DELETE FROM final_price_due WHERE unique_id = NEW.unique_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_products_final_price_due_delete
+        AFTER DELETE ON products
+        BEGIN
+            DELETE FROM final_price_due WHERE unique_id = OLD.unique_id;
+        END;
+
+        INSERT OR IGNORE INTO final_price_due (unique_id, user_id, due_ts)
+        SELECT unique_id, user_id, created_ts + {FINAL_PRICE_DEADLINE} FROM products
+        WHERE status = 'active' AND final_price IS NULL AND created_ts <= {int(time.time()) - FINAL_PRICE_DEADLINE};
+    """)
+
+async def _migration_item_counts(conn: aiosqlite.Connection, bot: Bot = None) -> None:
+    """Миграция 6: счётчики элементов по (таблица, статус, категория) для общего числа на доске без COUNT(*)."""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS item_counts (
+            item_table TEXT NOT NULL,
+            status TEXT,
+            category TEXT NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (item_table, status, category)
+        )
+    """)
+    for table in ("products", "requests"):
+        await _execute_script(conn, f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_count_insert AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO item_counts (item_table, status, category, n) VALUES ('{table}', NEW.status, NEW.category, 1)
+                ON CONFLICT (item_table, status, category) DO UPDATE SET n = n + 1;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_count_delete AFTER DELETE ON {table}
+            BEGIN
+                UPDATE item_counts SET n = n - 1
+                WHERE item_table = '{table}' AND status IS OLD.status AND category = OLD.category;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_count_update AFTER UPDATE OF status, category ON {table}
+            WHEN OLD.status IS NOT NEW.status OR OLD.category != NEW.category
+            BEGIN
+                UPDATE item_counts SET n = n - 1
+                WHERE item_table = '{table}' AND status IS OLD.status AND category = OLD.category;
+                INSERT INTO item_counts (item_table, status, category, n) VALUES ('{table}', NEW.status, NEW.category, 1)
+                ON CONFLICT (item_table, status, category) DO UPDATE SET n = n + 1;
+            END;
+
+            DELETE FROM item_counts WHERE item_table = '{table}';
+            INSERT INTO item_counts (item_table, status, category, n)
+            SELECT '{table}', status, category, COUNT(*) FROM {table} GROUP BY status, category;
+        """)
+
+async def _migration_board_generations(conn: aiosqlite.Connection, bot: Bot = None) -> None:
+    """Миграция 7: номер поколения доски на таблицу; триггеры увеличивают его при любой записи, видимой на доске."""
+    await _execute_script(conn, """
+        CREATE TABLE IF NOT EXISTS board_generations (
+            item_table TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+        INSERT OR IGNORE INTO board_generations (item_table) VALUES ('products'), ('requests');
+
+        -- Регион и телефон автора выводятся на доске, поэтому их изменение сбрасывает обе доски
+        CREATE TRIGGER IF NOT EXISTS trg_users_board_generation AFTER UPDATE OF region, phone_number ON users
+        BEGIN
+            UPDATE board_generations SET generation = generation + 1;
+        END;
+    """)
+    for table in ("products", "requests"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            await conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_board_generation_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE board_generations SET generation = generation + 1 WHERE item_table = '{table}';
+                END
             """)
 
-            logger.debug("Создание индексов")
-            await conn.executescript("""
-                CREATE INDEX IF NOT EXISTS idx_products_user_id ON products(user_id);
-                CREATE INDEX IF NOT EXISTS idx_products_unique_id ON products(unique_id);
-                CREATE INDEX IF NOT EXISTS idx_products_created_at ON products(created_at);
-                CREATE INDEX IF NOT EXISTS idx_products_status ON products(status);
-                CREATE INDEX IF NOT EXISTS idx_requests_user_id ON requests(user_id);
-                CREATE INDEX IF NOT EXISTS idx_requests_unique_id ON requests(unique_id);
-                CREATE INDEX IF NOT EXISTS idx_requests_created_at ON requests(created_at);
-                CREATE INDEX IF NOT EXISTS idx_requests_status ON requests(status);
-                CREATE INDEX IF NOT EXISTS idx_pending_items_user_id ON pending_items(user_id);
-                CREATE INDEX IF NOT EXISTS idx_users_phone_number ON users(phone_number);
-                CREATE INDEX IF NOT EXISTS idx_users_id ON users(id);
+async def _migration_board_changed_ts(conn: aiosqlite.Connection, bot: Bot = None) -> None:
+    """Миграция 8: время последнего изменения доски рядом с поколением — для Last-Modified в API."""
+    async with conn.execute("PRAGMA table_info(board_generations)") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    # Колонка могла остаться от прерванного запуска миграции, user_version которого не успел обновиться
+    if "changed_ts" not in columns:
+        await conn.execute("ALTER TABLE board_generations ADD COLUMN changed_ts INTEGER NOT NULL DEFAULT 0")
+        await conn.execute(f"UPDATE board_generations SET changed_ts = {int(time.time())}")
+    bump = "generation = generation + 1, changed_ts = CAST(strftime('%s', 'now') AS INTEGER)"
+    await _execute_script(conn, f"""
+        DROP TRIGGER IF EXISTS trg_users_board_generation;
+        CREATE TRIGGER trg_users_board_generation AFTER UPDATE OF region, phone_number ON users
+        BEGIN
+            UPDATE board_generations SET {bump};
+        END;
+    """)
+    for table in ("products", "requests"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            trigger = f"trg_{table}_board_generation_{event.lower()}"
+            await _execute_script(conn, f"""
+                DROP TRIGGER IF EXISTS {trigger};
+                CREATE TRIGGER {trigger} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE board_generations SET {bump} WHERE item_table = '{table}';
+                END;
             """)
 
-            await _migrate_table(conn, "products", {
-                "channel_message_id": "INTEGER",
-                "channel_message_ids": "TEXT",
-                "status": "TEXT DEFAULT 'active'",
-                "final_price": "REAL",
-                "created_at": "TEXT",
-                "archived_at": "TEXT",
-                "region": "TEXT NOT NULL DEFAULT 'Не указан'",
-                "archived_photos": "TEXT",
-                "completed_at": "TEXT"
-            }, bot=bot)
-            await _migrate_table(conn, "requests", {
-                "channel_message_id": "INTEGER",
-                "status": "TEXT DEFAULT 'active'",
-                "final_price": "REAL",
-                "created_at": "TEXT",
-                "archived_at": "TEXT",
-                "region": "TEXT NOT NULL DEFAULT 'Не указан'"
-            }, bot=bot)
-            await _migrate_table(conn, "deleted_users", {
-                "blocked": "INTEGER DEFAULT 0"
-            }, bot=bot)
-            await _migrate_table(conn, "pending_items", {
-                "item_type": "TEXT NOT NULL",
-                "unique_id": "TEXT NOT NULL",
-                "created_at": "TEXT"
-            }, bot=bot)
-
-            await _migrate_dates(conn, bot=bot)
-
-            logger.debug("Инициализация счетчиков")
-            await conn.executemany(
-                "INSERT OR IGNORE INTO counters (name, value) VALUES (?, ?)",
-                [("products", 0), ("requests", 0), ("sellers", 0), ("buyers", 0), ("admins", 0)]
-            )
-            logger.debug("Инициализация категорий")
-            await conn.executemany(
-                "INSERT OR IGNORE INTO categories (name) VALUES (?)",
-                [(cat,) for cat in CATEGORIES]
-            )
+async def _migration_board_search(conn: aiosqlite.Connection, bot: Bot = None) -> None:
+    """Миграция 9: полнотекстовые индексы FTS5 по категории, сорту и региону для поиска на доске."""
+    # Индексы внешнего содержимого: текст хранится только в самих таблицах, триггеры поддерживают индекс.
+    # Буквы-апострофы ʻ ʼ объявлены разделителями, как и обычный апостроф: oʻzbek и o'zbek дают одни токены.
+    # Латиница/кириллица и апострофы нормализуются в запросе (board_search.fts_match), поэтому триггерам
+    # не нужны функции Python и запись работает с любого соединения.
+    for table in ("products", "requests"):
+        await _execute_script(conn, f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+                category, sort, region,
+                content='{table}', content_rowid='id',
+                tokenize="unicode61 remove_diacritics 2 separators 'ʻʼ'", prefix='2 3'
+            );
+
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_insert AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO {table}_fts (rowid, category, sort, region) VALUES (NEW.id, NEW.category, NEW.sort, NEW.region);
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_delete AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO {table}_fts ({table}_fts, rowid, category, sort, region)
+                VALUES ('delete', OLD.id, OLD.category, OLD.sort, OLD.region);
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_update AFTER UPDATE OF category, sort, region ON {table}
+            BEGIN
+                INSERT INTO {table}_fts ({table}_fts, rowid, category, sort, region)
+                VALUES ('delete', OLD.id, OLD.category, OLD.sort, OLD.region);
+                INSERT INTO {table}_fts (rowid, category, sort, region) VALUES (NEW.id, NEW.category, NEW.sort, NEW.region);
+            END;
+
+            INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild');
+        """)
+
+# Нумерованные миграции: применяются по порядку ровно один раз, номер хранится в PRAGMA user_version.
+# Уже выпущенные миграции не редактируются, изменения схемы добавляются новой записью в конец.
+# Миграция выполняется в одной транзакции с обновлением user_version, поэтому не вызывает commit
+# и не использует executescript (см. _execute_script).
+MIGRATIONS = [
+    (1, "базовая схема", _migration_base_schema),
+    (2, "epoch-колонки дат", _migration_epoch_columns),
+    (3, "синхронизация счётчиков ID", _migration_sync_id_counters),
+    (4, "индексы под запросы", _migration_query_indexes),
+    (5, "эълоны, ждущие final_price", _migration_final_price_due),
+    (6, "счётчики элементов доски", _migration_item_counts),
+    (7, "поколения кэша доски", _migration_board_generations),
+    (8, "время изменения доски", _migration_board_changed_ts),
+    (9, "полнотекстовый поиск по доске", _migration_board_search),
+]
+
+async def _run_migrations(conn: aiosqlite.Connection, bot: Bot = None) -> None:
+    """Применяет миграции новее PRAGMA user_version; при актуальной схеме ничего не делает."""
+    async with conn.execute("PRAGMA user_version") as cursor:
+        current_version = (await cursor.fetchone())[0]
+    latest_version = MIGRATIONS[-1][0]
+    if current_version >= latest_version:
+        if current_version > latest_version:
+            logger.warning(f"Версия схемы базы данных {current_version} новее известной коду {latest_version}")
+        logger.info(f"Схема базы данных актуальна: user_version={current_version}")
+        return
+
+    async with conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table'") as cursor:
+        has_tables = (await cursor.fetchone())[0] > 0
+    if has_tables:
+        logger.info(f"Резервная копия перед миграцией схемы {current_version} -> {latest_version}")
+        await backup_db()
+
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        started = time.perf_counter()
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Пока ждали блокировку записи, миграцию мог применить другой процесс
+            async with conn.execute("PRAGMA user_version") as cursor:
+                if (await cursor.fetchone())[0] >= version:
+                    await conn.rollback()
+                    continue
+            logger.info(f"Применение миграции {version}: {description}")
+            await migration(conn, bot=bot)
+            await conn.execute(f"PRAGMA user_version = {version}")
             await conn.commit()
+        except BaseException:
+            await conn.rollback()
+            raise
+        logger.info(f"Миграция {version} применена за {time.perf_counter() - started:.2f} сек")
 
-            async with conn.execute("SELECT name FROM sqlite_master WHERE type='table'") as cursor:
-                tables = [row[0] for row in await cursor.fetchall()]
-                logger.debug(f"Созданы таблицы: {tables}")
-                if 'users' not in tables or 'payments' not in tables:
-                    logger.error("Таблицы users или payments не созданы")
-                    await notify_admin("Таблицы users или payments не созданы", bot=bot)
-                    raise aiosqlite.Error("Таблицы users или payments не созданы")
-        logger.info("Маълумотлар базаси муваффақиятли инициализация қилинди")
-    except aiosqlite.Error as e:
-        logger.error(f"Хатолик: Маълумотлар базасини инициализация қилишда: {e}")
-        await notify_admin(f"Хатолик: Маълумотлар базасини инициализация қилишда: {str(e)}", bot=bot)
-        raise
+    offenders = await check_query_plans(conn)
+    if offenders:
+        await notify_admin(f"Запросы с полным сканированием таблицы после миграции: {', '.join(offenders)}", bot=bot)
+
+async def _wait_for_migrations(conn: aiosqlite.Connection) -> None:
+    """Ждёт, пока PRAGMA user_version дойдёт до последней миграции; aiosqlite.Error по MIGRATION_WAIT_TIMEOUT."""
+    latest_version = MIGRATIONS[-1][0]
+    deadline = time.monotonic() + MIGRATION_WAIT_TIMEOUT
+    while True:
+        async with conn.execute("PRAGMA user_version") as cursor:
+            current_version = (await cursor.fetchone())[0]
+        if current_version >= latest_version:
+            logger.info(f"Схема базы данных актуальна: user_version={current_version}")
+            return
+        if time.monotonic() >= deadline:
+            raise aiosqlite.Error(
+                f"Схема базы данных не обновлена основным процессом за {MIGRATION_WAIT_TIMEOUT} сек: "
+                f"user_version={current_version}, нужна {latest_version}"
+            )
+        logger.info(f"Ожидание миграций основного процесса: user_version={current_version}, нужна {latest_version}")
+        await asyncio.sleep(MIGRATION_WAIT_POLL)
+
+async def _configure_journal(conn: aiosqlite.Connection, bot: Bot = None) -> None:
+    """Переводит базу в журнал из профиля DB_PRAGMAS (WAL) и проверяет результат."""
+    journal_mode = DB_PRAGMAS["journal_mode"]
+    async with conn.execute(f"PRAGMA journal_mode = {journal_mode}") as cursor:
+        current_mode = (await cursor.fetchone())[0]
+    if current_mode.upper() != journal_mode.upper():
+        logger.warning(f"Не удалось включить journal_mode={journal_mode}, текущий режим: {current_mode}")
+        await notify_admin(f"Не удалось включить journal_mode={journal_mode}, текущий режим: {current_mode}", bot=bot)
+    else:
+        logger.info(f"Режим журнала базы данных: {current_mode}")
+    await conn.execute(f"PRAGMA synchronous = {DB_PRAGMAS['synchronous']}")
+
+async def close_db() -> None:
+    """Останавливает задачу записи и закрывает пул соединений с базой данных."""
+    global _writer_task
+    try:
+        if _writer_task and not _writer_task.done():
+            await _write_queue.put(None)
+            await _writer_task
+        _writer_task = None
+        await pool.close()
     except Exception as e:
-        logger.error(f"Кутмаган хатолик: Маълумотлар базасини инициализация қилишда: {e}")
-        await notify_admin(f"Кутмаган хатолик: Маълумотлар базасини инициализация қилишда: {str(e)}", bot=bot)
-        raise
+        logger.error(f"Ошибка закрытия пула соединений: {e}")
+
+async def run_write(job: Callable[[aiosqlite.Connection], Awaitable[Any]]) -> Any:
+    """Ставит задачу записи в очередь и ждёт её результат после фиксации транзакции.
+
+    Задача получает соединение писателя и не должна сама вызывать commit/rollback.
+    """
+    global _write_queue, _writer_task
+    if _write_queue is None:
+        _write_queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+    if _writer_task is None or _writer_task.done():
+        _writer_task = asyncio.create_task(_writer_loop(_write_queue))
+    future = asyncio.get_running_loop().create_future()
+    await _write_queue.put((job, future))
+    return await future
+
+async def _writer_loop(queue: asyncio.Queue) -> None:
+    """Забирает задачи записи из очереди и фиксирует их группами."""
+    logger.info("Задача записи в базу данных запущена")
+    stopping = False
+    while not stopping:
+        item = await queue.get()
+        if item is None:
+            break
+        batch = [item]
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        try:
+            await _commit_batch(batch)
+        except Exception as e:
+            logger.error(f"Кутмаган хатолик в задаче записи: {e}", exc_info=True)
+    logger.info("Задача записи в базу данных остановлена")
+
+async def _commit_batch(batch: list) -> None:
+    """Выполняет пачку задач в одной транзакции; каждая задача изолирована SAVEPOINT."""
+    started = time.perf_counter()
+    completed = []
+    try:
+        async with pool.writer() as conn:
+            await conn.execute("BEGIN IMMEDIATE")
+            for job, future in batch:
+                if future.done():
+                    continue
+                await conn.execute("SAVEPOINT write_job")
+                try:
+                    result = await job(conn)
+                except Exception as e:
+                    await conn.execute("ROLLBACK TO write_job")
+                    await conn.execute("RELEASE write_job")
+                    future.set_exception(e)
+                    continue
+                await conn.execute("RELEASE write_job")
+                completed.append((future, result))
+            await conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка фиксации пачки из {len(batch)} задач записи: {e}", exc_info=True)
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for future, result in completed:
+        if not future.done():
+            future.set_result(result)
+    logger.debug(f"Зафиксирована пачка из {len(batch)} задач записи за {(time.perf_counter() - started) * 1000:.1f} мс")
 
 async def _migrate_table(conn: aiosqlite.Connection, table_name: str, columns: dict, bot: Bot = None) -> None:
     """Устунлар мавжуд бўлмаса, таблицага қўшади."""
@@ -278,7 +780,6 @@ async def _migrate_table(conn: aiosqlite.Connection, table_name: str, columns: d
                     await conn.execute(
                         f"UPDATE {table_name} SET created_at = datetime('now') WHERE created_at IS NULL"
                     )
-        await conn.commit()
     except aiosqlite.Error as e:
         logger.error(f"Хатолик: {table_name} таблицасини миграция қилишда: {e}")
         await notify_admin(f"Хатолик: {table_name} таблицасини миграция қилишда: {str(e)}", bot=bot)
@@ -318,57 +819,147 @@ async def _migrate_dates(conn: aiosqlite.Connection, bot: Bot = None) -> None:
                                 parsed = parse_uz_datetime(value)
                                 if parsed:
                                     new_value = parsed.strftime('%Y-%m-%d %H:%M:%S')
-                                    logger.debug(f"SQL: UPDATE {table_name} SET {col} = '{new_value}' WHERE rowid = {rowid}")
+                                    logger.debug("SQL: UPDATE %s SET %s = '%s' WHERE rowid = %s", table_name, col, new_value, rowid)
                                     await conn.execute(
                                         f"UPDATE {table_name} SET {col} = ? WHERE rowid = ?",
                                         (new_value, rowid)
                                     )
                             except ValueError:
                                 logger.warning(f"Сана {value} ни {table_name} таблицасида, rowid={rowid} да ўзгартириб бўлмади")
-            await conn.commit()
         logger.info("Саналар миграцияси якунланди")
     except aiosqlite.Error as e:
         logger.error(f"Хатолик: Саналар миграциясида: {e}")
         await notify_admin(f"Хатолик: Саналар миграциясида: {str(e)}", bot=bot)
         raise
 
+def _epoch_sql(value: str, iso_offset: int) -> str:
+    """SQL-выражение, переводящее текстовую дату (DD.MM.YYYY или ISO) в Unix epoch."""
+    return (
+        f"CASE "
+        f"WHEN {value} GLOB '[0-9][0-9].[0-9][0-9].[0-9][0-9][0-9][0-9] *' THEN "
+        f"CAST(strftime('%s', substr({value}, 7, 4) || '-' || substr({value}, 4, 2) || '-' || "
+        f"substr({value}, 1, 2) || ' ' || substr({value}, 12, 8)) AS INTEGER) - {TASHKENT_UTC_OFFSET} "
+        f"WHEN {value} GLOB '[0-9][0-9][0-9][0-9]-*' THEN CAST(strftime('%s', {value}) AS INTEGER) - {iso_offset} "
+        f"END"
+    )
+
+async def _migrate_epoch_columns(conn: aiosqlite.Connection, bot: Bot = None) -> None:
+    """Заполняет epoch-колонки, создаёт триггеры синхронизации и индексы для диапазонных запросов."""
+    try:
+        for table_name, columns in EPOCH_COLUMNS.items():
+            for text_col, ts_col, iso_offset in columns:
+                for event, trigger_suffix in ((f"INSERT ON {table_name}", "ins"),
+                                              (f"UPDATE OF {text_col} ON {table_name}", "upd")):
+                    await conn.execute(f"""
+                        CREATE TRIGGER IF NOT EXISTS trg_{table_name}_{ts_col}_{trigger_suffix}
+                        AFTER {event}
+                        BEGIN
+                            UPDATE {table_name} SET {ts_col} = {_epoch_sql(f"NEW.{text_col}", iso_offset)}
+                            WHERE rowid = NEW.rowid;
+                        END
+                    """)
+
+                cursor = await conn.execute(
+                    f"UPDATE {table_name} SET {ts_col} = {_epoch_sql(text_col, iso_offset)} "
+                    f"WHERE {ts_col} IS NULL AND {text_col} IS NOT NULL"
+                )
+                if cursor.rowcount > 0:
+                    logger.info(f"Таблица {table_name}: {ts_col} заполнен для {cursor.rowcount} строк")
+
+                # Даты в формате с названием месяца SQL разобрать не может
+                async with conn.execute(
+                    f"SELECT rowid, {text_col} FROM {table_name} WHERE {ts_col} IS NULL AND {text_col} IS NOT NULL"
+                ) as cursor:
+                    rows = await cursor.fetchall()
+                for rowid, value in rows:
+                    parsed = parse_uz_datetime(value)
+                    if parsed:
+                        await conn.execute(
+                            f"UPDATE {table_name} SET {ts_col} = ? WHERE rowid = ?",
+                            (to_epoch(parsed), rowid)
+                        )
+                    else:
+                        logger.warning(f"Сана {value} ни {table_name}.{ts_col} учун ўзгартириб бўлмади, rowid={rowid}")
+
+        await conn.execute("DROP INDEX IF EXISTS idx_products_created_at")
+        await conn.execute("DROP INDEX IF EXISTS idx_requests_created_at")
+        for index_name, target in EPOCH_INDEXES.items():
+            await conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {target}")
+        logger.info("Миграция epoch-колонок якунланди")
+    except aiosqlite.Error as e:
+        logger.error(f"Хатолик: epoch-колонок миграциясида: {e}")
+        await notify_admin(f"Хатолик: epoch-колонок миграциясида: {str(e)}", bot=bot)
+        raise
+
+async def _sync_id_counters(conn: aiosqlite.Connection, bot: Bot = None) -> None:
+    """Поднимает счётчики до максимального уже выданного номера, чтобы блоки ID не пересекались со старыми."""
+    try:
+        for counter_name in ITEM_ID_COUNTERS:
+            async with conn.execute(
+                f"SELECT MAX(CAST(substr(unique_id, instr(unique_id, '-') + 1) AS INTEGER)) FROM {counter_name}"
+            ) as cursor:
+                max_value = (await cursor.fetchone())[0] or 0
+            await conn.execute("UPDATE counters SET value = MAX(value, ?) WHERE name = ?", (max_value, counter_name))
+        for counter_name, base_id in USER_ID_COUNTERS.values():
+            prefix = base_id.rstrip('0123456789')
+            async with conn.execute(
+                "SELECT MAX(CAST(substr(unique_id, ?) AS INTEGER)) FROM users WHERE unique_id LIKE ?",
+                (len(prefix) + 1, f"{prefix}%")
+            ) as cursor:
+                max_value = (await cursor.fetchone())[0] or 0
+            await conn.execute("UPDATE counters SET value = MAX(value, ?) WHERE name = ?", (max_value, counter_name))
+    except aiosqlite.Error as e:
+        logger.error(f"Хатолик: счетчикларни синхронлашда: {e}")
+        await notify_admin(f"Хатолик: счетчикларни синхронлашда: {str(e)}", bot=bot)
+        raise
+
+async def _next_counter_value(counter_name: str) -> int:
+    """Выдаёт следующий номер счётчика из блока в памяти, резервируя новый блок при исчерпании.
+
+    Блок резервируется одним атомарным UPDATE ... RETURNING, поэтому несколько процессов
+    никогда не получат пересекающиеся номера; неиспользованный остаток блока теряется при рестарте.
+    """
+    block = _id_blocks.get(counter_name)
+    if block and block[0] <= block[1]:
+        block[0] += 1
+        return block[0] - 1
+
+    async with _id_block_locks.setdefault(counter_name, asyncio.Lock()):
+        block = _id_blocks.get(counter_name)
+        if not block or block[0] > block[1]:
+            async def job(conn: aiosqlite.Connection) -> int:
+                logger.debug("SQL: UPSERT counters SET value = value + %s WHERE name = '%s' RETURNING value", ID_BLOCK_SIZE, counter_name)
+                async with conn.execute(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value RETURNING value",
+                    (counter_name, ID_BLOCK_SIZE)
+                ) as cursor:
+                    return (await cursor.fetchone())[0]
+
+            last_value = await run_write(job)
+            block = [last_value - ID_BLOCK_SIZE + 1, last_value]
+            _id_blocks[counter_name] = block
+            logger.debug(f"Счетчик {counter_name}: зарезервирован блок {block[0]}..{block[1]}")
+        block[0] += 1
+        return block[0] - 1
+
 async def generate_user_id(role: str, bot: Bot = None) -> str:
     """Генерирует уникальный ID для пользователя в формате S00001, B00002, A00003."""
     if role not in VALID_ROLES:
         raise ValueError(f"Йўқ роль: {role}. Керакли роллар: {VALID_ROLES}")
 
-    role_config = {
-        BUYER_ROLE: ("buyers", BUYER_BASE_ID),
-        SELLER_ROLE: ("sellers", SELLER_BASE_ID),
-        ADMIN_ROLE: ("admins", ADMIN_BASE_ID)
-    }
-
-    counter_name, base_id = role_config[role]
+    counter_name, base_id = USER_ID_COUNTERS[role]
     logger.debug(f"Роль учун ID яратиш: {role}, счетчик: {counter_name}, базовый ID: {base_id}")
+
     try:
-        async with db_lock:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                await conn.execute("BEGIN TRANSACTION")
-                logger.debug(f"SQL: SELECT value FROM counters WHERE name = '{counter_name}'")
-                async with conn.execute("SELECT value FROM counters WHERE name = ?", (counter_name,)) as cursor:
-                    row = await cursor.fetchone()
-                    current_value = row[0] if row else 0
-                    new_value = current_value + 1
-
-                numeric_part = str(new_value).zfill(5)  # Фиксированная длина 5 цифр
-                unique_id = f"{base_id.rstrip('0123456789')}{numeric_part}"
-                if len(unique_id) > 12:
-                    logger.error(f"Сгенерированный unique_id слишком длинный: {unique_id}")
-                    await conn.execute("ROLLBACK")
-                    raise ValueError(f"unique_id превышает допустимую длину: {unique_id}")
-                logger.debug(f"SQL: INSERT OR REPLACE INTO counters (name, value) VALUES ('{counter_name}', {new_value})")
-                await conn.execute(
-                    "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)",
-                    (counter_name, new_value)
-                )
-                await conn.commit()
-                logger.debug(f"Яратилган unique_id: {unique_id}")
-                return unique_id
+        new_value = await _next_counter_value(counter_name)
+        numeric_part = str(new_value).zfill(5)  # Фиксированная длина 5 цифр
+        unique_id = f"{base_id.rstrip('0123456789')}{numeric_part}"
+        if len(unique_id) > 12:
+            logger.error(f"Сгенерированный unique_id слишком длинный: {unique_id}")
+            raise ValueError(f"unique_id превышает допустимую длину: {unique_id}")
+        logger.debug(f"Яратилган unique_id: {unique_id}")
+        return unique_id
     except aiosqlite.Error as e:
         logger.error(f"Роль {role} учун user_id яратишда хатолик: {e}")
         await notify_admin(f"Роль {role} учун user_id яратишда хатолик: {str(e)}", bot=bot)
@@ -380,39 +971,12 @@ async def generate_user_id(role: str, bot: Bot = None) -> str:
 
 async def generate_item_id(counter_name: str, prefix: str, bot: Bot = None) -> str:
     """Элемент (product/request) учун уникал ID яратади."""
-    if counter_name not in ("products", "requests"):
+    if counter_name not in ITEM_ID_COUNTERS:
         raise ValueError(f"Йўқ счетчик номи: {counter_name}. Керакли: 'products' ёки 'requests'")
-    MAX_ATTEMPTS = 10000
     try:
-        async with db_lock:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                await conn.execute("BEGIN TRANSACTION")
-                logger.debug(f"SQL: SELECT value FROM counters WHERE name = '{counter_name}'")
-                async with conn.execute("SELECT value FROM counters WHERE name = ?", (counter_name,)) as cursor:
-                    result = await cursor.fetchone()
-                    current_value = result[0] if result else 0
-                new_value = current_value
-                table = "products" if counter_name == "products" else "requests"
-                attempts = 0
-                while attempts < MAX_ATTEMPTS:
-                    new_value += 1
-                    unique_id = f"{prefix}-{new_value:04d}"
-                    logger.debug(f"SQL: SELECT unique_id FROM {table} WHERE unique_id = '{unique_id}'")
-                    async with conn.execute(f"SELECT unique_id FROM {table} WHERE unique_id = ?", (unique_id,)) as cursor:
-                        if not await cursor.fetchone():
-                            logger.debug(f"SQL: INSERT OR REPLACE INTO counters (name, value) VALUES ('{counter_name}', {new_value})")
-                            await conn.execute(
-                                "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)",
-                                (counter_name, new_value)
-                            )
-                            await conn.commit()
-                            logger.debug(f"Яратилган unique_id: {unique_id} за {attempts + 1} уриниш")
-                            return unique_id
-                    attempts += 1
-                logger.error(f"{counter_name} учун уникал ID ни {MAX_ATTEMPTS} уринишдан кейин яратиб бўлмади")
-                await conn.execute("ROLLBACK")
-                await notify_admin(f"{counter_name} учун уникал ID ни {MAX_ATTEMPTS} уринишдан кейин яратиб бўлмади", bot=bot)
-                raise ValueError(f"{MAX_ATTEMPTS} уринишдан кейин уникал ID яратиб бўлмади")
+        unique_id = f"{prefix}-{await _next_counter_value(counter_name):04d}"
+        logger.debug(f"Яратилган unique_id: {unique_id}")
+        return unique_id
     except aiosqlite.Error as e:
         logger.error(f"{counter_name} учун item_id яратишда хатолик: {e}")
         await notify_admin(f"{counter_name} учун item_id яратишда хатолик: {str(e)}", bot=bot)
@@ -429,37 +993,31 @@ async def ensure_payment_record(user_id: int, bot: Bot = None) -> None:
         await notify_admin(f"Неверный тип user_id: {type(user_id)}", bot=bot)
         raise ValueError(f"User_id учун бутун сон керак, олинди: {type(user_id)}")
     logger.debug(f"Фойдаланувчи user_id={user_id} учун тўлов ёзувини таъминлаш")
-    for attempt in range(3):
-        try:
-            async with db_lock:
-                async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                    await conn.execute("BEGIN TRANSACTION")
-                    logger.debug(f"SQL: SELECT name FROM sqlite_master WHERE type='table' AND name='payments'")
-                    async with conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='payments'") as cursor:
-                        if not await cursor.fetchone():
-                            logger.error("Таблица payments не существует")
-                            await notify_admin("Таблица payments не существует при создании записи оплаты", bot=bot)
-                            await conn.execute("ROLLBACK")
-                            raise aiosqlite.Error("Таблица payments не существует")
-                    logger.debug(f"SQL: INSERT OR IGNORE INTO payments (user_id, bot_expires, trial_used) VALUES ({user_id}, NULL, 0)")
-                    await conn.execute(
-                        "INSERT OR IGNORE INTO payments (user_id, bot_expires, trial_used) VALUES (?, NULL, 0)",
-                        (user_id,)
-                    )
-                    await conn.commit()
-            logger.info(f"Фойдаланувчи user_id={user_id} учун тўлов ёзуви яратилди")
-            return
-        except aiosqlite.Error as e:
-            logger.error(f"Попытка {attempt + 1}/3: user_id={user_id} хатолик в ensure_payment_record: {e}")
-            if "database is locked" in str(e) and attempt < 2:
-                await asyncio.sleep(10)
-            else:
-                await notify_admin(f"Фойдаланувчи user_id={user_id} тўлов ёзувини яратиб бўлмади (3 попытки): {str(e)}", bot=bot)
-                raise
-        except Exception as e:
-            logger.error(f"Фойдаланувчи user_id={user_id} тўлов ёзувини яратишда кутмаган хатолик: {e}")
-            await notify_admin(f"Фойдаланувчи user_id={user_id} тўлов ёзувини яратишда кутмаган хатолик: {str(e)}", bot=bot)
-            raise
+
+    async def job(conn: aiosqlite.Connection) -> None:
+        logger.debug("SQL: SELECT name FROM sqlite_master WHERE type='table' AND name='payments'")
+        async with conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='payments'") as cursor:
+            if not await cursor.fetchone():
+                logger.error("Таблица payments не существует")
+                await notify_admin("Таблица payments не существует при создании записи оплаты", bot=bot)
+                raise aiosqlite.Error("Таблица payments не существует")
+        logger.debug("SQL: INSERT OR IGNORE INTO payments (user_id, bot_expires, trial_used) VALUES (%s, NULL, 0)", user_id)
+        await conn.execute(
+            "INSERT OR IGNORE INTO payments (user_id, bot_expires, trial_used) VALUES (?, NULL, 0)",
+            (user_id,)
+        )
+
+    try:
+        await run_write(job)
+        logger.info(f"Фойдаланувчи user_id={user_id} учун тўлов ёзуви яратилди")
+    except aiosqlite.Error as e:
+        logger.error(f"Фойдаланувчи user_id={user_id} тўлов ёзувини яратишда хатолик: {e}")
+        await notify_admin(f"Фойдаланувчи user_id={user_id} тўлов ёзувини яратиб бўлмади: {str(e)}", bot=bot)
+        raise
+    except Exception as e:
+        logger.error(f"Фойдаланувчи user_id={user_id} тўлов ёзувини яратишда кутмаган хатолик: {e}")
+        await notify_admin(f"Фойдаланувчи user_id={user_id} тўлов ёзувини яратишда кутмаган хатолик: {str(e)}", bot=bot)
+        raise
 
 async def activate_trial(user_id: int, bot: Bot = None) -> None:
     """Фойдаланувчига 3 кунлик синов муддатини фаоллаштиради."""
@@ -468,51 +1026,48 @@ async def activate_trial(user_id: int, bot: Bot = None) -> None:
         await notify_admin(f"Неверный тип user_id: {type(user_id)}", bot=bot)
         raise ValueError(f"User_id учун бутун сон керак, олинди: {type(user_id)}")
     logger.debug(f"Фойдаланувчи user_id={user_id} учун синов муддатини фаоллаштириш")
-    for attempt in range(3):
-        try:
-            async with db_lock:
-                async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                    await conn.execute("BEGIN TRANSACTION")
-                    trial_expires = datetime.now(pytz.timezone('Asia/Tashkent')) + timedelta(days=3)
-                    trial_expires_str = format_uz_datetime(trial_expires)
-                    logger.debug(f"SQL: INSERT OR REPLACE INTO payments (user_id, bot_expires, trial_used) VALUES ({user_id}, '{trial_expires_str}', 1)")
-                    await conn.execute(
-                        "INSERT OR REPLACE INTO payments (user_id, bot_expires, trial_used) VALUES (?, ?, 1)",
-                        (user_id, trial_expires_str)
-                    )
-                    await conn.commit()
-            logger.info(f"Фойдаланувчи user_id={user_id} учун синов муддати активирован до {trial_expires_str}")
-            return
-        except aiosqlite.Error as e:
-            logger.error(f"Попытка {attempt + 1}/3: user_id={user_id} хатолик в activate_trial: {e}")
-            if "database is locked" in str(e) and attempt < 2:
-                await asyncio.sleep(10)
-            else:
-                await notify_admin(f"Фойдаланувчи user_id={user_id} синов муддатини активировать бўлмади (3 попытки): {str(e)}", bot=bot)
-                raise
-        except Exception as e:
-            logger.error(f"Фойдаланувчи user_id={user_id} синов муддатини активировать бўлмади: {e}")
-            await notify_admin(f"Фойдаланувчи user_id={user_id} синов муддатини активировать бўлмади: {str(e)}", bot=bot)
-            raise
+    trial_expires = datetime.now(pytz.timezone('Asia/Tashkent')) + timedelta(days=3)
+    trial_expires_str = format_uz_datetime(trial_expires)
+
+    async def job(conn: aiosqlite.Connection) -> None:
+        logger.debug("SQL: INSERT OR REPLACE INTO payments (user_id, bot_expires, trial_used) VALUES (%s, '%s', 1)", user_id, trial_expires_str)
+        await conn.execute(
+            "INSERT OR REPLACE INTO payments (user_id, bot_expires, trial_used) VALUES (?, ?, 1)",
+            (user_id, trial_expires_str)
+        )
+
+    try:
+        await run_write(job)
+        await subscription_cache.invalidate(user_id)
+        logger.info(f"Фойдаланувчи user_id={user_id} учун синов муддати активирован до {trial_expires_str}")
+    except aiosqlite.Error as e:
+        logger.error(f"Фойдаланувчи user_id={user_id} синов муддатини активировать бўлмади: {e}")
+        await notify_admin(f"Фойдаланувчи user_id={user_id} синов муддатини активировать бўлмади: {str(e)}", bot=bot)
+        raise
+    except Exception as e:
+        logger.error(f"Фойдаланувчи user_id={user_id} синов муддатини активировать бўлмади: {e}")
+        await notify_admin(f"Фойдаланувчи user_id={user_id} синов муддатини активировать бўлмади: {str(e)}", bot=bot)
+        raise
 
 async def grant_full_subscription(user_id: int, bot: Bot = None) -> None:
     """Фойдаланувчига 30 кунлик тўлиқ обуна беради."""
     if not isinstance(user_id, int):
         raise ValueError(f"User_id учун бутун сон керак, олинди: {type(user_id)}")
+    full_expires = datetime.now(pytz.timezone('Asia/Tashkent')) + timedelta(days=30)
+    full_expires_str = format_uz_datetime(full_expires)
+
+    async def job(conn: aiosqlite.Connection) -> None:
+        logger.debug("SQL: INSERT OR REPLACE INTO payments (user_id, bot_expires, channel_expires, trial_used) VALUES (%s, '%s', '%s', COALESCE((SELECT trial_used FROM payments WHERE user_id = %s), FALSE))", user_id, full_expires_str, full_expires_str, user_id)
+        await conn.execute(
+            "INSERT OR REPLACE INTO payments (user_id, bot_expires, channel_expires, trial_used) "
+            "VALUES (?, ?, ?, COALESCE((SELECT trial_used FROM payments WHERE user_id = ?), FALSE))",
+            (user_id, full_expires_str, full_expires_str, user_id)
+        )
+
     try:
-        full_expires = datetime.now(pytz.timezone('Asia/Tashkent')) + timedelta(days=30)
-        full_expires_str = format_uz_datetime(full_expires)
-        async with db_lock:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                await conn.execute("BEGIN TRANSACTION")
-                logger.debug(f"SQL: INSERT OR REPLACE INTO payments (user_id, bot_expires, channel_expires, trial_used) VALUES ({user_id}, '{full_expires_str}', '{full_expires_str}', COALESCE((SELECT trial_used FROM payments WHERE user_id = {user_id}), FALSE))")
-                await conn.execute(
-                    "INSERT OR REPLACE INTO payments (user_id, bot_expires, channel_expires, trial_used) "
-                    "VALUES (?, ?, ?, COALESCE((SELECT trial_used FROM payments WHERE user_id = ?), FALSE))",
-                    (user_id, full_expires_str, full_expires_str, user_id)
-                )
-                await conn.commit()
-                logger.info(f"Фойдаланувчи user_id={user_id} учун тўлиқ обуна {full_expires_str} гача")
+        await run_write(job)
+        await subscription_cache.invalidate(user_id)
+        logger.info(f"Фойдаланувчи user_id={user_id} учун тўлиқ обуна {full_expires_str} гача")
     except aiosqlite.Error as e:
         logger.error(f"Фойдаланувчи user_id={user_id} учун тўлиқ обуна беришда хатолик: {e}")
         await notify_admin(f"Фойдаланувчи user_id={user_id} учун тўлиқ обуна беришда хатолик: {str(e)}", bot=bot)
@@ -530,76 +1085,66 @@ async def register_user(user_id: int, phone_number: str, bot: Bot = None) -> boo
         raise ValueError("Телефон рақами бўш бўлиши мумкин эмас")
 
     logger.info(f"[register_user] Попытка регистрации user_id={user_id}, phone={phone_number}")
-    for attempt in range(3):
-        try:
-            async with db_lock:
-                async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                    await conn.execute("BEGIN TRANSACTION")
-                    # Проверка на блокировку
-                    logger.debug(f"SQL: SELECT blocked FROM deleted_users WHERE user_id = {user_id} AND blocked = 1")
-                    async with conn.execute(
-                            "SELECT blocked FROM deleted_users WHERE user_id = ? AND blocked = 1", (user_id,)
-                    ) as cursor:
-                        blocked = await cursor.fetchone()
-                        if blocked:
-                            logger.warning(f"Блокланган фойдаланувчи user_id={user_id} рўйхатдан ўтишга уринди")
-                            await conn.execute("ROLLBACK")
-                            return False
-
-                    # Проверка на существующего пользователя по user_id или phone_number
-                    logger.debug(f"SQL: SELECT id, phone_number FROM users WHERE id = {user_id} OR phone_number = '{phone_number}'")
-                    async with conn.execute(
-                            "SELECT id, phone_number FROM users WHERE id = ? OR phone_number = ?",
-                            (user_id, phone_number)
-                    ) as cursor:
-                        existing_user = await cursor.fetchone()
-                        if existing_user:
-                            if existing_user[0] == user_id:
-                                logger.info(f"Фойдаланувчи user_id={user_id} уже существует, phone_number={existing_user[1]}")
-                                await conn.execute("ROLLBACK")
-                                return True
-                            else:
-                                logger.warning(f"Телефон рақами {phone_number} уже зарегистрирован другим пользователем user_id={existing_user[0]}")
-                                await conn.execute("ROLLBACK")
-                                return False
-
-                    # Регистрация нового пользователя
-                    logger.debug(f"SQL: INSERT INTO users (id, phone_number) VALUES ({user_id}, '{phone_number}')")
-                    await conn.execute(
-                        "INSERT INTO users (id, phone_number) VALUES (?, ?)",
-                        (user_id, phone_number)
-                    )
 
-                    # Временно отключено для теста
-                    # logger.debug(f"Фойдаланувчи user_id={user_id} учун тўлов ёзуви таъминланмоқда")
-                    # await ensure_payment_record(user_id, bot=bot)
+    async def job(conn: aiosqlite.Connection) -> bool:
+        # Проверка на блокировку
+        logger.debug("SQL: SELECT blocked FROM deleted_users WHERE user_id = %s AND blocked = 1", user_id)
+        async with conn.execute(
+                "SELECT blocked FROM deleted_users WHERE user_id = ? AND blocked = 1", (user_id,)
+        ) as cursor:
+            if await cursor.fetchone():
+                logger.warning(f"Блокланган фойдаланувчи user_id={user_id} рўйхатдан ўтишга уринди")
+                return False
 
-                    await conn.commit()
-                    logger.info(f"Фойдаланувчи user_id={user_id} телефон {phone_number} билан рўйхатдан ўтди")
+        # Проверка на существующего пользователя по user_id или phone_number
+        logger.debug("SQL: SELECT id, phone_number FROM users WHERE id = %s OR phone_number = '%s'", user_id, phone_number)
+        async with conn.execute(
+                "SELECT id, phone_number FROM users WHERE id = ? OR phone_number = ?",
+                (user_id, phone_number)
+        ) as cursor:
+            existing_user = await cursor.fetchone()
+            if existing_user:
+                if existing_user[0] == user_id:
+                    logger.info(f"Фойдаланувчи user_id={user_id} уже существует, phone_number={existing_user[1]}")
                     return True
-        except aiosqlite.IntegrityError as e:
-            logger.error(f"Попытка {attempt + 1}/3: Фойдаланувчи user_id={user_id} рўйхатдан ўтишда IntegrityError: {e}")
-            await notify_admin(f"Попытка {attempt + 1}/3: Фойдаланувчи user_id={user_id} рўйхатдан ўтишда IntegrityError: {str(e)}", bot=bot)
-            if attempt < 2:
-                await asyncio.sleep(10)
-                continue
-            return False
-        except aiosqlite.Error as e:
-            logger.error(f"Попытка {attempt + 1}/3: user_id={user_id} рўйхатдан ўтишда хатолик: {e}")
-            if "database is locked" in str(e) and attempt < 2:
-                await asyncio.sleep(10)
-            else:
-                await notify_admin(f"Фойдаланувчи user_id={user_id} рўйхатдан ўтишда хатолик (3 попытки): {str(e)}", bot=bot)
-                raise
-        except Exception as e:
-            logger.error(f"Фойдаланувчи user_id={user_id} рўйхатдан ўтишда кутмаган хатолик: {e}")
-            await notify_admin(f"Фойдаланувчи user_id={user_id} рўйхатдан ўтишда кутмаган хатолик: {str(e)}", bot=bot)
-            raise
+                logger.warning(f"Телефон рақами {phone_number} уже зарегистрирован другим пользователем user_id={existing_user[0]}")
+                return False
+
+        # Регистрация нового пользователя
+        logger.debug("SQL: INSERT INTO users (id, phone_number) VALUES (%s, '%s')", user_id, phone_number)
+        await conn.execute(
+            "INSERT INTO users (id, phone_number) VALUES (?, ?)",
+            (user_id, phone_number)
+        )
+
+        # Временно отключено для теста
+        # logger.debug(f"Фойдаланувчи user_id={user_id} учун тўлов ёзуви таъминланмоқда")
+        # await ensure_payment_record(user_id, bot=bot)
+
+        logger.info(f"Фойдаланувчи user_id={user_id} телефон {phone_number} билан рўйхатдан ўтди")
+        return True
+
+    try:
+        return await run_write(job)
+    except aiosqlite.IntegrityError as e:
+        logger.error(f"Фойдаланувчи user_id={user_id} рўйхатдан ўтишда IntegrityError: {e}")
+        await notify_admin(f"Фойдаланувчи user_id={user_id} рўйхатдан ўтишда IntegrityError: {str(e)}", bot=bot)
+        return False
+    except aiosqlite.Error as e:
+        logger.error(f"Фойдаланувчи user_id={user_id} рўйхатдан ўтишда хатолик: {e}")
+        await notify_admin(f"Фойдаланувчи user_id={user_id} рўйхатдан ўтишда хатолик: {str(e)}", bot=bot)
+        raise
+    except Exception as e:
+        logger.error(f"Фойдаланувчи user_id={user_id} рўйхатдан ўтишда кутмаган хатолик: {e}")
+        await notify_admin(f"Фойдаланувчи user_id={user_id} рўйхатдан ўтишда кутмаган хатолик: {str(e)}", bot=bot)
+        raise
 
 async def clear_user_state(user_id: int, storage: RedisStorage, bot: Bot = None) -> None:
     """Принудительно очищает состояние пользователя в Redis."""
     try:
         if hasattr(storage, 'redis'):
+            if isinstance(storage, PipelinedRedisStorage):
+                storage.discard(user_id)
             redis_keys = await storage.redis.keys(f"aiogram:*:{user_id}:*")
             if redis_keys:
                 await storage.redis.delete(*redis_keys)
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import aiosqlite
+
+from config import DB_NAME, DB_TIMEOUT, DB_POOL_SIZE, DB_PRAGMAS
+
+logger = logging.getLogger(__name__)
+
+# Ожидание соединения дольше этого порога логируется как предупреждение
+SLOW_ACQUIRE_SECONDS = 0.5
+# Размер кэша подготовленных выражений sqlite3 на соединение (по умолчанию 128)
+STATEMENT_CACHE_SIZE = 256
+
+class ConnectionPool:
+    """Пул долгоживущих соединений aiosqlite: фиксированное число читателей и один писатель."""
+
+    def __init__(self, db_name: str, readers: int, timeout: float):
+        self.db_name = db_name
+        self.size = readers
+        self.timeout = timeout
+        self._readers: Optional[asyncio.Queue] = None
+        self._connections: list[aiosqlite.Connection] = []
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._stats = {
+            kind: {"acquired": 0, "wait_total": 0.0, "wait_max": 0.0, "hold_total": 0.0, "hold_max": 0.0}
+            for kind in ("reader", "writer")
+        }
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    def _pragmas(self, read_only: bool) -> list[str]:
+        """PRAGMA, применяемые один раз при открытии соединения (journal_mode задаётся в init_db)."""
+        pragmas = [f"PRAGMA busy_timeout = {int(self.timeout * 1000)}"]
+        pragmas.extend(
+            f"PRAGMA {name} = {value}" for name, value in DB_PRAGMAS.items() if name != "journal_mode"
+        )
+        if read_only:
+            pragmas.append("PRAGMA query_only = ON")
+        return pragmas
+
+    async def _connect(self, read_only: bool) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.db_name, timeout=self.timeout, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in self._pragmas(read_only):
+            await conn.execute(pragma)
+        self._connections.append(conn)
+        return conn
+
+    async def open(self) -> None:
+        """Открывает соединения пула, если они ещё не открыты."""
+        async with self._open_lock:
+            if self.is_open:
+                return
+            try:
+                readers = asyncio.Queue()
+                for _ in range(self.size):
+                    readers.put_nowait(await self._connect(read_only=True))
+                self._writer = await self._connect(read_only=False)
+                self._readers = readers
+                logger.info(f"Пул соединений открыт: {self.size} читателей, 1 писатель ({self.db_name})")
+            except aiosqlite.Error as e:
+                logger.error(f"Ошибка открытия пула соединений: {e}", exc_info=True)
+                await self._close_connections()
+                raise
+
+    async def close(self) -> None:
+        """Закрывает все соединения пула."""
+        async with self._open_lock:
+            if not self.is_open:
+                return
+            await self._close_connections()
+            logger.info(f"Пул соединений закрыт, статистика: {self.stats()}")
+
+    async def _close_connections(self) -> None:
+        for conn in self._connections:
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.warning(f"Ошибка закрытия соединения пула: {e}")
+        self._connections = []
+        self._readers = None
+        self._writer = None
+
+    def _record(self, kind: str, waited: float, held: float) -> None:
+        stats = self._stats[kind]
+        stats["acquired"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+        stats["hold_total"] += held
+        stats["hold_max"] = max(stats["hold_max"], held)
+        if waited > SLOW_ACQUIRE_SECONDS:
+            logger.warning(f"Долгое ожидание соединения ({kind}): {waited:.3f} сек")
+
+    def stats(self) -> dict:
+        """Возвращает статистику ожидания и удержания соединений."""
+        result = {}
+        for kind, stats in self._stats.items():
+            acquired = stats["acquired"] or 1
+            result[kind] = {
+                "acquired": stats["acquired"],
+                "wait_avg_ms": round(stats["wait_total"] / acquired * 1000, 3),
+                "wait_max_ms": round(stats["wait_max"] * 1000, 3),
+                "hold_avg_ms": round(stats["hold_total"] / acquired * 1000, 3),
+                "hold_max_ms": round(stats["hold_max"] * 1000, 3),
+            }
+        result["readers_idle"] = self._readers.qsize() if self._readers else 0
+        return result
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Выдаёт соединение только для чтения."""
+        if not self.is_open:
+            await self.open()
+        started = time.perf_counter()
+        conn = await asyncio.wait_for(self._readers.get(), timeout=self.timeout)
+        acquired = time.perf_counter()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                await conn.rollback()
+            if self._readers is not None:
+                self._readers.put_nowait(conn)
+            self._record("reader", acquired - started, time.perf_counter() - acquired)
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Выдаёт единственное соединение для записи; незавершённая транзакция откатывается."""
+        if not self.is_open:
+            await self.open()
+        started = time.perf_counter()
+        await asyncio.wait_for(self._writer_lock.acquire(), timeout=self.timeout)
+        acquired = time.perf_counter()
+        conn = self._writer
+        try:
+            yield conn
+        finally:
+            try:
+                if conn.in_transaction:
+                    logger.warning("Транзакция писателя не завершена, выполняется откат")
+                    await conn.rollback()
+            finally:
+                self._writer_lock.release()
+                self._record("writer", acquired - started, time.perf_counter() - acquired)
+
+pool = ConnectionPool(DB_NAME, DB_POOL_SIZE, DB_TIMEOUT)
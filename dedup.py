@@ -0,0 +1,99 @@
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+import aiosqlite
+
+from config import DEDUP_CACHE_SIZE, DEDUP_TTL, DEDUP_RING_SIZE
+from database import run_write
+
+logger = logging.getLogger(__name__)
+
+class UpdateDeduplicator:
+    """Отсекает повторные update_id: LRU в памяти, затем Redis SET NX с TTL, иначе кольцо в SQLite."""
+
+    def __init__(self, cache_size: int, ttl: int, ring_size: int):
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.ring_size = ring_size
+        self.redis = None
+        # update_id -> где поставлена отметка ("redis" или "sqlite"), чтобы forget снимал её только там
+        self._seen: OrderedDict[int, Optional[str]] = OrderedDict()
+        self._stats = {"memory": 0, "redis": 0, "sqlite": 0, "new": 0}
+
+    def attach_redis(self, redis) -> None:
+        """Подключает клиент Redis (storage.redis); без него используется SQLite."""
+        self.redis = redis
+
+    def _remember(self, update_id: int) -> bool:
+        """Запоминает update_id в LRU; возвращает True, если он уже был."""
+        if update_id in self._seen:
+            self._seen.move_to_end(update_id)
+            return True
+        self._seen[update_id] = None
+        if len(self._seen) > self.cache_size:
+            self._seen.popitem(last=False)
+        return False
+
+    async def is_duplicate(self, update_id: int) -> bool:
+        """Отмечает update_id как обработанный и сообщает, встречался ли он раньше."""
+        if self._remember(update_id):
+            self._stats["memory"] += 1
+            return True
+
+        if self.redis is not None:
+            try:
+                added = await self.redis.set(f"dedup:update:{update_id}", 1, nx=True, ex=self.ttl)
+                return self._count(update_id, not added, "redis")
+            except Exception as e:
+                logger.warning(f"Redis недоступен для дедупликации update_id={update_id}, используется SQLite: {e}")
+
+        return self._count(update_id, await self._check_sqlite(update_id), "sqlite")
+
+    def _count(self, update_id: int, duplicate: bool, source: str) -> bool:
+        self._stats[source if duplicate else "new"] += 1
+        if not duplicate and update_id in self._seen:
+            self._seen[update_id] = source
+        return duplicate
+
+    async def _check_sqlite(self, update_id: int) -> bool:
+        ring_size = self.ring_size
+
+        async def job(conn: aiosqlite.Connection) -> bool:
+            async with conn.execute(
+                "INSERT OR IGNORE INTO processed_updates (update_id) VALUES (?)", (update_id,)
+            ) as cursor:
+                inserted = cursor.rowcount == 1
+            if inserted:
+                # update_id у Telegram монотонно растёт, поэтому старые записи отрезаются диапазоном по ключу
+                await conn.execute(
+                    "DELETE FROM processed_updates WHERE update_id <= ?", (update_id - ring_size,)
+                )
+            return not inserted
+
+        return await run_write(job)
+
+    async def forget(self, update_id: int) -> None:
+        """Снимает отметку с update_id, если обновление не удалось принять в обработку.
+
+        Отметка снимается там, где её поставил is_duplicate; если update_id уже вытеснен из LRU — в обоих хранилищах.
+        """
+        source = self._seen.pop(update_id, None)
+        if self.redis is not None and source != "sqlite":
+            try:
+                await self.redis.delete(f"dedup:update:{update_id}")
+            except Exception as e:
+                logger.warning(f"Ошибка удаления отметки update_id={update_id} из Redis: {e}")
+        if source == "redis":
+            return
+
+        async def job(conn: aiosqlite.Connection) -> None:
+            await conn.execute("DELETE FROM processed_updates WHERE update_id = ?", (update_id,))
+
+        await run_write(job)
+
+    def stats(self) -> dict:
+        """Возвращает число повторов по источникам и размер LRU."""
+        return {**self._stats, "cached": len(self._seen)}
+
+update_dedup = UpdateDeduplicator(DEDUP_CACHE_SIZE, DEDUP_TTL, DEDUP_RING_SIZE)
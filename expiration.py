@@ -2,14 +2,19 @@ import aiosqlite
 import asyncio
 import logging
 from datetime import datetime, timedelta
+from typing import Optional
 import pytz
 from aiogram import Bot, Router, F
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.base import StorageKey
-from config import DB_NAME, DB_TIMEOUT, ADMIN_IDS, CHANNEL_ID
-from utils import format_uz_datetime, parse_uz_datetime, make_keyboard, check_subscription, notify_admin, validate_number_minimal
+from config import ADMIN_IDS, CHANNEL_ID
+from database import FINAL_PRICE_DEADLINE, run_write
+from db_pool import pool
+from profile_cache import user_profiles
+from repositories import ProductRepo, RequestRepo, UserRepo
+from utils import format_uz_datetime, to_epoch, make_keyboard, check_subscription, notify_admin, validate_number_minimal
 
 logger = logging.getLogger(__name__)
 
@@ -19,32 +24,27 @@ class ExpiredStates(StatesGroup):
     choice = State()
     final_price = State()
 
-async def auto_archive_pending(conn: aiosqlite.Connection, table: str, unique_id: str, archived_at: str, bot: Bot) -> bool:
-    """Архивирует или удаляет элемент (эълон или сўров) по unique_id в указанной таблице."""
+async def auto_archive_pending(table: str, unique_id: str, archived_at: str, bot: Bot) -> bool:
+    """Архивирует или удаляет элемент (эълон или сўров) по unique_id в указанной таблице.
+
+    Запись идёт короткой транзакцией через run_write; канал и пользователь уведомляются после commit.
+    """
     try:
-        async with conn.execute(
-            f"SELECT channel_message_id, user_id FROM {table} WHERE unique_id = ? AND status = 'pending_response'",
-            (unique_id,)
-        ) as cursor:
-            item = await cursor.fetchone()
-        if not item:
-            logger.info(f"Элемент {unique_id} в таблице {table} не найден или не в статусе pending_response")
-            return False
-        channel_message_id, user_id = item
         if table == "products":
             # Для объявлений: архивирование
-            await conn.execute(
-                f"UPDATE {table} SET status = 'archived', archived_at = ? WHERE unique_id = ?",
-                (archived_at, unique_id)
-            )
+            async def job(conn: aiosqlite.Connection) -> Optional[tuple]:
+                return await ProductRepo.archive_pending(conn, unique_id, archived_at)
             action = "архивга ўтказилди"
         else:
             # Для запросов: удаление
-            await conn.execute(
-                f"DELETE FROM {table} WHERE unique_id = ?",
-                (unique_id,)
-            )
+            async def job(conn: aiosqlite.Connection) -> Optional[tuple]:
+                return await RequestRepo.delete_pending(conn, unique_id)
             action = "ўчирилди"
+        item = await run_write(job)
+        if not item:
+            logger.info(f"Элемент {unique_id} в таблице {table} не найден или не в статусе pending_response")
+            return False
+        channel_message_id, user_id = item
         if channel_message_id:
             try:
                 await bot.delete_message(chat_id=CHANNEL_ID, message_id=channel_message_id)
@@ -80,14 +80,12 @@ async def notify_user(bot: Bot, user_id: int, unique_id: str, is_request: bool,
     logger.debug(f"notify_user: user_id={user_id}, {table} {unique_id}, текущий статус={current_state}")
 
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                    "SELECT blocked FROM deleted_users WHERE user_id = ? AND blocked = TRUE", (user_id,)
-            ) as cursor:
-                if await cursor.fetchone():
-                    logger.warning(
-                        f"Заблокированный пользователь {user_id} не получил уведомление о {table} {unique_id}")
-                    return
+        async with pool.reader() as conn:
+            blocked = await UserRepo.is_blocked(conn, user_id)
+        if blocked:
+            logger.warning(
+                f"Заблокированный пользователь {user_id} не получил уведомление о {table} {unique_id}")
+            return
     except aiosqlite.Error as e:
         logger.error(f"Ошибка базы данных при проверке блокировки для user_id={user_id}: {e}")
         await notify_admin(f"Ошибка базы данных в notify_user для user_id={user_id}: {str(e)}", bot=bot)
@@ -166,11 +164,8 @@ async def handle_expired_choice(message: Message, state: FSMContext):
         await state.set_state(ExpiredStates.final_price)
     elif choice == "Бекор қилиш":
         try:
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                await conn.execute(
-                    f"UPDATE {table} SET status = 'archived', archived_at = ? WHERE unique_id = ?",
-                    (format_uz_datetime(datetime.now(pytz.UTC)), unique_id)
-                )
+            async with pool.writer() as conn:
+                await ProductRepo.archive_pending(conn, unique_id, format_uz_datetime(datetime.now(pytz.UTC)))
                 await conn.commit()
             await message.answer(
                 f"{action_type} {unique_id} бекор қилинди.",
@@ -242,11 +237,8 @@ async def handle_final_price(message: Message, state: FSMContext):
         return
 
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            await conn.execute(
-                f"UPDATE {table} SET final_price = ?, status = 'completed', completed_at = ? WHERE unique_id = ?",
-                (final_price, format_uz_datetime(datetime.now(pytz.UTC)), unique_id)
-            )
+        async with pool.writer() as conn:
+            await ProductRepo.complete(conn, unique_id, final_price, format_uz_datetime(datetime.now(pytz.UTC)))
             await conn.commit()
         await message.answer(
             f"{action_type} {unique_id} якуний нарҳи {final_price:,.0f} сўм билан якунланди.",
@@ -264,6 +256,74 @@ async def handle_final_price(message: Message, state: FSMContext):
         )
         await state.clear()
 
+async def notify_final_price_due(bot: Bot, user_id: int, unique_id: str) -> None:
+    """Один раз сообщает пользователю, что для эълона нужно ввести final_price."""
+    try:
+        await bot.send_message(
+            user_id,
+            f"Эълон {unique_id} муддати (48 соат) тугади! Илтимос, якуний нархни киритинг. "
+            f"Бунгача ботдан фойдаланишингиз чекланади.",
+            reply_markup=make_keyboard(["Эълонни ёпиш"], one_time=True)
+        )
+        logger.info(f"Отправлено уведомление о вводе final_price для user_id={user_id}, unique_id={unique_id}")
+    except Exception as e:
+        logger.error(f"Ошибка отправки уведомления user_id={user_id}, unique_id={unique_id}: {e}")
+        await notify_admin(f"Ошибка отправки уведомления user_id={user_id}, unique_id={unique_id}: {str(e)}", bot=bot)
+
+async def expire_window(bot: Bot, storage, repo: type[ProductRepo] | type[RequestRepo], start_ts: int, end_ts: int,
+                        batch_size: int = 100) -> int:
+    """Переводит активные элементы окна [start_ts, end_ts] в pending_response и уведомляет владельцев.
+
+    Каждый батч помечается отдельной короткой транзакцией через run_write; сообщения в Telegram
+    отправляются только после её commit, поэтому соединение писателя не ждёт сети.
+    """
+    is_request = repo is RequestRepo
+    item_name = "Сўров" if is_request else "Эълон"
+    expired_count = 0
+    last_id = 0
+    while True:
+        async with pool.reader() as conn:
+            items = await repo.expiring_window(conn, start_ts, end_ts, last_id, batch_size)
+        logger.debug(f"Фаол {repo.table} сони батчда: {len(items)}")
+        if not items:
+            break
+        last_id = items[-1][0]
+        unique_ids = [item[2] for item in items]
+
+        async def job(conn: aiosqlite.Connection) -> list[str]:
+            return await repo.mark_pending_response(conn, unique_ids)
+
+        marked = set(await run_write(job))
+        if not is_request:
+            # Смена статуса эълона снимает final_price_due триггером — кэш профиля устарел
+            for user_id in {item[1] for item in items if item[2] in marked}:
+                await user_profiles.invalidate(user_id)
+        for _, user_id, unique_id, created_ts in items:
+            if unique_id not in marked:
+                continue
+            try:
+                expiration_time = datetime.fromtimestamp(created_ts, pytz.timezone('Asia/Tashkent')) + timedelta(hours=48)
+                state = FSMContext(
+                    storage=storage,
+                    key=StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)
+                )
+                logger.debug(f"{item_name} {unique_id} муддати тугади, срок: {format_uz_datetime(expiration_time)}")
+                await notify_user(bot, user_id, unique_id, is_request=is_request, state=state)
+                expired_count += 1
+                logger.debug(f"{item_name} {unique_id} pending_response сифатида белгиланди")
+            except Exception as e:
+                logger.error(f"FSMContext хатоси user_id={user_id}, {item_name.lower()} {unique_id}: {e}")
+                await notify_admin(
+                    f"check_expired_items да FSMContext хатоси user_id={user_id}: {str(e)}", bot=bot)
+                await bot.send_message(
+                    user_id,
+                    "Хатолик юз берди. Админ билан боғланинг (@ad_mbozor).",
+                    reply_markup=make_keyboard(["Асосий меню"], columns=1)
+                )
+        if len(items) < batch_size:
+            break
+    return expired_count
+
 async def check_expired_items(bot: Bot, storage):
     """Фоновая задача для проверки истёкших элементов и отправки уведомлений о финальной цене."""
     logger.info("Фоновая вазифа ишга туширилди: истекший элементларни текшириш")
@@ -271,135 +331,35 @@ async def check_expired_items(bot: Bot, storage):
         while True:
             try:
                 now = datetime.now(pytz.timezone('Asia/Tashkent'))
-                cutoff_time = now - timedelta(hours=49)
-                cutoff_time_str = format_uz_datetime(cutoff_time)
-                logger.debug(f"Истекший элементларни текшириш, cutoff_time={cutoff_time_str}")
-
-                async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                    async with conn.execute(
-                        "SELECT unique_id, created_at FROM requests WHERE status = 'pending_response'"
-                    ) as cursor:
-                        pending = await cursor.fetchall()
-                    for unique_id, created_at in pending:
-                        created_at_dt = parse_uz_datetime(created_at)
-                        if created_at_dt:
-                            created_at_dt = created_at_dt.replace(tzinfo=pytz.timezone('Asia/Tashkent'))
-                        if created_at_dt and now > created_at_dt + timedelta(hours=48):
-                            await auto_archive_pending(conn, "requests", unique_id, format_uz_datetime(now), bot)
-                            logger.info(f"Сўров {unique_id} автомат равишда ўчирилди (pending_response)")
+                now_ts = to_epoch(now)
+                # Истекают элементы старше 48 часов; активные берём только из последнего часа после истечения
+                expiry_cutoff_ts = now_ts - 48 * 3600
+                window_start_ts = now_ts - 49 * 3600
+                logger.debug(f"Истекший элементларни текшириш, cutoff_time={format_uz_datetime(now - timedelta(hours=49))}")
 
-                    async with conn.execute(
-                        "SELECT unique_id, created_at FROM products WHERE status = 'pending_response'"
-                    ) as cursor:
-                        pending = await cursor.fetchall()
-                    for unique_id, created_at in pending:
-                        created_at_dt = parse_uz_datetime(created_at)
-                        if created_at_dt:
-                            created_at_dt = created_at_dt.replace(tzinfo=pytz.timezone('Asia/Tashkent'))
-                        if created_at_dt and now > created_at_dt + timedelta(hours=48):
-                            await auto_archive_pending(conn, "products", unique_id, format_uz_datetime(now), bot)
-                            logger.info(f"Эълон {unique_id} автомат равишда архивга ўтказилди (pending_response)")
+                async with pool.reader() as conn:
+                    pending_requests = await RequestRepo.pending_expired(conn, expiry_cutoff_ts)
+                    pending_products = await ProductRepo.pending_expired(conn, expiry_cutoff_ts)
+                for unique_id in pending_requests:
+                    if await auto_archive_pending("requests", unique_id, format_uz_datetime(now), bot):
+                        logger.info(f"Сўров {unique_id} автомат равишда ўчирилди (pending_response)")
+                for unique_id in pending_products:
+                    if await auto_archive_pending("products", unique_id, format_uz_datetime(now), bot):
+                        logger.info(f"Эълон {unique_id} автомат равишда архивга ўтказилди (pending_response)")
 
-                    batch_size = 100
-                    offset = 0
-                    expired_count = 0
-                    while True:
-                        async with conn.execute(
-                            """
-                            SELECT r.user_id, r.unique_id, r.created_at 
-                            FROM requests r JOIN users u ON r.user_id = u.id 
-                            WHERE r.status = 'active' AND r.created_at >= ? 
-                            LIMIT ? OFFSET ?
-                            """,
-                            (cutoff_time_str, batch_size, offset)
-                        ) as cursor:
-                            requests = await cursor.fetchall()
-                        offset += batch_size
-                        logger.debug(f"Фаол сўровлар сони батчда: {len(requests)}")
-                        for user_id, unique_id, created_at in requests:
-                            try:
-                                created_at_dt = parse_uz_datetime(created_at)
-                                if created_at_dt:
-                                    created_at_dt = created_at_dt.replace(tzinfo=pytz.timezone('Asia/Tashkent'))
-                                if not created_at_dt:
-                                    logger.warning(f"Сўров {unique_id} учун яроқсиз яратилган сана: {created_at}")
-                                    continue
-                                expiration_time = created_at_dt + timedelta(hours=48)
-                                if now >= expiration_time:
-                                    await conn.execute(
-                                        "UPDATE requests SET status = 'pending_response' WHERE unique_id = ?",
-                                        (unique_id,)
-                                    )
-                                    state = FSMContext(
-                                        storage=storage,
-                                        key=StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)
-                                    )
-                                    logger.debug(f"Сўров {unique_id} муддати тугади, срок: {format_uz_datetime(expiration_time)}")
-                                    await notify_user(bot, user_id, unique_id, is_request=True, state=state)
-                                    expired_count += 1
-                                    logger.debug(f"Сўров {unique_id} pending_response сифатида белгиланди")
-                            except Exception as e:
-                                logger.error(f"FSMContext хатоси user_id={user_id}, сўров {unique_id}: {e}")
-                                await notify_admin(
-                                    f"check_expired_items да FSMContext хатоси user_id={user_id}: {str(e)}", bot=bot)
-                                await bot.send_message(
-                                    user_id,
-                                    "Хатолик юз берди. Админ билан боғланинг (@ad_mbozor).",
-                                    reply_markup=make_keyboard(["Асосий меню"], columns=1)
-                                )
-                        if len(requests) < batch_size:
-                            break
+                expired_count = await expire_window(bot, storage, RequestRepo, window_start_ts, expiry_cutoff_ts)
+                expired_count += await expire_window(bot, storage, ProductRepo, window_start_ts, expiry_cutoff_ts)
 
-                    offset = 0
-                    while True:
-                        async with conn.execute(
-                            """
-                            SELECT p.user_id, p.unique_id, p.created_at, p.final_price 
-                            FROM products p JOIN users u ON p.user_id = u.id 
-                            WHERE p.status = 'active' AND p.created_at >= ? 
-                            LIMIT ? OFFSET ?
-                            """,
-                            (cutoff_time_str, batch_size, offset)
-                        ) as cursor:
-                            products = await cursor.fetchall()
-                        offset += batch_size
-                        logger.debug(f"Фаол эълонлар сони батчда: {len(products)}")
-                        for user_id, unique_id, created_at, final_price in products:
-                            try:
-                                created_at_dt = parse_uz_datetime(created_at)
-                                if created_at_dt:
-                                    created_at_dt = created_at_dt.replace(tzinfo=pytz.timezone('Asia/Tashkent'))
-                                if not created_at_dt:
-                                    logger.warning(f"Эълон {unique_id} учун яроқсиз яратилган сана: {created_at}")
-                                    continue
-                                expiration_time = created_at_dt + timedelta(hours=48)
-                                if now >= expiration_time and final_price is None:
-                                    await conn.execute(
-                                        "UPDATE products SET status = 'pending_response' WHERE unique_id = ?",
-                                        (unique_id,)
-                                    )
-                                    state = FSMContext(
-                                        storage=storage,
-                                        key=StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)
-                                    )
-                                    logger.debug(f"Эълон {unique_id} муддати тугади, срок: {format_uz_datetime(expiration_time)}, final_price отсутствует")
-                                    await notify_user(bot, user_id, unique_id, is_request=False, state=state)
-                                    expired_count += 1
-                                    logger.debug(f"Эълон {unique_id} pending_response сифатида белгиланди")
-                            except Exception as e:
-                                logger.error(f"FSMContext хатоси user_id={user_id}, эълон {unique_id}: {e}")
-                                await notify_admin(
-                                    f"check_expired_items да FSMContext хатоси user_id={user_id}: {str(e)}", bot=bot)
-                                await bot.send_message(
-                                    user_id,
-                                    "Хатолик юз берди. Админ билан боғланинг (@ad_mbozor).",
-                                    reply_markup=make_keyboard(["Асосий меню"], columns=1)
-                                )
-                        if len(products) < batch_size:
-                            break
+                # Эълоны, пропустившие часовое окно (например, бот был остановлен), блокируют пользователя до ввода final_price
+                async def mark_due(conn: aiosqlite.Connection) -> list[tuple[str, int]]:
+                    return await ProductRepo.mark_final_price_due(conn, expiry_cutoff_ts, FINAL_PRICE_DEADLINE)
 
-                    await conn.commit()
-                    logger.info(f"Текширув якунланди: {expired_count} истекший элементлар ишлов берилди")
+                due_products = await run_write(mark_due)
+                for user_id in {user_id for _, user_id in due_products}:
+                    await user_profiles.invalidate(user_id)
+                for unique_id, user_id in due_products:
+                    await notify_final_price_due(bot, user_id, unique_id)
+                logger.info(f"Текширув якунланди: {expired_count} истекший элементлар ишлов берилди, final_price кутилмоқда: {len(due_products)}")
             except aiosqlite.Error as e:
                 logger.error(f"check_expired_items да маълумотлар базаси хатоси: {e}", exc_info=True)
                 await notify_admin(f"check_expired_items да маълумотлар базаси хатоси: {str(e)}", bot=bot)
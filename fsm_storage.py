@@ -0,0 +1,233 @@
+import copy
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+
+logger = logging.getLogger(__name__)
+
+class _BufferedState:
+    """Состояние и данные FSM одного ключа, прочитанные за обновление, и флаги изменений."""
+
+    __slots__ = ("state", "data", "state_dirty", "data_dirty")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state = state
+        self.data = data
+        self.state_dirty = False
+        self.data_dirty = False
+
+# Буфер FSM текущего обновления; None вне update_scope — тогда чтение и запись идут напрямую в Redis
+current_fsm_buffer: ContextVar[Optional[dict[StorageKey, _BufferedState]]] = ContextVar("current_fsm_buffer", default=None)
+
+class PipelinedRedisStorage(BaseStorage):
+    """Обёртка над RedisStorage: состояние и данные ключа читаются одним MGET при первом обращении
+    за обновление, дальше обслуживаются из памяти, а изменения записываются одним конвейером в конце."""
+
+    def __init__(self, storage: RedisStorage):
+        self.storage = storage
+        self.redis = storage.redis
+        self.key_builder = storage.key_builder
+        self._stats = {"updates": 0, "loads": 0, "hits": 0, "flushes": 0, "commands": 0}
+
+    @asynccontextmanager
+    async def update_scope(self) -> AsyncIterator[None]:
+        """Открывает буфер на время обработки одного обновления и сбрасывает его изменения в Redis."""
+        buffer: dict[StorageKey, _BufferedState] = {}
+        token = current_fsm_buffer.set(buffer)
+        self._stats["updates"] += 1
+        try:
+            yield
+        finally:
+            current_fsm_buffer.reset(token)
+            await self.flush(buffer)
+
+    async def _entry(self, key: StorageKey) -> Optional[_BufferedState]:
+        buffer = current_fsm_buffer.get()
+        if buffer is None:
+            return None
+        entry = buffer.get(key)
+        if entry is not None:
+            self._stats["hits"] += 1
+            return entry
+        state, data = await self.redis.mget(self.key_builder.build(key, "state"), self.key_builder.build(key, "data"))
+        if isinstance(state, bytes):
+            state = state.decode("utf-8")
+        data = self.storage.json_loads(data) if data else {}
+        entry = buffer[key] = _BufferedState(state, data)
+        self._stats["loads"] += 1
+        return entry
+
+    async def flush(self, buffer: dict[StorageKey, _BufferedState]) -> None:
+        """Записывает изменённые состояния и данные одним конвейером; у прочитанных продлевает TTL."""
+        pipe = self.redis.pipeline(transaction=False)
+        state_ttl, data_ttl = self.storage.state_ttl, self.storage.data_ttl
+        commands = 0
+        for key, entry in buffer.items():
+            state_key = self.key_builder.build(key, "state")
+            if entry.state_dirty:
+                if entry.state is None:
+                    pipe.delete(state_key)
+                else:
+                    pipe.set(state_key, entry.state, ex=state_ttl)
+                commands += 1
+            elif state_ttl and entry.state is not None:
+                pipe.expire(state_key, state_ttl)
+                commands += 1
+            data_key = self.key_builder.build(key, "data")
+            if entry.data_dirty:
+                if not entry.data:
+                    pipe.delete(data_key)
+                else:
+                    pipe.set(data_key, self.storage.json_dumps(entry.data), ex=data_ttl)
+                commands += 1
+            elif data_ttl and entry.data:
+                pipe.expire(data_key, data_ttl)
+                commands += 1
+        if not commands:
+            return
+        try:
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"Ошибка записи состояния FSM в Redis ({commands} команд): {e}")
+            raise
+        self._stats["flushes"] += 1
+        self._stats["commands"] += commands
+
+    def discard(self, user_id: int) -> None:
+        """Забывает буферизованные состояния пользователя (после прямого удаления его ключей в Redis)."""
+        buffer = current_fsm_buffer.get()
+        if buffer:
+            for key in [key for key in buffer if key.user_id == user_id]:
+                del buffer[key]
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        if entry is None:
+            await self.storage.set_state(key, state)
+            return
+        entry.state = state.state if isinstance(state, State) else state
+        entry.state_dirty = True
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = await self._entry(key)
+        if entry is None:
+            return await self.storage.get_state(key)
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._entry(key)
+        if entry is None:
+            await self.storage.set_data(key, data)
+            return
+        entry.data = data.copy()
+        entry.data_dirty = True
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        entry = await self._entry(key)
+        if entry is None:
+            return await self.storage.get_data(key)
+        return entry.data.copy()
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        entry = await self._entry(key)
+        if entry is None:
+            return await self.storage.update_data(key, data)
+        entry.data.update(data)
+        entry.data_dirty = True
+        return entry.data.copy()
+
+    async def close(self) -> None:
+        await self.storage.close()
+
+    def stats(self) -> dict:
+        """Возвращает число обновлений, загрузок из Redis, чтений из буфера и записанных команд."""
+        return dict(self._stats)
+
+class _MemoryRecord:
+    __slots__ = ("state", "data", "expires_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], expires_at: float):
+        self.state = state
+        self.data = data
+        self.expires_at = expires_at
+
+class BoundedMemoryStorage(BaseStorage):
+    """Резервное хранилище FSM в памяти: LRU не больше max_keys ключей, запись живёт ttl секунд
+    с последнего обращения (как TTL в Redis)."""
+
+    def __init__(self, ttl: int, max_keys: int):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._records: OrderedDict[StorageKey, _MemoryRecord] = OrderedDict()
+        self._stats = {"expired": 0, "evicted": 0}
+
+    def _evict_expired(self, now: float) -> None:
+        # TTL у всех записей одинаковый и продлевается при обращении, поэтому порядок LRU совпадает с порядком истечения
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record.expires_at > now:
+                break
+            del self._records[key]
+            self._stats["expired"] += 1
+
+    def _lookup(self, key: StorageKey) -> Optional[_MemoryRecord]:
+        """Запись ключа с продлением TTL или None; отсутствующий ключ не создаётся и никого не вытесняет."""
+        now = time.monotonic()
+        self._evict_expired(now)
+        record = self._records.get(key)
+        if record is not None:
+            self._records.move_to_end(key)
+            record.expires_at = now + self.ttl
+        return record
+
+    def _record(self, key: StorageKey) -> _MemoryRecord:
+        """Запись ключа для изменения: создаётся при необходимости, сверх max_keys вытесняется самая старая."""
+        record = self._lookup(key)
+        if record is None:
+            record = self._records[key] = _MemoryRecord(None, {}, time.monotonic() + self.ttl)
+            if len(self._records) > self.max_keys:
+                self._records.popitem(last=False)
+                self._stats["evicted"] += 1
+        return record
+
+    def _drop_if_empty(self, key: StorageKey, record: _MemoryRecord) -> None:
+        if record.state is None and not record.data:
+            self._records.pop(key, None)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._drop_if_empty(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._lookup(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = self._record(key)
+        record.data = copy.deepcopy(data)
+        self._drop_if_empty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._lookup(key)
+        return copy.deepcopy(record.data) if record else {}
+
+    async def close(self) -> None:
+        self._records.clear()
+
+    def stats(self) -> dict:
+        """Возвращает число хранимых состояний и удалённых по TTL и по размеру."""
+        return {**self._stats, "size": len(self._records)}
+
+def fsm_scope(storage: BaseStorage):
+    """Буфер FSM на время обработки обновления; для других хранилищ — пустой контекст."""
+    if isinstance(storage, PipelinedRedisStorage):
+        return storage.update_scope()
+    return nullcontext()
@@ -0,0 +1,28 @@
+import json
+import logging
+from typing import Any, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него используется стандартный json
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Сериализует объект в UTF-8 JSON."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def dumps(obj: Any) -> str:
+    """Сериализует объект в JSON-строку."""
+    return dumps_bytes(obj).decode("utf-8")
+
+def loads(data: Union[bytes, bytearray, str]) -> Any:
+    """Разбирает JSON из bytes или str; ошибки — ValueError (json.JSONDecodeError / orjson.JSONDecodeError)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
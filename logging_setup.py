@@ -0,0 +1,78 @@
+import logging
+import queue
+import sys
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+import pytz
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Узбекские названия месяцев по номеру месяца (1-12)
+UZ_MONTHS = ("", "Январ", "Феврал", "Март", "Апрел", "Май", "Июн",
+             "Июл", "Август", "Сентябр", "Октябр", "Ноябр", "Декабр")
+
+class UzbekDateFormatter(logging.Formatter):
+    """Дата записи вида "05 Март 2025 йил 14:03:07"; строка кэшируется на текущую секунду."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cached_second = None
+        self._cached_text = ""
+
+    def formatTime(self, record, datefmt=None):
+        second = int(record.created)
+        if second != self._cached_second:
+            dt = datetime.fromtimestamp(second, tz=pytz.UTC)
+            self._cached_text = f"{dt.day:02d} {UZ_MONTHS[dt.month]} {dt.year} йил {dt:%H:%M:%S}"
+            self._cached_second = second
+        return self._cached_text
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только каждую N-ю DEBUG-запись указанных логгеров; остальные уровни не трогает."""
+
+    def __init__(self, rates: dict[str, int]):
+        super().__init__()
+        self.rates = rates
+        self._counters: dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.DEBUG:
+            return True
+        rate = self.rates.get(record.name)
+        if not rate or rate <= 1:
+            return True
+        count = self._counters.get(record.name, 0)
+        self._counters[record.name] = count + 1
+        return count % rate == 0
+
+def setup_logging(level: int, log_file: str, sample_rates: dict[str, int]) -> QueueListener:
+    """Корневой логгер пишет в очередь, файл и консоль обслуживает поток QueueListener.
+
+    На цикле событий остаются только создание записи и подстановка аргументов;
+    форматирование даты и запись на диск выполняются в отдельном потоке.
+    """
+    formatter = UzbekDateFormatter(LOG_FORMAT)
+    file_handler = RotatingFileHandler(
+        log_file,
+        maxBytes=10 * 1024 * 1024,  # 10 MB
+        backupCount=5,
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=False)
+    listener.start()
+    return listener
@@ -3,7 +3,6 @@ import logging
 import sys
 import os
 from datetime import datetime, timedelta
-import json
 from typing import Dict, Any, Optional
 
 import aiosqlite
@@ -13,29 +12,42 @@ from aiogram.enums import ParseMode
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.redis import RedisStorage
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand, ReplyKeyboardMarkup, KeyboardButton, WebAppInfo, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.web_app import check_webapp_signature
 from quart import Quart, jsonify, request, send_from_directory, Response
+from quart.json.provider import DefaultJSONProvider
 from quart_cors import cors
 import requests
 from redis.asyncio import ConnectionError
 import backoff
-from logging.handlers import RotatingFileHandler
 import pytz
 import hmac
 import hashlib
 import urllib.parse
+from email.utils import formatdate
 import hypercorn
 from hypercorn.config import Config
 from hypercorn.asyncio import serve
 
 from config import (
-    BOT_TOKEN, ROLES, ADMIN_ROLE, LOG_LEVEL, ADMIN_IDS,
-    ROLE_MAPPING, WEBAPP_URL, DB_NAME, DB_TIMEOUT, PORT,
-    WEBHOOK_PATH, CATEGORIES
+    BOT_TOKEN, ROLES, ADMIN_ROLE, LOG_LEVEL, LOG_SAMPLE, ADMIN_IDS,
+    ROLE_MAPPING, WEBAPP_URL, PORT,
+    WEBHOOK_PATH, CATEGORIES, UPDATE_INGEST_MODE, FSM_TIMEOUT, FSM_MEMORY_MAX_KEYS, API_COMPRESS_MIN_SIZE
 )
-from database import init_db
+from database import init_db, close_db, backup_loop
+from logging_setup import setup_logging
+import json_codec
+from compression import compress, negotiate
+from db_pool import pool
+from dedup import update_dedup
+from profile_cache import user_profiles
+from subscription_cache import subscription_cache
+from fsm_storage import BoundedMemoryStorage, PipelinedRedisStorage
+from update_workers import update_workers
+from update_stream import update_stream
+from board_search import fts_match
+from board_snapshot import board_item_dict, board_snapshots
+from repositories import ProductRepo, RequestRepo, UserContext, query_stats, encode_cursor, decode_cursor
 from products import check_expired_products_without_final_price
 from registration import router as registration_router, Registration
 from expiration import router as expiration_router, check_expired_items
@@ -44,9 +56,10 @@ from user_requests import register_handlers as register_request_handlers
 from common import register_handlers as register_common_handlers
 from admin import register_handlers as register_admin_handlers, AdminStates
 from utils import (
-    check_role, make_keyboard, MONTHS_UZ, check_subscription,
-    format_uz_datetime, parse_uz_datetime,
-    get_main_menu, get_admin_menu, notify_admin, invalidate_cache
+    check_role, make_keyboard, check_subscription,
+    to_epoch,
+    get_main_menu, get_admin_menu, notify_admin,
+    load_user_context, current_user_context
 )
 
 WEBHOOK_URL = f"{WEBAPP_URL}{WEBHOOK_PATH}"
@@ -56,33 +69,24 @@ bot: Bot = None
 dp: Dispatcher = None
 
 # Настройка логирования
-class UzbekDateFormatter(logging.Formatter):
-    def formatTime(self, record, datefmt=None):
-        dt = datetime.fromtimestamp(record.created, tz=pytz.UTC)
-        eng_date = dt.strftime("%d %B %Y йил %H:%M:%S")
-        for eng, uz in MONTHS_UZ.items():
-            eng_date = eng_date.replace(eng, uz)
-        return eng_date
-
 logger = logging.getLogger(__name__)
-log_level = getattr(logging, LOG_LEVEL.upper(), logging.DEBUG)
-file_handler = RotatingFileHandler(
-    '/home/mbozor/Mbozor/webhook.log',
-    maxBytes=10 * 1024 * 1024,  # 10 MB
-    backupCount=5,
-    encoding='utf-8'
-)
-file_handler.setLevel(log_level)
-file_handler.setFormatter(UzbekDateFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(log_level)
-console_handler.setFormatter(UzbekDateFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-logging.basicConfig(level=log_level, handlers=[file_handler, console_handler])
+log_level = getattr(logging, LOG_LEVEL.upper(), logging.INFO)
+log_listener = setup_logging(log_level, '/home/mbozor/Mbozor/webhook.log', LOG_SAMPLE)
 
 logging.Formatter.converter = lambda *args: datetime.now(pytz.timezone('Asia/Tashkent')).timetuple()
 
 # Инициализация Quart приложения
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify и request.get_json через json_codec (orjson, если установлен)."""
+
+    def dumps(self, object_: Any, **kwargs: Any) -> str:
+        return json_codec.dumps(object_)
+
+    def loads(self, object_: str | bytes, **kwargs: Any) -> Any:
+        return json_codec.loads(object_)
+
 app = Quart(__name__)
+app.json = FastJSONProvider(app)
 app.config["MAX_CONTENT_LENGTH"] = 1024 * 1024  # 1 MB
 app = cors(app, allow_origin=["http://159.65.7.40", "https://web.telegram.org"], allow_methods=["GET", "POST"],
            allow_headers=["X-Telegram-Init-Data"], allow_credentials=False)
@@ -132,9 +136,9 @@ def manual_check_webapp_signature(token: str, init_data: str) -> bool:
 @app.route('/', methods=['GET', 'HEAD'])
 async def serve_webapp():
     logger.info("Запрос on /")
-    headers = dict(request.headers)
     init_data = request.headers.get("X-Telegram-Init-Data", "Not provided")
-    logger.debug(f"serve_webapp: remote_addr={request.remote_addr}, User-Agent={request.user_agent}, Headers={headers}, Init-Data={init_data}")
+    logger.debug("serve_webapp: remote_addr=%s, User-Agent=%s, Headers=%s, Init-Data=%s",
+                 request.remote_addr, request.user_agent, request.headers, init_data)
     try:
         response = await send_from_directory('/home/mbozor/Mbozor', 'webapp.html')
         response.headers['Content-Type'] = 'text/html; charset=utf-8'
@@ -186,23 +190,41 @@ async def serve_static(filename):
 async def connect_redis():
     logger.info("Попытка подключения к Redis")
     try:
-        storage = RedisStorage.from_url("redis://localhost:6379/0")
+        storage = RedisStorage.from_url("redis://localhost:6379/0", state_ttl=FSM_TIMEOUT, data_ttl=FSM_TIMEOUT)
         await storage.redis.ping()
         logger.info("Успешно подключено к RedisStorage")
-        return storage
+        return PipelinedRedisStorage(storage)
     except ConnectionError as e:
-        logger.warning(f"Не удалось подключиться к Redis: {e}. Используется MemoryStorage.")
+        logger.warning(f"Не удалось подключиться к Redis: {e}. Используется BoundedMemoryStorage.")
         await notify_admin(f"Не удалось подключиться к Redis: {str(e)}", bot=bot)
-        return MemoryStorage()
+        return BoundedMemoryStorage(FSM_TIMEOUT, FSM_MEMORY_MAX_KEYS)
 
 # Middleware для проверки подписки
 class SubscriptionCheckMiddleware(BaseMiddleware):
     async def __call__(self, handler, event: types.Message | types.CallbackQuery, data: dict) -> None:
+        user_id = event.from_user.id
+        user_ctx = None
+        # Админов middleware не проверяет, их контекст обработчики при необходимости загрузят сами
+        if user_id not in ADMIN_IDS:
+            try:
+                user_ctx = await load_user_context(user_id)
+            except (aiosqlite.Error, asyncio.TimeoutError) as e:
+                logger.error(f"Ошибка загрузки контекста пользователя user_id={user_id}: {e}", exc_info=True)
+                await notify_admin(f"Ошибка загрузки контекста пользователя user_id={user_id}: {str(e)}", bot=data["bot"])
+        data["user_ctx"] = user_ctx
+        token = current_user_context.set(user_ctx)
+        try:
+            await self._check(handler, event, data, user_ctx)
+        finally:
+            current_user_context.reset(token)
+
+    async def _check(self, handler, event: types.Message | types.CallbackQuery, data: dict, user_ctx: Optional[UserContext]) -> None:
         user_id = event.from_user.id
         state = data["state"]
         current_state = await state.get_state()
         event_text = event.text if isinstance(event, types.Message) else event.data
-        logger.info(f"Middleware processing: user_id={user_id}, chat_id={event.chat.id if hasattr(event, 'chat') else 'unknown'}, event_text={event_text}, state={current_state}, handler={handler.__name__}")
+        logger.debug("Middleware processing: user_id=%s, event_text=%s, state=%s, handler=%s",
+                     user_id, event_text, current_state, handler.__name__)
 
         data["dp"] = self.dp  # Передаём Dispatcher в data
 
@@ -240,7 +262,10 @@ class SubscriptionCheckMiddleware(BaseMiddleware):
             await handler(event, data)
             return
 
-        allowed, role = await check_role(event, allow_unregistered=True)
+        if user_ctx is None:
+            allowed, role = await check_role(event, allow_unregistered=True)
+        else:
+            allowed, role = user_ctx.role is not None, user_ctx.role
         if not allowed or not role:
             logger.info(f"Незарегистрированный пользователь {user_id} перенаправлен на регистрацию")
             try:
@@ -257,7 +282,10 @@ class SubscriptionCheckMiddleware(BaseMiddleware):
         if role != ADMIN_ROLE:
             # Проверка истёкших объявлений без final_price
             try:
-                has_expired_products = await check_expired_products_without_final_price(data["bot"], user_id)
+                if user_ctx is None:
+                    has_expired_products = await check_expired_products_without_final_price(data["bot"], user_id)
+                else:
+                    has_expired_products = user_ctx.has_expired_products
                 if has_expired_products:
                     logger.info(f"User {user_id} has expired products without final_price, restricting access")
                     try:
@@ -277,7 +305,10 @@ class SubscriptionCheckMiddleware(BaseMiddleware):
 
             # Проверка подписки
             try:
-                _, bot_active, is_subscribed = await check_subscription(data["bot"], user_id, data["dp"].storage)
+                if user_ctx is None:
+                    _, bot_active, is_subscribed = await check_subscription(data["bot"], user_id, data["dp"].storage)
+                else:
+                    bot_active = is_subscribed = user_ctx.subscribed
                 logger.debug(f"Подписка: user_id={user_id}, bot_active={bot_active}, is_subscribed={is_subscribed}")
                 if not is_subscribed:
                     try:
@@ -344,8 +375,8 @@ async def handle_webapp_close(message: types.Message, state: FSMContext):
         return
 
     try:
-        data = json.loads(web_app_data)
-    except json.JSONDecodeError:
+        data = json_codec.loads(web_app_data)
+    except ValueError:
         logger.warning(f"Неверный формат JSON от user_id={user_id}: '{web_app_data}'")
         await message.answer("Неверный формат данных.", reply_markup=get_main_menu(None))
         return
@@ -367,152 +398,165 @@ async def handle_webapp_close(message: types.Message, state: FSMContext):
         logger.warning(f"Неизвестные данные Web App от user_id={user_id}: '{web_app_data}'")
         await message.answer("Неверный формат данных.", reply_markup=get_main_menu(role))
 
-async def get_active_data(table: str, bot: Optional[object] = None) -> Dict[str, any]:
-    """
-    Jadvaldan (products yoki requests) status='active' bo‘lgan ma’lumotlarni oladi, сортируя по created_at DESC.
-    """
-    if table not in ["products", "requests"]:
-        logger.error(f"Недопустимая таблица: {table}")
-        return {"items": [], "total": 0}
-
-    try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            query = f"""
-                SELECT p.*, u.region, u.phone_number
-                FROM {table} p
-                JOIN users u ON p.user_id = u.id
-                WHERE p.status = 'active'
-                ORDER BY p.created_at DESC
-            """
-            count_query = query.replace("SELECT p.*, u.region", "SELECT COUNT(*)").replace("ORDER BY p.created_at DESC", "")
-
-            async with conn.execute(count_query) as cursor:
-                total = (await cursor.fetchone())[0]
-
-            async with conn.execute(query) as cursor:
-                items = await cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description]
-                result = [dict(zip(columns, item)) for item in items]
-
-            for item in result:
-                if "created_at" in item and item["created_at"]:
-                    created_at_dt = parse_uz_datetime(item["created_at"])
-                    if created_at_dt:
-                        item["created_at"] = format_uz_datetime(created_at_dt)
-                    else:
-                        logger.error(f"Ошибка парсинга created_at: {item['created_at']}")
-                        item["created_at"] = "Не указано"
-                if "archived_at" in item and item["archived_at"]:
-                    archived_at_dt = parse_uz_datetime(item["archived_at"])
-                    if archived_at_dt:
-                        item["archived_at"] = format_uz_datetime(archived_at_dt)
-                    else:
-                        logger.error(f"Ошибка парсинга archived_at: {item['archived_at']}")
-                        item["archived_at"] = "Не указано"
-                if "notified" in item:
-                    item["notified"] = bool(item["notified"])
-                if "photos" in item and item["photos"]:
-                    item["photos"] = item["photos"].split(",") if item["photos"] else []
-
-            logger.debug(f"Fetched {len(result)} items from {table}, total: {total}")
-            return {"items": result, "total": total}
-
-    except aiosqlite.Error as e:
-        logger.error(f"Ошибка загрузки данных из {table}: {e}", exc_info=True)
-        if bot:
-            await notify_admin(f"Ошибка загрузки данных из {table}: {str(e)}", bot=bot)
-        return {"items": [], "total": 0}
+ITEM_REPOS = {"products": ProductRepo, "requests": RequestRepo}
+# Наибольший размер страницы доски в API
+MAX_PER_PAGE = 100
+# Срок жизни страницы в кэше: свежесть обеспечивает поколение в ключе, TTL лишь убирает страницы старых поколений
+BOARD_CACHE_TTL = 3600
+# Доска показывает элементы за последние BOARD_WINDOW_DAYS; начало окна округляется до суток (UTC)
+BOARD_WINDOW_DAYS = 30
+BOARD_WINDOW_GRANULARITY = 86400
 
 async def get_all_data(
         table: str,
         storage: Optional[BaseStorage] = None,
         status: Optional[str] = None,
-        page: int = 1,
+        after: Optional[tuple[int, int]] = None,
         per_page: int = 20,
         category: Optional[str] = None,
         region: Optional[str] = None,
         search: Optional[str] = None,
+        with_total: bool = False,
+        generation: Optional[int] = None,
         bot: Optional[Bot] = None
 ) -> Dict[str, Any]:
+    """Страница доски после позиции after; "next" — позиция следующей страницы, "total" — только при with_total.
+    generation — уже прочитанное поколение доски, иначе оно читается здесь."""
     if table not in ["products", "requests"]:
         logger.error(f"Недопустимая таблица: {table}")
-        return {"items": [], "total": 0}
-    offset = (page - 1) * per_page
-    cache_key = f"cache:{table}:{status}:{page}:{per_page}:{category}:{region}:{search}"
+        return {"items": [], "next": None, "total": 0}
+    category = category if category in CATEGORIES else None
+    repo = ITEM_REPOS[table]
     try:
-        if storage and hasattr(storage, 'redis'):
-            await invalidate_cache(storage, table)
-            cached = await storage.redis.get(cache_key)
-            if cached:
-                logger.debug(f"Данные из кэша для {cache_key}")
-                return json.loads(cached)
-    except Exception as e:
-        logger.warning(f"Redis недоступен для {cache_key}: {e}")
-
-    try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            params = [(datetime.now(pytz.UTC) - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')]
-            query = f"""
-                SELECT p.*, u.region, u.phone_number
-                FROM {table} p
-                JOIN users u ON p.user_id = u.id
-                WHERE p.status != 'hidden' AND p.created_at >= ?
-            """
-            if status:
-                query += " AND p.status = ?"
-                params.append(status)
-            if category and category in CATEGORIES:
-                query += " AND p.category = ?"
-                params.append(category)
-            if region:
-                query += " AND u.region = ?"
-                params.append(region)
-            if search:
-                query += " AND (p.sort LIKE ? OR p.category LIKE ?)"
-                search_term = f"%{search}%"
-                params.extend([search_term, search_term])
-            count_query = query.replace("SELECT p.*, u.region", "SELECT COUNT(*)")
-            query += " ORDER BY p.created_at DESC LIMIT ? OFFSET ?"
-            params.extend([per_page, offset])
-
-            async with conn.execute(count_query, params[:-2]) as cursor:
-                total = (await cursor.fetchone())[0]
-            async with conn.execute(query, params) as cursor:
-                items = await cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description]
-                result = [dict(zip(columns, item)) for item in items]
-
-            for item in result:
-                if "created_at" in item and item["created_at"]:
-                    created_at_dt = parse_uz_datetime(item["created_at"])
-                    item["created_at"] = format_uz_datetime(created_at_dt) if created_at_dt else "Не указано"
-                if "archived_at" in item and item["archived_at"]:
-                    archived_at_dt = parse_uz_datetime(item["archived_at"])
-                    item["archived_at"] = format_uz_datetime(archived_at_dt) if archived_at_dt else "Не указано"
-                if "notified" in item:
-                    item["notified"] = bool(item["notified"])
-                if "photos" in item and item["photos"]:
-                    item["photos"] = item["photos"].split(",") if item["photos"] else []
-
-            response = {"items": result, "total": total}
-            try:
-                if storage and hasattr(storage, 'redis'):
-                    await storage.redis.setex(cache_key, 300, json.dumps(response))
-            except Exception as e:
-                logger.warning(f"Redis недоступен для кэширования {cache_key}: {e}")
-            return response
+        if generation is None:
+            async with pool.reader() as conn:
+                generation, _ = await repo.board_version(conn)
+        # Поколение в ключе: после любой записи в таблицу старые страницы просто перестают запрашиваться.
+        # Начало окна тоже в ключе: иначе без записей страница пережила бы сдвиг окна и показывала выпавшие элементы
+        since_ts = to_epoch(datetime.now(pytz.UTC) - timedelta(days=BOARD_WINDOW_DAYS))
+        since_ts -= since_ts % BOARD_WINDOW_GRANULARITY
+        after_key = f"{after[0]}:{after[1]}" if after else ""
+        match = fts_match(search)
+        cache_key = (
+            f"cache:{table}:{generation}:{since_ts}:{status}:{after_key}:{per_page}:{category}:{region}:{match}:{int(with_total)}"
+        )
+        try:
+            if storage and hasattr(storage, 'redis'):
+                cached = await storage.redis.get(cache_key)
+                if cached:
+                    logger.debug(f"Данные из кэша для {cache_key}")
+                    return json_codec.loads(cached)
+        except Exception as e:
+            logger.warning(f"Redis недоступен для {cache_key}: {e}")
+
+        async with pool.reader() as conn:
+            items, next_position = await repo.board_page(
+                conn, since_ts, status=status, category=category, region=region, match=match,
+                limit=per_page, after=after
+            )
+            response = {"items": [board_item_dict(item) for item in items], "next": next_position}
+            if with_total:
+                response["total"] = await repo.board_count(
+                    conn, since_ts, status=status, category=category, region=region, match=match
+                )
+        try:
+            if storage and hasattr(storage, 'redis'):
+                await storage.redis.setex(cache_key, BOARD_CACHE_TTL, json_codec.dumps_bytes(response))
+        except Exception as e:
+            logger.warning(f"Redis недоступен для кэширования {cache_key}: {e}")
+        return response
     except aiosqlite.Error as e:
         logger.error(f"Ошибка загрузки данных из {table}: {e}", exc_info=True)
         await notify_admin(f"Ошибка загрузки данных из {table}: {str(e)}", bot=bot)
-        return {"items": [], "total": 0}
+        return {"items": [], "next": None, "total": 0}
+
+def _board_page_args(sources: int = 1) -> tuple[int, Optional[list], bool]:
+    """per_page, позиции из курсора (None — первая страница) и with_total из аргументов запроса; ValueError при ошибке."""
+    per_page = min(max(int(request.args.get('per_page', 20)), 1), MAX_PER_PAGE)
+    cursor = request.args.get('cursor')
+    positions = decode_cursor(cursor, sources) if cursor else None
+    with_total = request.args.get('with_total', '0').lower() in ('1', 'true')
+    return per_page, positions, with_total
+
+def _board_response(pages: list[Dict[str, Any]], with_total: bool) -> Dict[str, Any]:
+    """Ответ API доски: элементы всех источников, непрозрачный next_cursor и total по запросу."""
+    response = {
+        "items": [item for page in pages for item in page["items"]],
+        "next_cursor": encode_cursor(*(page["next"] for page in pages)),
+    }
+    if with_total:
+        response["total"] = sum(page.get("total", 0) for page in pages)
+    return response
+
+def _validator_headers(etag: str, changed_ts: int) -> Dict[str, str]:
+    """Заголовки валидаторов ответа API: ETag, Last-Modified и обязательная перепроверка у сервера."""
+    return {
+        "ETag": etag,
+        "Last-Modified": formatdate(changed_ts, usegmt=True),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+
+def _not_modified(etag: str, changed_ts: int) -> bool:
+    """Условный запрос: If-None-Match (слабое сравнение, RFC 9110), а без него — If-Modified-Since."""
+    header = request.headers.get("If-None-Match")
+    if header:
+        candidates = {value.strip().removeprefix("W/") for value in header.split(",")}
+        return "*" in candidates or etag.removeprefix("W/") in candidates
+    since = request.if_modified_since
+    return since is not None and changed_ts <= since.timestamp()
+
+async def _board_snapshot_response(table: str) -> Response:
+    """Ответ из снимка доски: 304 при совпадении валидаторов, иначе готовый JSON в согласованной кодировке."""
+    version = await board_snapshots[table].current()
+    encoding = negotiate(request.headers.get("Accept-Encoding"))
+    if len(version.body) < API_COMPRESS_MIN_SIZE:
+        encoding = None
+    etag = version.etag(encoding)
+    headers = _validator_headers(etag, version.changed_ts)
+    if _not_modified(etag, version.changed_ts):
+        return Response(status=304, headers=headers)
+    body = version.body
+    if encoding is not None:
+        body = version.encoded[encoding]
+        headers["Content-Encoding"] = encoding
+    return Response(body, status=200, mimetype="application/json", headers=headers)
+
+async def _board_versions(tables: tuple[str, ...]) -> list[tuple[int, int]]:
+    """Поколение и время изменения доски для каждой таблицы."""
+    async with pool.reader() as conn:
+        return [await ITEM_REPOS[table].board_version(conn) for table in tables]
+
+def _board_page_etag(versions: list[tuple[int, int]]) -> str:
+    """Слабый ETag страницы: поколения таблиц и аргументы запроса (тело зависит только от них)."""
+    generations = "-".join(str(generation) for generation, _ in versions)
+    digest = hashlib.blake2b(request.query_string, digest_size=8).hexdigest()
+    return f'W/"{generations}-{digest}"'
+
+@app.after_request
+async def compress_api_response(response: Response) -> Response:
+    """Сжимает JSON-ответы /api/* крупнее API_COMPRESS_MIN_SIZE в br или gzip по Accept-Encoding."""
+    if not request.path.startswith("/api/") or response.status_code != 200 or "Content-Encoding" in response.headers:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+    body = await response.get_data()
+    if len(body) < API_COMPRESS_MIN_SIZE:
+        return response
+    # Ответы сжимаются на каждый запрос, поэтому уровень средний: почти тот же размер за малую долю времени
+    response.set_data(compress(body, encoding, level=5 if encoding == "br" else 6))
+    response.headers["Content-Encoding"] = encoding
+    return response
 
 @app.route('/api/all_active_products')
 async def get_all_active_products():
     logger.info(f"Запрос на /api/all_active_products, User-Agent: {request.headers.get('User-Agent')}, IP: {request.remote_addr}")
     try:
-        products = await get_active_data("products")
-        logger.info(f"Возвращено {len(products['items'])} продуктов, всего: {products['total']}")
-        return jsonify(products), 200
+        response = await _board_snapshot_response("products")
+        logger.info(f"Ответ /api/all_active_products: {response.status_code}, всего: {board_snapshots['products'].version.total}")
+        return response
     except Exception as e:
         logger.error(f"Ошибка обработки /api/all_active_products: {e}", exc_info=True)
         if bot:
@@ -523,29 +567,42 @@ async def get_all_active_products():
 async def get_all_active_requests():
     logger.info(f"Запрос на /api/all_active_requests, User-Agent: {request.headers.get('User-Agent')}, IP: {request.remote_addr}")
     try:
-        requests_data = await get_active_data("requests")
-        logger.info(f"Возвращено {len(requests_data['items'])} запросов, всего: {requests_data['total']}")
-        return jsonify(requests_data), 200
+        response = await _board_snapshot_response("requests")
+        logger.info(f"Ответ /api/all_active_requests: {response.status_code}, всего: {board_snapshots['requests'].version.total}")
+        return response
     except Exception as e:
         logger.error(f"Ошибка обработки /api/all_active_requests: {e}", exc_info=True)
         if bot:
             await notify_admin(f"Ошибка обработки /api/all_active_requests: {str(e)}", bot=bot)
         return jsonify({"error": "Server error", "details": str(e)}), 500
+
 @app.route('/api/all_products')
 async def get_all_products():
     logger.info(f"Запрос на /api/all_products, args={request.args}")
     init_data = request.headers.get("X-Telegram-Init-Data", "Not provided")
-    headers = dict(request.headers)
-    logger.debug(f"get_all_products: init_data='{init_data}', length={len(init_data) if init_data != 'Not provided' else 0}, remote_addr={request.remote_addr}, Headers={headers}")
+    logger.debug("get_all_products: init_data_length=%s, remote_addr=%s, Headers=%s",
+                 len(init_data) if init_data != 'Not provided' else 0, request.remote_addr, request.headers)
+    try:
+        per_page, positions, with_total = _board_page_args()
+    except ValueError as e:
+        logger.warning(f"Неверные параметры страницы /api/all_products: {e}")
+        return jsonify({"error": "Invalid pagination parameters"}), 400
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
         category = request.args.get('category')
         region = request.args.get('region')
         search = request.args.get('search')
-        products = await get_all_data("products", dp.storage if dp else None, "active", page, per_page, category, region, search, bot=bot)
-        logger.info(f"Возвращено {len(products['items'])} продуктов, всего: {products['total']}")
-        return jsonify(products), 200
+        versions = await _board_versions(("products",))
+        etag = _board_page_etag(versions)
+        headers = _validator_headers(etag, versions[0][1])
+        if _not_modified(etag, versions[0][1]):
+            return Response(status=304, headers=headers)
+        products = await get_all_data(
+            "products", dp.storage if dp else None, "active", positions[0] if positions else None, per_page,
+            category, region, search, with_total, generation=versions[0][0], bot=bot
+        )
+        response = _board_response([products], with_total)
+        logger.info(f"Возвращено {len(response['items'])} продуктов, следующая страница: {bool(response['next_cursor'])}")
+        return jsonify(response), 200, headers
     except Exception as e:
         logger.error(f"Ошибка обработки /api/all_products: {e}", exc_info=True)
         await notify_admin(f"Ошибка обработки /api/all_products: {str(e)}", bot=bot)
@@ -555,17 +612,29 @@ async def get_all_products():
 async def get_all_requests():
     logger.info(f"Запрос на /api/all_requests, args={request.args}")
     init_data = request.headers.get("X-Telegram-Init-Data", "Not provided")
-    headers = dict(request.headers)
-    logger.debug(f"get_all_requests: init_data='{init_data}', length={len(init_data) if init_data != 'Not provided' else 0}, remote_addr={request.remote_addr}, Headers={headers}")
+    logger.debug("get_all_requests: init_data_length=%s, remote_addr=%s, Headers=%s",
+                 len(init_data) if init_data != 'Not provided' else 0, request.remote_addr, request.headers)
+    try:
+        per_page, positions, with_total = _board_page_args()
+    except ValueError as e:
+        logger.warning(f"Неверные параметры страницы /api/all_requests: {e}")
+        return jsonify({"error": "Invalid pagination parameters"}), 400
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
         category = request.args.get('category')
         region = request.args.get('region')
         search = request.args.get('search')
-        requests_data = await get_all_data("requests", dp.storage if dp else None, "active", page, per_page, category, region, search, bot=bot)
-        logger.info(f"Возвращено {len(requests_data['items'])} запросов, всего: {requests_data['total']}")
-        return jsonify(requests_data), 200
+        versions = await _board_versions(("requests",))
+        etag = _board_page_etag(versions)
+        headers = _validator_headers(etag, versions[0][1])
+        if _not_modified(etag, versions[0][1]):
+            return Response(status=304, headers=headers)
+        requests_data = await get_all_data(
+            "requests", dp.storage if dp else None, "active", positions[0] if positions else None, per_page,
+            category, region, search, with_total, generation=versions[0][0], bot=bot
+        )
+        response = _board_response([requests_data], with_total)
+        logger.info(f"Возвращено {len(response['items'])} запросов, следующая страница: {bool(response['next_cursor'])}")
+        return jsonify(response), 200, headers
     except Exception as e:
         logger.error(f"Ошибка обработки /api/all_requests: {e}", exc_info=True)
         await notify_admin(f"Ошибка обработки /api/all_requests: {str(e)}", bot=bot)
@@ -575,20 +644,37 @@ async def get_all_requests():
 async def get_archive():
     logger.info(f"Запрос на /api/archive, args={request.args}")
     init_data = request.headers.get("X-Telegram-Init-Data", "Not provided")
-    headers = dict(request.headers)
-    logger.debug(f"get_archive: init_data='{init_data}', length={len(init_data) if init_data != 'Not provided' else 0}, remote_addr={request.remote_addr}, Headers={headers}")
+    logger.debug("get_archive: init_data_length=%s, remote_addr=%s, Headers=%s",
+                 len(init_data) if init_data != 'Not provided' else 0, request.remote_addr, request.headers)
+    try:
+        per_page, positions, with_total = _board_page_args(sources=2)
+    except ValueError as e:
+        logger.warning(f"Неверные параметры страницы /api/archive: {e}")
+        return jsonify({"error": "Invalid pagination parameters"}), 400
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 20))
         category = request.args.get('category')
         region = request.args.get('region')
         search = request.args.get('search')
-        archived_products = await get_all_data("products", dp.storage if dp else None, "archived", page, per_page, category, region, search, bot=bot)
-        archived_requests = await get_all_data("requests", dp.storage if dp else None, "archived", page, per_page, category, region, search, bot=bot)
-        archived = {"items": archived_products["items"] + archived_requests["items"],
-                    "total": archived_products["total"] + archived_requests["total"]}
-        logger.info(f"Возвращено {len(archived['items'])} архивных записей, всего: {archived['total']}")
-        return jsonify(archived), 200
+        tables = ("products", "requests")
+        versions = await _board_versions(tables)
+        etag = _board_page_etag(versions)
+        changed_ts = max(changed for _, changed in versions)
+        headers = _validator_headers(etag, changed_ts)
+        if _not_modified(etag, changed_ts):
+            return Response(status=304, headers=headers)
+        pages = []
+        for index, table in enumerate(tables):
+            after = None
+            if positions is not None:
+                # Источник, закончившийся на прошлых страницах, запрашивается с позиции (0, 0): пустая страница, но total считается
+                after = positions[index] or (0, 0)
+            pages.append(await get_all_data(
+                table, dp.storage if dp else None, "archived", after, per_page,
+                category, region, search, with_total, generation=versions[index][0], bot=bot
+            ))
+        archived = _board_response(pages, with_total)
+        logger.info(f"Возвращено {len(archived['items'])} архивных записей, следующая страница: {bool(archived['next_cursor'])}")
+        return jsonify(archived), 200, headers
     except Exception as e:
         logger.error(f"Ошибка обработки /api/archive: {e}", exc_info=True)
         await notify_admin(f"Ошибка обработки /api/archive: {str(e)}", bot=bot)
@@ -600,22 +686,18 @@ async def get_archive():
 async def get_user_phone():
     logger.info(f"Запрос на /api/get_user_phone, args={request.args}")
     init_data = request.headers.get("X-Telegram-Init-Data", "Not provided")
-    headers = dict(request.headers)
-    logger.debug(f"get_user_phone: init_data='{init_data}', length={len(init_data) if init_data != 'Not provided' else 0}, remote_addr={request.remote_addr}, Headers={headers}")
+    logger.debug("get_user_phone: init_data_length=%s, remote_addr=%s, Headers=%s",
+                 len(init_data) if init_data != 'Not provided' else 0, request.remote_addr, request.headers)
     user_id = request.args.get('user_id')
     if not user_id:
         logger.error("Отсутствует user_id")
         return jsonify({"error": "User ID is required"}), 400
     try:
         user_id_int = int(user_id)
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                    "SELECT phone_number, region FROM users WHERE id = ?", (user_id_int,)
-            ) as cursor:
-                result = await cursor.fetchone()
-        if result:
+        user = await user_profiles.get(user_id_int)
+        if user:
             logger.info(f"Возвращен номер телефона для user_id={user_id}")
-            return jsonify({"phone_number": result[0], "region": result[1] or "Не указан"}), 200
+            return jsonify({"phone_number": user.phone_number, "region": user.region or "Не указан"}), 200
         logger.warning(f"Пользователь user_id={user_id} не найден")
         return jsonify({"error": "User not found"}), 404
     except ValueError:
@@ -629,40 +711,48 @@ async def get_user_phone():
 @app.route(WEBHOOK_PATH, methods=['POST'])
 @backoff.on_exception(backoff.expo, Exception, max_tries=3)
 async def webhook_handler():
-    logger.debug(f"Получен вебхук-запрос, headers={request.headers}, remote_addr={request.remote_addr}, content_length={request.content_length}")
+    logger.debug("Получен вебхук-запрос, remote_addr=%s, content_length=%s", request.remote_addr, request.content_length)
     if dp is None:
         logger.error("Dispatcher не инициализирован")
         await notify_admin("Критическая ошибка: Dispatcher не инициализирован", bot=bot)
         return jsonify({"ok": False, "error": "Dispatcher not initialized"}), 500
 
     try:
-        raw_data = await request.get_data(as_text=True)
-        logger.debug(f"Webhook raw_data={raw_data}")
-        update_data = await request.get_json()
-        logger.debug(f"Webhook update_data={update_data}")
+        raw_data = await request.get_data()
+        try:
+            update_data = json_codec.loads(raw_data) if raw_data else None
+        except ValueError as e:
+            logger.warning("Некорректный JSON в вебхук-запросе: %s, remote_addr=%s", e, request.remote_addr)
+            return jsonify({"ok": False, "error": "Invalid JSON"}), 400
         if not update_data:
-            logger.warning(f"Пустой вебхук-запрос, raw_data={raw_data}, remote_addr={request.remote_addr}, headers={request.headers}")
+            logger.warning("Пустой вебхук-запрос, raw_data=%s, remote_addr=%s", raw_data, request.remote_addr)
             return jsonify({"ok": True}), 200
 
         update_id = update_data.get('update_id')
-        logger.debug(f"Webhook update_id={update_id}")
+        logger.debug("Webhook update_id=%s", update_id)
         if not update_id:
             logger.warning(f"Отсутствует update_id в запросе: {update_data}")
             return jsonify({"ok": True}), 200
 
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                    "SELECT update_id FROM processed_updates WHERE update_id = ?", (update_id,)
-            ) as cursor:
-                if await cursor.fetchone():
-                    logger.debug(f"Повторный update_id={update_id}, пропущен")
-                    return jsonify({"ok": True}), 200
-            await conn.execute("INSERT INTO processed_updates (update_id) VALUES (?)", (update_id,))
-            await conn.commit()
-
-        logger.debug(f"Передача обновления в Dispatcher: update_id={update_id}")
-        await dp.feed_raw_update(bot, update_data)
-        logger.info(f"Обработан update_id={update_id}")
+        if await update_dedup.is_duplicate(update_id):
+            logger.debug(f"Повторный update_id={update_id}, пропущен")
+            return jsonify({"ok": True}), 200
+
+        if update_stream.redis is not None:
+            try:
+                await update_stream.publish(raw_data)
+            except Exception as e:
+                logger.error(f"Не удалось добавить update_id={update_id} в поток: {e}")
+                await update_dedup.forget(update_id)
+                return jsonify({"ok": False, "error": "Update stream unavailable"}), 503, {"Retry-After": "1"}
+            logger.debug(f"update_id={update_id} добавлен в поток")
+            return jsonify({"ok": True}), 200
+
+        # Ответ Telegram не ждёт обработчиков: обновление уходит в очередь своего пользователя
+        if not update_workers.submit(update_data):
+            await update_dedup.forget(update_id)
+            return jsonify({"ok": False, "error": "Update queue is full"}), 503, {"Retry-After": "1"}
+        logger.debug(f"update_id={update_id} поставлен в очередь")
         return jsonify({"ok": True}), 200
     except Exception as e:
         logger.error(f"Ошибка обработки вебхука: {e}, raw_data={raw_data}", exc_info=True)
@@ -685,17 +775,22 @@ async def set_bot_commands(bot: Bot) -> None:
         await notify_admin(f"Ошибка установки команд бота: {str(e)}", bot=bot)
         raise
 
-async def on_startup(bot: Bot) -> None:
-    logger.info("Запуск on_startup")
+async def on_startup(bot: Bot, set_webhook: bool = True) -> None:
+    logger.info(f"Запуск on_startup, JSON: {json_codec.JSON_BACKEND}")
     try:
         logger.info("Инициализация базы данных")
-        await init_db(bot=bot)
+        # Миграции применяет только процесс с вебхуком, процессы --worker ждут готовую схему
+        await init_db(bot=bot, migrate=set_webhook)
         logger.info("База данных успешно инициализирована")
     except Exception as e:
         logger.critical(f"Ошибка инициализации базы данных: {e}", exc_info=True)
         await notify_admin(f"Критическая ошибка: Ошибка инициализации базы данных: {str(e)}", bot=bot)
         raise
 
+    if not set_webhook:
+        logger.info("Процесс-обработчик: вебхук не настраивается")
+        return
+
     try:
         webhook_info = await bot.get_webhook_info()
         logger.debug(f"Текущий вебхук: {webhook_info.url}")
@@ -713,17 +808,32 @@ async def on_startup(bot: Bot) -> None:
         await notify_admin(f"Ошибка установки вебхука: {str(e)}", bot=bot)
         raise
 
-async def on_shutdown(bot: Bot, dp: Dispatcher, expired_items_task: Optional[asyncio.Task] = None) -> None:
+async def on_shutdown(
+        bot: Bot,
+        dp: Dispatcher,
+        background_tasks: Optional[list[asyncio.Task]] = None,
+        delete_webhook: bool = True
+) -> None:
     logger.info("Запуск on_shutdown")
+    background_tasks = background_tasks or []
     try:
-        if expired_items_task and not expired_items_task.done():
-            expired_items_task.cancel()
+        for background_task in background_tasks:
+            if background_task.done():
+                continue
+            background_task.cancel()
             try:
-                await expired_items_task
+                await background_task
             except asyncio.CancelledError:
-                logger.info("Фоновая задача check_expired_items отменена")
+                logger.info(f"Фоновая задача {background_task.get_name()} отменена")
 
-        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task() and task is not expired_items_task]
+        # Сначала прекращаем приём обновлений и дожидаемся обработчиков, затем задача записи фиксирует
+        # всё поставленное в очередь — и только после этого отменяются оставшиеся задачи
+        await update_stream.stop()
+        await update_workers.stop()
+        await close_db()
+        logger.info("Очередь записи зафиксирована, соединения с базой данных закрыты")
+
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task() and task not in background_tasks]
         for task in tasks:
             task.cancel()
             try:
@@ -731,11 +841,19 @@ async def on_shutdown(bot: Bot, dp: Dispatcher, expired_items_task: Optional[asy
             except asyncio.CancelledError:
                 pass
 
-        await bot.delete_webhook(drop_pending_updates=True)
-        logger.info("Вебхук удалён")
+        if delete_webhook:
+            await bot.delete_webhook(drop_pending_updates=True)
+            logger.info("Вебхук удалён")
 
         await dp.storage.close()
         logger.info("Хранилище закрыто")
+        logger.info(f"Статистика дедупликации обновлений: {update_dedup.stats()}")
+        logger.info(f"Статистика запросов репозиториев: {query_stats()}")
+        logger.info(f"Статистика кэша профилей: {user_profiles.stats()}")
+        logger.info(f"Статистика кэша подписок: {subscription_cache.stats()}")
+        logger.info(f"Статистика снимков доски: { {table: snapshot.stats() for table, snapshot in board_snapshots.items()} }")
+        if isinstance(dp.storage, (PipelinedRedisStorage, BoundedMemoryStorage)):
+            logger.info(f"Статистика хранилища FSM: {dp.storage.stats()}")
 
         await bot.session.close()
         logger.info("Сессия бота закрыта")
@@ -745,7 +863,9 @@ async def on_shutdown(bot: Bot, dp: Dispatcher, expired_items_task: Optional[asy
 
 async def main():
     global bot, dp
-    logger.info("Запуск бота")
+    # --worker: процесс без вебхука и фоновых задач, только читает поток обновлений из Redis
+    worker_only = "--worker" in sys.argv
+    logger.info(f"Запуск бота{' (процесс-обработчик)' if worker_only else ''}")
     try:
         check_required_files()
         logger.debug("Все необходимые файлы найдены")
@@ -763,6 +883,16 @@ async def main():
 
     try:
         storage = await connect_redis()
+        if hasattr(storage, 'redis'):
+            update_dedup.attach_redis(storage.redis)
+            user_profiles.attach_redis(storage.redis)
+            subscription_cache.attach_redis(storage.redis)
+            if UPDATE_INGEST_MODE == "stream":
+                update_stream.attach_redis(storage.redis)
+        if worker_only and update_stream.redis is None:
+            raise RuntimeError("--worker требует UPDATE_INGEST_MODE=stream и доступный Redis")
+        if UPDATE_INGEST_MODE == "stream" and update_stream.redis is None:
+            logger.warning("UPDATE_INGEST_MODE=stream без Redis, обновления обрабатываются локально")
         dp = Dispatcher(bot=bot, storage=storage)
         logger.info(f"Dispatcher инициализирован: storage={type(storage).__name__}")
     except Exception as e:
@@ -802,8 +932,25 @@ async def main():
         logger.critical(f"Ошибка регистрации middleware или роутеров: {e}", exc_info=True)
         raise
 
+    if worker_only:
+        try:
+            await on_startup(bot, set_webhook=False)
+        except Exception as e:
+            logger.critical(f"Ошибка в on_startup: {e}", exc_info=True)
+            raise
+        update_workers.start(bot, dp)
+        update_stream.start(update_workers)
+        background_tasks = []
+        if user_profiles.redis is not None:
+            background_tasks.append(asyncio.create_task(user_profiles.listen(), name="profile_invalidation"))
+        try:
+            await update_stream.wait()
+        finally:
+            await on_shutdown(bot, dp, background_tasks, delete_webhook=False)
+        return
+
     try:
-        expired_items_task = asyncio.create_task(check_expired_items(bot, storage))
+        background_tasks = [asyncio.create_task(check_expired_items(bot, storage), name="check_expired_items")]
         logger.info("Запуск проверки истёкших элементов")
     except Exception as e:
         logger.critical(f"Ошибка запуска фоновой задачи check_expired_items: {e}", exc_info=True)
@@ -821,6 +968,18 @@ async def main():
         logger.critical(f"Ошибка в on_startup: {e}", exc_info=True)
         raise
 
+    update_workers.start(bot, dp)
+    if update_stream.redis is not None:
+        update_stream.start(update_workers)
+        logger.info("Обновления принимаются через Redis Stream")
+
+    background_tasks.append(asyncio.create_task(backup_loop(bot), name="backup_loop"))
+    logger.info("Запуск фонового резервного копирования базы данных")
+
+    if user_profiles.redis is not None:
+        background_tasks.append(asyncio.create_task(user_profiles.listen(), name="profile_invalidation"))
+        logger.info("Запуск приёма инвалидаций кэша профилей")
+
     try:
         config = Config()
         config.bind = [f"127.0.0.1:{PORT}"]
@@ -836,7 +995,7 @@ async def main():
         await notify_admin(f"Ошибка запуска сервера на порту {PORT}: {str(e)}", bot=bot)
         raise
     finally:
-        await on_shutdown(bot, dp, expired_items_task)
+        await on_shutdown(bot, dp, background_tasks)
 
 if __name__ == "__main__":
     try:
@@ -845,4 +1004,6 @@ if __name__ == "__main__":
         logger.info("Бот остановлен пользователем")
     except Exception as e:
         logger.critical(f"Критическая ошибка в main: {e}", exc_info=True)
-        raise
\ No newline at end of file
+        raise
+    finally:
+        log_listener.stop()
\ No newline at end of file
@@ -5,10 +5,13 @@ from aiogram import Dispatcher, types, F, Bot
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.exceptions import TelegramBadRequest
-from config import DB_NAME, SELLER_ROLE, CATEGORIES, MAX_SORT_LENGTH, MAX_VOLUME_TON, MAX_PRICE, MAX_PHOTOS, CHANNEL_ID, ADMIN_IDS, ADMIN_ROLE, DB_TIMEOUT
+from config import SELLER_ROLE, CATEGORIES, MAX_SORT_LENGTH, MAX_VOLUME_TON, MAX_PRICE, MAX_PHOTOS, CHANNEL_ID, ADMIN_IDS, ADMIN_ROLE
 from user_requests import notify_next_pending_item
-from utils import check_role, make_keyboard, validate_number_minimal, validate_sort, check_subscription, parse_uz_datetime, format_uz_datetime, has_pending_items, get_ads_menu, get_main_menu, notify_admin
+from utils import make_keyboard, validate_number_minimal, validate_sort, parse_uz_datetime, format_uz_datetime, get_user_context, get_ads_menu, get_main_menu, notify_admin
 from database import generate_item_id
+from db_pool import pool
+from profile_cache import user_profiles
+from repositories import ProductRepo
 from regions import get_all_regions
 from datetime import datetime, timedelta
 from functools import wraps
@@ -43,16 +46,14 @@ def seller_only(handler):
         current_state = await state.get_state()
         logger.info(f"seller_only: user_id={user_id}, text='{message.text}', state={current_state}")
         try:
-            logger.debug(f"Checking pending items for user_id={user_id}")
-            has_pending = await has_pending_items(user_id)
+            user_ctx = await get_user_context(user_id)
+            has_pending = user_ctx.has_pending
             if has_pending:
                 logger.info(f"User {user_id} has pending items, notifying")
                 await notify_next_pending_item(message, state)
                 return
 
-            logger.debug(f"Checking subscription for user_id={user_id}")
-            success, bot_active, is_subscribed = await check_subscription(message.bot, user_id, state.storage)
-            logger.debug(f"check_subscription: user_id={user_id}, success={success}, bot_active={bot_active}, is_subscribed={is_subscribed}")
+            is_subscribed = user_ctx.subscribed
             if not is_subscribed:
                 logger.info(f"User {user_id} has no active subscription")
                 await message.answer(
@@ -62,10 +63,9 @@ def seller_only(handler):
                 await state.set_state("Registration:subscription")
                 return
 
-            logger.debug(f"Checking role for user_id={user_id}")
-            allowed, role = await check_role(message, allow_unregistered=False)
-            logger.info(f"Role check: user_id={user_id}, allowed={allowed}, role={role}")
-            if not allowed or (role != SELLER_ROLE and role != ADMIN_ROLE):
+            role = user_ctx.role
+            logger.info(f"Role check: user_id={user_id}, role={role}")
+            if role != SELLER_ROLE and role != ADMIN_ROLE:
                 logger.info(f"User {user_id} is not a seller or admin, role={role}")
                 await message.answer(
                     "Бу буйруқ фақат сотувчилар учун!",
@@ -74,7 +74,7 @@ def seller_only(handler):
                 await state.clear()
                 return
 
-            logger.debug(f"seller_only passed for user_id={user_id}, role={role}, has_pending={has_pending}, bot_active={bot_active}, is_subscribed={is_subscribed}")
+            logger.debug(f"seller_only passed for user_id={user_id}, role={role}, has_pending={has_pending}, is_subscribed={is_subscribed}")
             return await handler(message, state, *args, role=role, **kwargs)
         except aiosqlite.Error as e:
             logger.error(f"Database error in seller_only for user_id={user_id}: {e}", exc_info=True)
@@ -122,8 +122,7 @@ async def handle_ads_back_button(message: types.Message, state: FSMContext, role
         logger.debug(f"handle_ads_back_button skipped: text='{message.text}'")
         return
     try:
-        success, bot_active, is_subscribed = await check_subscription(message.bot, user_id, state.storage)
-        logger.debug(f"Subscription check in handle_ads_back_button: user_id={user_id}, success={success}, bot_active={bot_active}, is_subscribed={is_subscribed}")
+        is_subscribed = (await get_user_context(user_id)).subscribed
         if not is_subscribed and role != ADMIN_ROLE:
             await message.answer(
                 "Сизда фаол обуна мавжуд эмас. 'Обуна' тугмасини босинг:",
@@ -197,19 +196,8 @@ async def ads_list(message: types.Message, state: FSMContext, role: str):
     logger.debug(f"ads_list: user_id={user_id}, text='{message.text}', state={await state.get_state()}")
     try:
         logger.info(f"Attempting to fetch active products for user_id={user_id}")
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND name='products'"
-            ) as cursor:
-                table_exists = await cursor.fetchone()
-                if not table_exists:
-                    logger.error(f"Table 'products' does not exist for user_id={user_id}")
-                    raise aiosqlite.Error("Table 'products' does not exist")
-            async with conn.execute(
-                "SELECT unique_id, category, region, sort, volume_ton, price, photos, created_at "
-                "FROM products WHERE user_id = ? AND status = 'active'", (user_id,)
-            ) as cursor:
-                products = await cursor.fetchall()
+        async with pool.reader() as conn:
+            products = await ProductRepo.list_user_active(conn, user_id)
         logger.debug(f"Fetched products: {products}")
         if not products:
             await message.answer("Сизда эълонлар йўқ.", reply_markup=get_ads_menu())
@@ -217,24 +205,25 @@ async def ads_list(message: types.Message, state: FSMContext, role: str):
             logger.info(f"User {user_id} has no active ads")
             return
         now = datetime.now(pytz.timezone('Asia/Tashkent'))
-        for unique_id, category, region, sort, volume_ton, price, photos, created_at in products:
+        for product in products:
+            unique_id = product.unique_id
             try:
-                created_at_dt = parse_uz_datetime(created_at)
+                created_at_dt = parse_uz_datetime(product.created_at)
                 if not created_at_dt:
-                    logger.warning(f"Invalid creation date for ad {unique_id}: {created_at}")
+                    logger.warning(f"Invalid creation date for ad {unique_id}: {product.created_at}")
                     continue
                 expiration = created_at_dt + timedelta(hours=24)
                 status = "Фаол" if now < expiration else "Муддати тугаган"
                 info = (
                     f"Эълон {unique_id}\n"
-                    f"Категория: {category}\n"
-                    f"Вилоят: {region}\n"
-                    f"Сорт: {sort}\n"
-                    f"Ҳажм: {volume_ton} тонна\n"
-                    f"Нарх: {price:,.0f} сўм\n"
+                    f"Категория: {product.category}\n"
+                    f"Вилоят: {product.region}\n"
+                    f"Сорт: {product.sort}\n"
+                    f"Ҳажм: {product.volume_ton} тонна\n"
+                    f"Нарх: {product.price:,.0f} сўм\n"
                     f"Ҳолат: {status} ({format_uz_datetime(expiration)} гача)"
                 )
-                photos_list = photos.split(",") if photos else []
+                photos_list = product.photos.split(",") if product.photos else []
                 if photos_list:
                     media = [types.InputMediaPhoto(media=photo, caption=info if i == 0 else None) for i, photo in enumerate(photos_list)]
                     await message.answer_media_group(media=media)
@@ -525,7 +514,7 @@ async def process_photos(message: types.Message, state: FSMContext, role: str):
 
         item_id = await generate_item_id("products", "E")
         created_at = format_uz_datetime(datetime.now(pytz.timezone('Asia/Tashkent')))
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
+        async with pool.writer() as conn:
             await conn.execute(
                 "INSERT INTO products (unique_id, user_id, category, region, sort, volume_ton, price, photos, status, created_at) "
                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'active', ?)",
@@ -549,7 +538,7 @@ async def process_photos(message: types.Message, state: FSMContext, role: str):
             channel_msg = await message.bot.send_media_group(chat_id=CHANNEL_ID, media=media)
             message_ids = ",".join(str(msg.message_id) for msg in channel_msg)
             logger.debug(f"Ad {item_id} sent to channel, message_ids={message_ids}")
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
+            async with pool.writer() as conn:
                 await conn.execute(
                     "UPDATE products SET channel_message_ids = ? WHERE unique_id = ?",
                     (message_ids, item_id)
@@ -592,25 +581,15 @@ async def ads_delete_start(message: types.Message, state: FSMContext, role: str)
     logger.debug(f"ads_delete_start: user_id={user_id}, text='{message.text}', current_state={await state.get_state()}")
     try:
         logger.info(f"Attempting to fetch active products for user_id={user_id}")
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND name='products'"
-            ) as cursor:
-                table_exists = await cursor.fetchone()
-                if not table_exists:
-                    logger.error(f"Table 'products' does not exist for user_id={user_id}")
-                    raise aiosqlite.Error("Table 'products' does not exist")
-            async with conn.execute(
-                "SELECT unique_id FROM products WHERE user_id = ? AND status = 'active'", (user_id,)
-            ) as cursor:
-                products = await cursor.fetchall()
+        async with pool.reader() as conn:
+            products = await ProductRepo.list_user_active(conn, user_id)
         logger.debug(f"Fetched products: {products}")
         if not products:
             await message.answer("Ўчириш учун эълонлар йўқ.", reply_markup=get_ads_menu())
             await state.set_state(AdsMenu.menu)
             logger.info(f"User {user_id} has no ads to delete")
             return
-        product_ids = [p[0] for p in products]
+        product_ids = [p.unique_id for p in products]
         logger.debug(f"Product IDs available for deletion: {product_ids}")
         await message.answer(
             "Ўчириш учун эълон танланг:",
@@ -662,57 +641,61 @@ async def process_delete_product(message: types.Message, state: FSMContext, role
             )
             logger.warning(f"Invalid ad selection for deletion by user_id={user_id}: {item_id}")
             return
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
+        async with pool.reader() as conn:
             async with conn.execute(
                 "SELECT channel_message_ids, channel_message_id FROM products WHERE unique_id = ? AND user_id = ? AND status = 'active'",
                 (item_id, user_id)
             ) as cursor:
                 product = await cursor.fetchone()
-            if not product:
-                await message.answer(
-                    f"Эълон {item_id} топилмади ёки у сизга тегишли эмас!",
-                    reply_markup=get_ads_menu()
+        if not product:
+            await message.answer(
+                f"Эълон {item_id} топилмади ёки у сизга тегишли эмас!",
+                reply_markup=get_ads_menu()
+            )
+            await state.set_state(AdsMenu.menu)
+            logger.warning(f"User {user_id} tried to delete non-existent/unauthorized ad {item_id}")
+            return
+        reset_legacy_message = False
+        if product[0]:  # channel_message_ids
+            try:
+                message_ids = product[0].split(",")
+                for msg_id in message_ids:
+                    try:
+                        await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=int(msg_id))
+                        logger.debug(f"Message {msg_id} deleted from channel {CHANNEL_ID}")
+                    except TelegramBadRequest as e:
+                        if "message can't be deleted" in str(e) or "message to delete not found" in str(e):
+                            logger.warning(f"Message {msg_id} for ad {item_id} already deleted or not found: {e}")
+                        else:
+                            logger.error(f"Failed to delete message {msg_id} from channel for ad {item_id}: {e}", exc_info=True)
+                            await notify_admin(f"Failed to delete message {msg_id} from channel for ad {item_id}: {str(e)}", bot=message.bot)
+            except Exception as e:
+                logger.warning(f"Failed to delete messages {product[0]} from channel: {e}", exc_info=True)
+                await notify_admin(f"Failed to delete messages {product[0]} from channel for ad {item_id}: {str(e)}", bot=message.bot)
+        elif product[1]:  # channel_message_id (для старых объявлений)
+            try:
+                await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=product[1])
+                logger.debug(f"Legacy message {product[1]} deleted from channel {CHANNEL_ID}")
+            except TelegramBadRequest as e:
+                if "message can't be deleted" in str(e) or "message to delete not found" in str(e):
+                    logger.warning(f"Legacy message {product[1]} for ad {item_id} already deleted or not found: {e}")
+                    reset_legacy_message = True
+                else:
+                    logger.error(f"Failed to delete legacy message {product[1]} from channel for ad {item_id}: {e}", exc_info=True)
+                    await notify_admin(f"Failed to delete legacy message {product[1]} from channel for ad {item_id}: {str(e)}", bot=message.bot)
+        async with pool.writer() as conn:
+            if reset_legacy_message:
+                await conn.execute(
+                    "UPDATE products SET channel_message_id = NULL WHERE unique_id = ? AND user_id = ?",
+                    (item_id, user_id)
                 )
-                await state.set_state(AdsMenu.menu)
-                logger.warning(f"User {user_id} tried to delete non-existent/unauthorized ad {item_id}")
-                return
-            if product[0]:  # channel_message_ids
-                try:
-                    message_ids = product[0].split(",")
-                    for msg_id in message_ids:
-                        try:
-                            await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=int(msg_id))
-                            logger.debug(f"Message {msg_id} deleted from channel {CHANNEL_ID}")
-                        except TelegramBadRequest as e:
-                            if "message can't be deleted" in str(e) or "message to delete not found" in str(e):
-                                logger.warning(f"Message {msg_id} for ad {item_id} already deleted or not found: {e}")
-                            else:
-                                logger.error(f"Failed to delete message {msg_id} from channel for ad {item_id}: {e}", exc_info=True)
-                                await notify_admin(f"Failed to delete message {msg_id} from channel for ad {item_id}: {str(e)}", bot=message.bot)
-                except Exception as e:
-                    logger.warning(f"Failed to delete messages {product[0]} from channel: {e}", exc_info=True)
-                    await notify_admin(f"Failed to delete messages {product[0]} from channel for ad {item_id}: {str(e)}", bot=message.bot)
-            elif product[1]:  # channel_message_id (для старых объявлений)
-                try:
-                    await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=product[1])
-                    logger.debug(f"Legacy message {product[1]} deleted from channel {CHANNEL_ID}")
-                except TelegramBadRequest as e:
-                    if "message can't be deleted" in str(e) or "message to delete not found" in str(e):
-                        logger.warning(f"Legacy message {product[1]} for ad {item_id} already deleted or not found: {e}")
-                        await conn.execute(
-                            "UPDATE products SET channel_message_id = NULL WHERE unique_id = ? AND user_id = ?",
-                            (item_id, user_id)
-                        )
-                        await conn.commit()
-                        logger.info(f"Reset channel_message_id for ad {item_id}")
-                    else:
-                        logger.error(f"Failed to delete legacy message {product[1]} from channel for ad {item_id}: {e}", exc_info=True)
-                        await notify_admin(f"Failed to delete legacy message {product[1]} from channel for ad {item_id}: {str(e)}", bot=message.bot)
+                logger.info(f"Reset channel_message_id for ad {item_id}")
             await conn.execute(
                 "UPDATE products SET status = 'deleted' WHERE unique_id = ? AND user_id = ?",
                 (item_id, user_id)
             )
             await conn.commit()
+        await user_profiles.invalidate(user_id)
         await message.answer(f"Эълон {item_id} ўчирилди!", reply_markup=get_ads_menu())
         await state.set_state(AdsMenu.menu)
         logger.info(f"User {user_id} successfully deleted ad {item_id}")
@@ -739,32 +722,21 @@ async def close_product_start(message: types.Message, state: FSMContext, role: s
     logger.debug(f"close_product_start: user_id={user_id}, text='{message.text}', current_state={await state.get_state()}")
     try:
         logger.info(f"Attempting to fetch active products for user_id={user_id}")
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND name='products'"
-            ) as cursor:
-                table_exists = await cursor.fetchone()
-                if not table_exists:
-                    logger.error(f"Table 'products' does not exist for user_id={user_id}")
-                    raise aiosqlite.Error("Table 'products' does not exist")
-            async with conn.execute(
-                "SELECT unique_id, category, sort, volume_ton, price FROM products WHERE user_id = ? AND status = 'active'",
-                (user_id,)
-            ) as cursor:
-                products = await cursor.fetchall()
+        async with pool.reader() as conn:
+            products = await ProductRepo.list_user_active(conn, user_id)
         logger.debug(f"Fetched products: {products}")
         if not products:
             await message.answer("Ёпиш учун эълонлар йўқ.", reply_markup=get_ads_menu())
             await state.set_state(AdsMenu.menu)
             logger.info(f"User {user_id} has no ads to close")
             return
-        product_ids = [p[0] for p in products]
+        product_ids = [p.unique_id for p in products]
         logger.debug(f"Product IDs available for closure: {product_ids}")
         product_list = "Ёпиш учун эълонни танланг:\n"
-        for unique_id, category, sort, volume_ton, price in products:
-            product_list += f"{unique_id} - {category} ({sort}), {volume_ton} тонна, {price:,.0f} сўм\n"
+        for p in products:
+            product_list += f"{p.unique_id} - {p.category} ({p.sort}), {p.volume_ton} тонна, {p.price:,.0f} сўм\n"
         await message.answer(product_list, reply_markup=make_keyboard(product_ids, columns=2, with_back=True))
-        await state.update_data(products=products)
+        await state.update_data(products=[(p.unique_id, p.category, p.sort, p.volume_ton, p.price) for p in products])
         await state.set_state(CloseProduct.select_item)
         current_state = await state.get_state()
         logger.info(f"User {user_id} started ad closure process, state set to {current_state}")
@@ -838,42 +810,15 @@ async def process_close_product_select(message: types.Message, state: FSMContext
 
 async def check_expired_products_without_final_price(bot: Bot, user_id: int) -> bool:
     """
-    Проверяет, есть ли у пользователя истёкшие объявления без `final_price`.
-    Если есть, отправляет уведомление и возвращает True.
+    Проверяет, есть ли у пользователя эълоны, ждущие `final_price`.
+    Таблицу final_price_due ведёт check_expired_items; уведомление отправляется им один раз.
     """
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            now = datetime.now(pytz.timezone('Asia/Tashkent'))
-            expires_before = format_uz_datetime(now)
-            async with conn.execute(
-                """
-                SELECT unique_id, created_at
-                FROM products
-                WHERE user_id = ? 
-                AND status = 'active'
-                AND final_price IS NULL
-                AND datetime(created_at, '+48 hours') <= ?
-                """,
-                (user_id, expires_before)
-            ) as cursor:
-                expired_products = await cursor.fetchall()
-
-        if expired_products:
-            for product in expired_products:
-                unique_id = product[0]
-                try:
-                    await bot.send_message(
-                        user_id,
-                        f"Эълон {unique_id} муддати (48 соат) тугади! Илтимос, якуний нархни киритинг. "
-                        f"Бунгача ботдан фойдаланишингиз чекланади.",
-                        reply_markup=make_keyboard(["Эълонни ёпинг"], one_time=True)
-                    )
-                    logger.info(f"Отправлено уведомление о вводе final_price для user_id={user_id}, unique_id={unique_id}")
-                except Exception as e:
-                    logger.error(f"Ошибка отправки уведомления user_id={user_id}, unique_id={unique_id}: {e}")
-                    await notify_admin(f"Ошибка отправки уведомления user_id={user_id}, unique_id={unique_id}: {str(e)}", bot=bot)
-            return True
-        return False
+        async with pool.reader() as conn:
+            due_products = await ProductRepo.final_price_due(conn, user_id)
+        if due_products:
+            logger.debug(f"user_id={user_id} ждёт final_price для эълонов: {due_products}")
+        return bool(due_products)
     except aiosqlite.Error as e:
         logger.error(f"Ошибка проверки истёкших объявлений для user_id={user_id}: {e}")
         await notify_admin(f"Ошибка проверки истёкших объявлений для user_id={user_id}: {str(e)}", bot=bot)
@@ -885,23 +830,19 @@ async def process_close_product_final_price(message: types.Message, state: FSMCo
     logger.debug(f"process_close_product_final_price: user_id={user_id}, text='{message.text}', state={await state.get_state()}")
     try:
         if message.text == "Орқага":
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute(
-                    "SELECT unique_id, category, sort, volume_ton, price FROM products WHERE user_id = ? AND status = 'active'",
-                    (user_id,)
-                ) as cursor:
-                    products = await cursor.fetchall()
+            async with pool.reader() as conn:
+                products = await ProductRepo.list_user_active(conn, user_id)
             if not products:
                 await message.answer("Ёпиш учун эълонлар йўқ.", reply_markup=get_ads_menu())
                 await state.set_state(AdsMenu.menu)
                 logger.info(f"User {user_id} has no ads to close")
                 return
-            product_ids = [p[0] for p in products]
+            product_ids = [p.unique_id for p in products]
             product_list = "Ёпиш учун эълонни танланг:\n"
-            for unique_id, category, sort, volume_ton, price in products:
-                product_list += f"{unique_id} - {category} ({sort}), {volume_ton} тонна, {price:,.0f} сўм\n"
+            for p in products:
+                product_list += f"{p.unique_id} - {p.category} ({p.sort}), {p.volume_ton} тонна, {p.price:,.0f} сўм\n"
             await message.answer(product_list, reply_markup=make_keyboard(product_ids, columns=2, with_back=True))
-            await state.update_data(products=products)
+            await state.update_data(products=[(p.unique_id, p.category, p.sort, p.volume_ton, p.price) for p in products])
             await state.set_state(CloseProduct.select_item)
             logger.info(f"User {user_id} returned to ad selection for closure")
             return
@@ -921,7 +862,7 @@ async def process_close_product_final_price(message: types.Message, state: FSMCo
             logger.warning(f"Missing item_id in state for user_id={user_id}")
             return
         archived_at = format_uz_datetime(datetime.now(pytz.timezone('Asia/Tashkent')))
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
+        async with pool.reader() as conn:
             async with conn.execute(
                 """
                 SELECT channel_message_ids, photos, channel_message_id, created_at 
@@ -931,46 +872,49 @@ async def process_close_product_final_price(message: types.Message, state: FSMCo
                 (item_id, user_id)
             ) as cursor:
                 product = await cursor.fetchone()
-            if not product:
-                await message.answer(f"Эълон {item_id} топилмади!", reply_markup=get_ads_menu())
-                await state.set_state(AdsMenu.menu)
-                logger.warning(f"Ad {item_id} not found for user_id={user_id}")
-                return
-            logger.debug(f"Processing closure for ad {item_id}: channel_message_ids={product[0]}, photos={product[1]}, channel_message_id={product[2]}, created_at={product[3]}")
-            created_at_dt = parse_uz_datetime(product[3])
-            is_expired = created_at_dt and datetime.now(pytz.timezone('Asia/Tashkent')) >= created_at_dt + timedelta(hours=48)
-            if product[0]:  # channel_message_ids
-                try:
-                    message_ids = product[0].split(",")
-                    for msg_id in message_ids:
-                        try:
-                            await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=int(msg_id))
-                            logger.debug(f"Message {msg_id} deleted from channel")
-                        except TelegramBadRequest as e:
-                            if "message can't be deleted" in str(e) or "message to delete not found" in str(e):
-                                logger.warning(f"Message {msg_id} for ad {item_id} already deleted or not found: {e}")
-                            else:
-                                logger.error(f"Failed to delete message {msg_id} from channel for ad {item_id}: {e}", exc_info=True)
-                                await notify_admin(f"Failed to delete message {msg_id} from channel for ad {item_id}: {str(e)}", bot=message.bot)
-                except Exception as e:
-                    logger.warning(f"Failed to delete messages {product[0]} from channel: {e}", exc_info=True)
-                    await notify_admin(f"Failed to delete messages {product[0]} from channel for ad {item_id}: {str(e)}", bot=message.bot)
-            elif product[2]:  # channel_message_id
-                try:
-                    await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=product[2])
-                    logger.debug(f"Legacy message {product[2]} deleted from channel {CHANNEL_ID}")
-                except TelegramBadRequest as e:
-                    if "message can't be deleted" in str(e) or "message to delete not found" in str(e):
-                        logger.warning(f"Legacy message {product[2]} for ad {item_id} already deleted or not found: {e}")
-                        await conn.execute(
-                            "UPDATE products SET channel_message_id = NULL WHERE unique_id = ? AND user_id = ?",
-                            (item_id, user_id)
-                        )
-                        await conn.commit()
-                        logger.info(f"Reset channel_message_id for ad {item_id}")
-                    else:
-                        logger.error(f"Failed to delete legacy message {product[2]} from channel for ad {item_id}: {e}", exc_info=True)
-                        await notify_admin(f"Failed to delete legacy message {product[2]} from channel for ad {item_id}: {str(e)}", bot=message.bot)
+        if not product:
+            await message.answer(f"Эълон {item_id} топилмади!", reply_markup=get_ads_menu())
+            await state.set_state(AdsMenu.menu)
+            logger.warning(f"Ad {item_id} not found for user_id={user_id}")
+            return
+        logger.debug(f"Processing closure for ad {item_id}: channel_message_ids={product[0]}, photos={product[1]}, channel_message_id={product[2]}, created_at={product[3]}")
+        created_at_dt = parse_uz_datetime(product[3])
+        is_expired = created_at_dt and datetime.now(pytz.timezone('Asia/Tashkent')) >= created_at_dt + timedelta(hours=48)
+        reset_legacy_message = False
+        if product[0]:  # channel_message_ids
+            try:
+                message_ids = product[0].split(",")
+                for msg_id in message_ids:
+                    try:
+                        await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=int(msg_id))
+                        logger.debug(f"Message {msg_id} deleted from channel")
+                    except TelegramBadRequest as e:
+                        if "message can't be deleted" in str(e) or "message to delete not found" in str(e):
+                            logger.warning(f"Message {msg_id} for ad {item_id} already deleted or not found: {e}")
+                        else:
+                            logger.error(f"Failed to delete message {msg_id} from channel for ad {item_id}: {e}", exc_info=True)
+                            await notify_admin(f"Failed to delete message {msg_id} from channel for ad {item_id}: {str(e)}", bot=message.bot)
+            except Exception as e:
+                logger.warning(f"Failed to delete messages {product[0]} from channel: {e}", exc_info=True)
+                await notify_admin(f"Failed to delete messages {product[0]} from channel for ad {item_id}: {str(e)}", bot=message.bot)
+        elif product[2]:  # channel_message_id
+            try:
+                await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=product[2])
+                logger.debug(f"Legacy message {product[2]} deleted from channel {CHANNEL_ID}")
+            except TelegramBadRequest as e:
+                if "message can't be deleted" in str(e) or "message to delete not found" in str(e):
+                    logger.warning(f"Legacy message {product[2]} for ad {item_id} already deleted or not found: {e}")
+                    reset_legacy_message = True
+                else:
+                    logger.error(f"Failed to delete legacy message {product[2]} from channel for ad {item_id}: {e}", exc_info=True)
+                    await notify_admin(f"Failed to delete legacy message {product[2]} from channel for ad {item_id}: {str(e)}", bot=message.bot)
+        async with pool.writer() as conn:
+            if reset_legacy_message:
+                await conn.execute(
+                    "UPDATE products SET channel_message_id = NULL WHERE unique_id = ? AND user_id = ?",
+                    (item_id, user_id)
+                )
+                logger.info(f"Reset channel_message_id for ad {item_id}")
             await conn.execute(
                 """
                 UPDATE products 
@@ -980,7 +924,8 @@ async def process_close_product_final_price(message: types.Message, state: FSMCo
                 (final_price, archived_at, product[1], archived_at, item_id, user_id)
             )
             await conn.commit()
-            logger.info(f"Ad {item_id} archived successfully for user_id={user_id}, is_expired={is_expired}")
+        await user_profiles.invalidate(user_id)
+        logger.info(f"Ad {item_id} archived successfully for user_id={user_id}, is_expired={is_expired}")
         await message.answer(
             f"Эълон {item_id} архивига ўтказилди. Якуний нарх: {final_price:,.0f} сўм.",
             reply_markup=get_ads_menu()
@@ -6,6 +6,7 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from config import DB_NAME, DB_TIMEOUT, SELLER_ROLE, MAX_COMPANY_NAME_LENGTH, ADMIN_ROLE, DISPLAY_ROLE_MAPPING, BUYER_ROLE
 from utils import check_role, make_keyboard, check_subscription, get_profile_menu, get_main_menu, get_admin_menu, format_uz_datetime, notify_admin, has_pending_items
+from profile_cache import user_profiles
 from regions import get_all_regions, get_districts_for_region
 from datetime import datetime
 import pytz
@@ -96,6 +97,7 @@ async def profile_menu(message: types.Message, state: FSMContext) -> None:
                         "DELETE FROM users WHERE id = ? AND (role IS NULL OR region IS NULL OR phone_number IS NULL)", (user_id,)
                     )
                     await conn.commit()
+                    await user_profiles.invalidate(user_id)
                     logger.info(f"Удалена частичная регистрация для user_id={user_id}")
             await message.answer(
                 "Профильга кириш учун рўйхатдан ўтинг:",
@@ -147,12 +149,7 @@ async def profile_info(message: types.Message, state: FSMContext) -> None:
         return
     display_role = DISPLAY_ROLE_MAPPING.get(role, role)
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                "SELECT phone_number, role, region, district, company_name, unique_id FROM users WHERE id = ?",
-                (user_id,)
-            ) as cursor:
-                user = await cursor.fetchone()
+        user = await user_profiles.get(user_id)
         if not user:
             await message.answer(
                 "Сизнинг профилингиз топилмади. Илтимос, рўйхатдан ўтинг.",
@@ -162,14 +159,14 @@ async def profile_info(message: types.Message, state: FSMContext) -> None:
             logger.warning(f"Профиль не найден для user_id {user_id}")
             return
         info = (
-            f"📞 Телефон: {user[0]}\n"
+            f"📞 Телефон: {user.phone_number}\n"
             f"🎭 Рол: {display_role}\n"
-            f"🌍 Вилоят: {user[2] or 'Йўқ'}\n"
-            f"🏞 Туман: {user[3] or 'Йўқ'}\n"
+            f"🌍 Вилоят: {user.region or 'Йўқ'}\n"
+            f"🏞 Туман: {user.district or 'Йўқ'}\n"
         )
         if role == SELLER_ROLE:
-            info += f"🏢 Ташкилот: {user[4] or 'Йўқ'}\n"
-        info += f"🆔 ID: {user[5]}"
+            info += f"🏢 Ташкилот: {user.company_name or 'Йўқ'}\n"
+        info += f"🆔 ID: {user.unique_id}"
         reply_markup = get_admin_menu() if role == ADMIN_ROLE else get_profile_menu()
         await message.answer(
             f"Сизнинг профилингиз:\n\n{info}",
@@ -279,6 +276,7 @@ async def process_region(message: types.Message, state: FSMContext) -> None:
                         (region, "Йўқ", user_id)
                     )
                     await conn.commit()
+                await user_profiles.invalidate(user_id)
                 await message.answer(
                     f"Янги ташкилот номини киритинг (макс. {MAX_COMPANY_NAME_LENGTH} белги):",
                     reply_markup=make_keyboard(["Орқага"], one_time=True)
@@ -299,6 +297,7 @@ async def process_region(message: types.Message, state: FSMContext) -> None:
                     (region, "Йўқ", user_id)
                 )
                 await conn.commit()
+            await user_profiles.invalidate(user_id)
             await message.answer(
                 "✅ Профиль янгиланди! Асосий менюга қайтдик.",
                 reply_markup=get_main_menu(role)
@@ -411,6 +410,7 @@ async def process_company_name(message: types.Message, state: FSMContext) -> Non
                 (data["region"], data.get("district", "Йўқ"), company_name, user_id)
             )
             await conn.commit()
+        await user_profiles.invalidate(user_id)
         await message.answer(
             "✅ Профиль янгиланди! Асосий менюга қайтдик.",
             reply_markup=get_main_menu(role)
@@ -489,6 +489,7 @@ async def profile_delete(message: types.Message, state: FSMContext) -> None:
             )
             await conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
             await conn.commit()
+        await user_profiles.invalidate(user_id)
         await state.clear()
         try:
             storage = state.storage
@@ -562,6 +563,7 @@ async def handle_start_registration_after_delete(message: types.Message, state:
                 "DELETE FROM users WHERE id = ? AND (role IS NULL OR region IS NULL OR phone_number IS NULL)", (user_id,)
             )
             await conn.commit()
+        await user_profiles.invalidate(user_id)
 
         # Переход к запросу телефона
         keyboard = ReplyKeyboardMarkup(
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL
+from db_pool import pool
+from repositories import UserRepo, UserRow
+
+logger = logging.getLogger(__name__)
+
+# Канал Redis, по которому процессы бота сообщают друг другу об изменённых профилях
+INVALIDATE_CHANNEL = "cache_invalidate:users"
+
+class ProfileCache:
+    """LRU-кэш профилей пользователей с TTL; инвалидация рассылается через Redis pub/sub."""
+
+    def __init__(self, size: int, ttl: int):
+        self.size = size
+        self.ttl = ttl
+        self.redis = None
+        self._origin = f"{os.getpid()}:{id(self)}"
+        self._profiles: OrderedDict[int, tuple[float, UserRow]] = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "invalidated": 0, "remote": 0}
+
+    def attach_redis(self, redis) -> None:
+        """Подключает клиент Redis (storage.redis) для рассылки инвалидаций."""
+        self.redis = redis
+
+    async def get(self, user_id: int) -> Optional[UserRow]:
+        """Профиль из кэша или из базы; отсутствующие пользователи не кэшируются."""
+        entry = self._profiles.get(user_id)
+        if entry is not None:
+            expires_at, profile = entry
+            if expires_at > time.monotonic():
+                self._profiles.move_to_end(user_id)
+                self._stats["hits"] += 1
+                return profile
+            del self._profiles[user_id]
+            self._stats["expired"] += 1
+        self._stats["misses"] += 1
+        async with pool.reader() as conn:
+            profile = await UserRepo.get(conn, user_id)
+        if profile is not None:
+            self._profiles[user_id] = (time.monotonic() + self.ttl, profile)
+            if len(self._profiles) > self.size:
+                self._profiles.popitem(last=False)
+        return profile
+
+    def _evict(self, user_id: int) -> None:
+        if self._profiles.pop(user_id, None) is not None:
+            self._stats["invalidated"] += 1
+
+    async def invalidate(self, user_id: int) -> None:
+        """Удаляет профиль из кэша этого процесса и оповещает остальные процессы."""
+        self._evict(user_id)
+        if self.redis is not None:
+            try:
+                await self.redis.publish(INVALIDATE_CHANNEL, f"{self._origin}:{user_id}")
+            except Exception as e:
+                logger.warning(f"Ошибка публикации инвалидации профиля user_id={user_id}: {e}")
+
+    async def listen(self) -> None:
+        """Принимает инвалидации других процессов; при обрыве Redis переподключается."""
+        while self.redis is not None:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                logger.info(f"Подписка на {INVALIDATE_CHANNEL} оформлена")
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = message["data"]
+                    if isinstance(data, bytes):
+                        data = data.decode()
+                    origin, _, user_id = data.rpartition(":")
+                    if origin == self._origin:
+                        continue
+                    try:
+                        self._evict(int(user_id))
+                        self._stats["remote"] += 1
+                    except ValueError:
+                        logger.warning(f"Некорректное сообщение инвалидации профиля: {data}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Пока подписки нет, чужие изменения могли пройти мимо: сбрасываем кэш целиком
+                self._profiles.clear()
+                logger.warning(f"Ошибка подписки на {INVALIDATE_CHANNEL}, повтор через 5 секунд: {e}")
+                await asyncio.sleep(5)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    def stats(self) -> dict:
+        """Возвращает попадания, промахи и инвалидации кэша профилей."""
+        return {**self._stats, "cached": len(self._profiles)}
+
+user_profiles = ProfileCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import re
+import sys
+
+import aiosqlite
+
+from config import DB_NAME, DB_TIMEOUT
+from repositories import (
+    ACTIVE_SUBSCRIPTIONS_COUNT_SQL, ACTIVE_SUBSCRIPTIONS_SQL, BOARD_ACTIVE_SQL, BOARD_STALE_COUNT_SQL, BOARD_VERSION_SQL,
+    EXPIRING_WINDOW_SQL, FINAL_PRICE_DUE_SQL, FIND_DUPLICATE_SQL, ITEM_ACTIVE_IDS_SQL, ITEM_ARCHIVED_SQL,
+    ITEM_COUNTS_SQL, ITEM_CREATED_SINCE_SQL, ITEM_USER_ACTIVE_SQL, PAYMENT_GET_SQL, PENDING_EXPIRED_SQL,
+    USER_BLOCKED_SQL, USER_CREATED_SINCE_SQL, USER_GET_SQL, USER_ROLE_SQL, ProductRepo, RequestRepo
+)
+
+logger = logging.getLogger(__name__)
+
+# Горячие запросы бота с примерными параметрами: каждый должен обслуживаться индексом.
+# SQL репозиториев берётся из repositories, остальные строки повторяют запросы обработчиков.
+# Запросы-агрегаты по всей таблице (GROUP BY status, COUNT(*) без условий) сюда не входят.
+QUERY_CATALOG = {
+    "products.user_active": (
+        ProductRepo.sql(ITEM_USER_ACTIVE_SQL),
+        (1,),
+    ),
+    "products.user_item": (
+        "SELECT channel_message_ids, channel_message_id FROM products WHERE unique_id = ? AND user_id = ? AND status = 'active'",
+        ("E-0001", 1),
+    ),
+    "products.final_price_due": (
+        FINAL_PRICE_DUE_SQL,
+        (1,),
+    ),
+    "products.board_active": (
+        ProductRepo.sql(BOARD_ACTIVE_SQL),
+        (),
+    ),
+    "products.board_page": ProductRepo.board_page_query(0, "active", limit=20, after=(2000000000, 1000)),
+    "products.expiring_window": (
+        ProductRepo.sql(EXPIRING_WINDOW_SQL),
+        (0, 1, 0, 100),
+    ),
+    "products.pending_expired": (
+        ProductRepo.sql(PENDING_EXPIRED_SQL),
+        (0,),
+    ),
+    "products.admin_active": (
+        ProductRepo.sql(ITEM_ACTIVE_IDS_SQL),
+        (),
+    ),
+    "products.admin_archived": (
+        ProductRepo.sql(ITEM_ARCHIVED_SQL),
+        (),
+    ),
+    "products.created_since": (
+        ProductRepo.sql(ITEM_CREATED_SINCE_SQL),
+        (0,),
+    ),
+    "requests.user_active": (
+        RequestRepo.sql(ITEM_USER_ACTIVE_SQL),
+        (1,),
+    ),
+    "requests.duplicate": (
+        FIND_DUPLICATE_SQL,
+        (1, "Помидор", "a", "Тошкент"),
+    ),
+    "requests.user_item": (
+        "SELECT channel_message_id FROM requests WHERE id = ? AND user_id = ? AND status = 'active'",
+        (1, 1),
+    ),
+    "requests.board_page": RequestRepo.board_page_query(0, "active", limit=20, after=(2000000000, 1000)),
+    "products.board_stale_count": (
+        ProductRepo.sql(BOARD_STALE_COUNT_SQL, " AND category = ?"),
+        ("active", 0, "Помидор", "active", "Помидор"),
+    ),
+    "item_counts.board_total": (
+        ITEM_COUNTS_SQL + " AND category = ?",
+        ("products", "active", "Помидор"),
+    ),
+    "products.board_search": ProductRepo.board_page_query(0, "active", match='"помидор"*', limit=20),
+    "requests.board_search": RequestRepo.board_page_query(0, "active", match='"помидор"*', limit=20),
+    "board_generations.by_table": (
+        BOARD_VERSION_SQL,
+        ("products",),
+    ),
+    "requests.expiring_window": (
+        RequestRepo.sql(EXPIRING_WINDOW_SQL),
+        (0, 1, 0, 100),
+    ),
+    "requests.pending_expired": (
+        RequestRepo.sql(PENDING_EXPIRED_SQL),
+        (0,),
+    ),
+    "requests.admin_archived": (
+        RequestRepo.sql(ITEM_ARCHIVED_SQL),
+        (),
+    ),
+    "requests.created_since": (
+        RequestRepo.sql(ITEM_CREATED_SINCE_SQL),
+        (0,),
+    ),
+    "requests.admin_active": (
+        RequestRepo.sql(ITEM_ACTIVE_IDS_SQL),
+        (),
+    ),
+    "users.by_id": (
+        USER_ROLE_SQL,
+        (1,),
+    ),
+    "users.get": (
+        USER_GET_SQL,
+        (1,),
+    ),
+    "users.by_phone": (
+        "SELECT id FROM users WHERE phone_number = ?",
+        ("+998900000000",),
+    ),
+    "users.created_since": (
+        USER_CREATED_SINCE_SQL,
+        (0,),
+    ),
+    "payments.by_user": (
+        "SELECT bot_expires FROM payments WHERE user_id = ?",
+        (1,),
+    ),
+    "payments.get": (
+        PAYMENT_GET_SQL,
+        (1,),
+    ),
+    "payments.active_subscriptions": (
+        ACTIVE_SUBSCRIPTIONS_SQL,
+        (0,),
+    ),
+    "payments.active_count": (
+        ACTIVE_SUBSCRIPTIONS_COUNT_SQL,
+        (0,),
+    ),
+    "pending_items.next": (
+        "SELECT unique_id, item_type FROM pending_items WHERE user_id = ? ORDER BY created_at LIMIT 1",
+        (1,),
+    ),
+    "pending_items.count": (
+        "SELECT COUNT(*) FROM pending_items WHERE user_id = ?",
+        (1,),
+    ),
+    "deleted_users.blocked": (
+        USER_BLOCKED_SQL,
+        (1,),
+    ),
+}
+
+# Строка плана без индекса: "SCAN products" или "SCAN p" (с индексом было бы "USING ... INDEX")
+FULL_SCAN_RE = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+
+async def check_query_plans(conn: aiosqlite.Connection) -> dict[str, list[str]]:
+    """Выполняет EXPLAIN QUERY PLAN для каждого запроса из каталога и возвращает те, что сканируют таблицу целиком."""
+    offenders = {}
+    for name, (query, params) in QUERY_CATALOG.items():
+        async with conn.execute(f"EXPLAIN QUERY PLAN {query}", params) as cursor:
+            details = [row[3] for row in await cursor.fetchall()]
+        scans = [detail for detail in details if FULL_SCAN_RE.match(detail)]
+        if scans:
+            offenders[name] = details
+            logger.warning(f"Запрос {name} выполняется полным сканированием: {details}")
+        else:
+            logger.debug(f"План запроса {name}: {details}")
+    return offenders
+
+async def _main() -> int:
+    async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
+        offenders = await check_query_plans(conn)
+    for name, details in offenders.items():
+        print(f"FULL SCAN {name}: {' | '.join(details)}")
+    print(f"Проверено запросов: {len(QUERY_CATALOG)}, с полным сканированием: {len(offenders)}")
+    return 1 if offenders else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main()))
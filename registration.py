@@ -1,16 +1,17 @@
 import aiosqlite
 import logging
 import asyncio
-import json
 from aiogram import Router, types, F, Dispatcher
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+import json_codec
 from config import DB_NAME, DB_TIMEOUT, SELLER_ROLE, BUYER_ROLE, ADMIN_ROLE, ROLES, ROLE_MAPPING, ROLE_DISPLAY_NAMES, MAX_COMPANY_NAME_LENGTH, ADMIN_IDS
 from database import register_user, activate_trial, init_db, clear_user_state, generate_user_id
 from regions import get_all_regions, get_districts_for_region
 from utils import make_keyboard, get_main_menu, check_subscription, format_uz_datetime, notify_admin, get_admin_menu, parse_uz_datetime, validate_phone, save_registration_state
+from profile_cache import user_profiles
 from datetime import datetime, timedelta
 import pytz
 
@@ -43,6 +44,7 @@ async def process_start_registration(message: types.Message, state: FSMContext,
                     (user_id, ADMIN_ROLE, format_uz_datetime(datetime.now(pytz.UTC)))
                 )
                 await conn.commit()
+            await user_profiles.invalidate(user_id)
             await message.answer("Админ панели:", reply_markup=get_admin_menu())
             await state.set_state("AdminStates:main_menu")
             logger.info(f"Админ {user_id} панельга кирди")
@@ -104,16 +106,13 @@ async def process_start_registration(message: types.Message, state: FSMContext,
     try:
         async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
             logger.debug(f"Мавжуд фойдаланувчи текширилмоқда user_id={user_id}")
-            async with conn.execute(
-                "SELECT id, role, region, district, phone_number, unique_id FROM users WHERE id = ?", (user_id,)
-            ) as cursor:
-                existing_user = await cursor.fetchone()
-            if existing_user and existing_user[1] and existing_user[2] and existing_user[3]:
+            existing_user = await user_profiles.get(user_id)
+            if existing_user and existing_user.role and existing_user.region and existing_user.district:
                 # Пользователь полностью зарегистрирован
-                db_role = existing_user[1]
+                db_role = existing_user.role
                 display_role = ROLE_DISPLAY_NAMES.get(db_role, db_role)
-                phone = existing_user[4]
-                unique_id = existing_user[5]
+                phone = existing_user.phone_number
+                unique_id = existing_user.unique_id
                 _, bot_active, is_subscribed = await check_subscription(message.bot, user_id, dp.storage)
                 logger.debug(f"Фойдаланувчи {user_id} обунаси: bot_active={bot_active}, is_subscribed={is_subscribed}")
                 async with conn.execute(
@@ -151,9 +150,10 @@ async def process_start_registration(message: types.Message, state: FSMContext,
 
     try:
         async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            logger.debug(f"SQL: DELETE FROM users WHERE id = {user_id} AND (role IS NULL OR region IS NULL OR district IS NULL)")
+            logger.debug("SQL: DELETE FROM users WHERE id = %s AND (role IS NULL OR region IS NULL OR district IS NULL)", user_id)
             await conn.execute("DELETE FROM users WHERE id = ? AND (role IS NULL OR region IS NULL OR district IS NULL)", (user_id,))
             await conn.commit()
+        await user_profiles.invalidate(user_id)
         await message.answer(
             f"Хуш келибсиз, {first_name}! Рўйхатдан ўтиш тугмасини босинг:",
             reply_markup=make_keyboard(["Рўйхатдан ўтиш"], one_time=True)
@@ -257,6 +257,7 @@ async def process_phone(message: types.Message, state: FSMContext):
 
         # Регистрация пользователя
         registered = await register_user(user_id, phone, bot=message.bot)
+        await user_profiles.invalidate(user_id)
         if not isinstance(registered, bool):
             logger.error(f"register_user нотўғри тип қайтарди: {type(registered).__name__}, қиймат: {registered}")
             raise ValueError(f"register_user нотўғри тип қайтарди: {type(registered).__name__}")
@@ -310,7 +311,7 @@ async def process_phone(message: types.Message, state: FSMContext):
             if hasattr(state.storage, 'redis'):
                 saved_data = await state.storage.redis.get(f"reg:{user_id}")
                 if saved_data:
-                    await state.set_data(json.loads(saved_data))
+                    await state.set_data(json_codec.loads(saved_data))
                     await message.answer(
                         "Хатолик юз берди. Илтимос, телефон рақамингизни қайта улашинг:",
                         reply_markup=ReplyKeyboardMarkup(
@@ -337,7 +338,7 @@ async def process_phone(message: types.Message, state: FSMContext):
             if hasattr(state.storage, 'redis'):
                 saved_data = await state.storage.redis.get(f"reg:{user_id}")
                 if saved_data:
-                    await state.set_data(json.loads(saved_data))
+                    await state.set_data(json_codec.loads(saved_data))
                     await message.answer(
                         "Хатолик юз берди. Илтимос, телефон рақамингизни қайта улашинг:",
                         reply_markup=ReplyKeyboardMarkup(
@@ -378,7 +379,7 @@ async def process_role(message: types.Message, state: FSMContext):
                 if hasattr(state.storage, 'redis'):
                     saved_data = await state.storage.redis.get(f"reg:{user_id}")
                     if saved_data:
-                        await state.set_data(json.loads(saved_data))
+                        await state.set_data(json_codec.loads(saved_data))
                         await message.answer(
                             "Хатолик юз берди. Рольни қайта танланг:",
                             reply_markup=make_keyboard(role_buttons, columns=2, one_time=True)
@@ -420,7 +421,7 @@ async def process_role(message: types.Message, state: FSMContext):
             if hasattr(state.storage, 'redis'):
                 saved_data = await state.storage.redis.get(f"reg:{user_id}")
                 if saved_data:
-                    await state.set_data(json.loads(saved_data))
+                    await state.set_data(json_codec.loads(saved_data))
                     await message.answer(
                         "Хатолик юз берди. Рольни қайта танланг:",
                         reply_markup=make_keyboard(role_buttons, columns=2, one_time=True)
@@ -691,13 +692,14 @@ async def complete_registration(message: types.Message, state: FSMContext):
     try:
         async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
             unique_id = await generate_user_id(role, bot=message.bot)
-            logger.debug(f"SQL: UPDATE users SET phone_number = ?, role = ?, region = ?, district = ?, company_name = ?, unique_id = ? WHERE id = ?")
+            logger.debug("SQL: UPDATE users SET phone_number = ?, role = ?, region = ?, district = ?, company_name = ?, unique_id = ? WHERE id = ?")
             await conn.execute(
                 "UPDATE users SET phone_number = ?, role = ?, region = ?, district = ?, company_name = ?, unique_id = ? WHERE id = ?",
                 (phone, role, region, district, company_name, unique_id, user_id)
             )
             await conn.commit()
             logger.debug(f"Фойдаланувчи {user_id} маълумотлари янгиланди: unique_id={unique_id}")
+        await user_profiles.invalidate(user_id)
 
         if not hasattr(state.storage, 'redis'):
             logger.error(f"Storage Redis ни қўллаб-қувватламайди user_id={user_id}")
@@ -772,7 +774,7 @@ async def complete_registration(message: types.Message, state: FSMContext):
             if hasattr(state.storage, 'redis'):
                 saved_data = await state.storage.redis.get(f"reg:{user_id}")
                 if saved_data:
-                    await state.set_data(json.loads(saved_data))
+                    await state.set_data(json_codec.loads(saved_data))
                     role = data.get("role")
                     if role == SELLER_ROLE:
                         await message.answer(
@@ -804,7 +806,7 @@ async def complete_registration(message: types.Message, state: FSMContext):
             if hasattr(state.storage, 'redis'):
                 saved_data = await state.storage.redis.get(f"reg:{user_id}")
                 if saved_data:
-                    await state.set_data(json.loads(saved_data))
+                    await state.set_data(json_codec.loads(saved_data))
                     role = data.get("role")
                     if role == SELLER_ROLE:
                         await message.answer(
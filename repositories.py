@@ -0,0 +1,596 @@
+import base64
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Union
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# Статистика запросов репозиториев: имя -> [количество, суммарное время, максимум]
+_query_stats: dict[str, list] = {}
+
+@asynccontextmanager
+async def _timed(name: str) -> AsyncIterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stats = _query_stats.setdefault(name, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+
+def query_stats() -> dict:
+    """Возвращает число вызовов и время выполнения каждого запроса репозиториев (мс)."""
+    return {
+        name: {
+            "calls": calls,
+            "avg_ms": round(total / calls * 1000, 3),
+            "max_ms": round(maximum * 1000, 3),
+        }
+        for name, (calls, total, maximum) in _query_stats.items()
+    }
+
+# Позиция на доске: (created_ts, id), а при поиске — (релевантность bm25, id)
+BoardPosition = tuple[Union[int, float], int]
+
+def encode_cursor(*positions: Optional[BoardPosition]) -> Optional[str]:
+    """Непрозрачный курсор из позиций по одной на источник; None — источник исчерпан."""
+    if all(position is None for position in positions):
+        return None
+    # repr у float точный, поэтому релевантность после разбора курсора сравнивается без потерь
+    raw = "|".join("" if position is None else f"{position[0]!r}:{position[1]}" for position in positions)
+    return base64.urlsafe_b64encode(raw.encode("ascii")).decode("ascii").rstrip("=")
+
+def _cursor_number(value: str) -> Union[int, float]:
+    return int(value) if value.lstrip("-").isdigit() else float(value)
+
+def decode_cursor(cursor: str, parts: int = 1) -> list[Optional[BoardPosition]]:
+    """Разбирает курсор encode_cursor; ValueError, если он повреждён или сделан для другого числа источников."""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("ascii")
+    positions = [tuple(_cursor_number(value) for value in part.split(":")) if part else None for part in raw.split("|")]
+    if len(positions) != parts or any(position is not None and len(position) != 2 for position in positions):
+        raise ValueError(f"Неверный курсор: {cursor}")
+    return positions
+
+# SQL репозиториев. Шаблоны с {table}, {item_columns}, {board_columns}, {expiring_filter} собираются
+# через _ItemRepo.sql; query_plans проверяет планы этих же строк, а не их копий.
+ITEM_USER_ACTIVE_SQL = "SELECT {item_columns} FROM {table} WHERE user_id = ? AND status = 'active' ORDER BY id"
+BOARD_ACTIVE_SQL = (
+    "SELECT {board_columns} FROM {table} p JOIN users u ON p.user_id = u.id "
+    "WHERE p.status = 'active' ORDER BY p.created_ts DESC"
+)
+ITEM_COUNTS_SQL = "SELECT COALESCE(SUM(n), 0) FROM item_counts WHERE item_table = ? AND status = ?"
+# created_ts < ? и IS NULL — отдельные диапазоны индекса: через OR SQLite прошёл бы все активные
+BOARD_STALE_COUNT_SQL = (
+    "SELECT (SELECT COUNT(*) FROM {table} WHERE status = ? AND created_ts < ?{category_filter}) + "
+    "(SELECT COUNT(*) FROM {table} WHERE status = ? AND created_ts IS NULL{category_filter})"
+)
+BOARD_VERSION_SQL = "SELECT generation, changed_ts FROM board_generations WHERE item_table = ?"
+PENDING_EXPIRED_SQL = "SELECT unique_id FROM {table} WHERE status = 'pending_response' AND created_ts <= ?"
+EXPIRING_WINDOW_SQL = (
+    "SELECT p.id, p.user_id, p.unique_id, p.created_ts FROM {table} p JOIN users u ON p.user_id = u.id "
+    "WHERE p.status = 'active'{expiring_filter} AND p.created_ts BETWEEN ? AND ? AND p.id > ? ORDER BY p.id LIMIT ?"
+)
+ITEM_ACTIVE_IDS_SQL = "SELECT unique_id FROM {table} WHERE status = 'active'"
+ITEM_ARCHIVED_SQL = "SELECT unique_id, category, sort, user_id FROM {table} WHERE status = 'archived'"
+ITEM_CREATED_SINCE_SQL = "SELECT COUNT(*) FROM {table} WHERE created_ts > ?"
+ITEM_STATUS_COUNTS_SQL = "SELECT status, SUM(n) FROM item_counts WHERE item_table = ? GROUP BY status"
+ITEM_DELETE_SQL = "UPDATE {table} SET status = 'deleted' WHERE unique_id = ? RETURNING channel_message_id, user_id"
+ITEM_ARCHIVE_ACTIVE_SQL = (
+    "UPDATE {table} SET status = 'archived', archived_at = ? WHERE unique_id = ? AND status = 'active' "
+    "RETURNING channel_message_id, user_id"
+)
+ITEM_DELETE_ARCHIVED_SQL = (
+    "DELETE FROM {table} WHERE unique_id = ? AND status = 'archived' RETURNING channel_message_id, user_id"
+)
+PRODUCT_ADMIN_LIST_SQL = "SELECT unique_id, user_id, category, sort, status, created_at FROM products"
+REQUEST_ADMIN_LIST_SQL = "SELECT unique_id, user_id, category, sort, status FROM requests WHERE status = 'active'"
+PRODUCT_COMPLETE_SQL = "UPDATE products SET final_price = ?, status = 'completed', completed_at = ? WHERE unique_id = ?"
+MARK_PENDING_RESPONSE_SQL = "UPDATE {table} SET status = 'pending_response' WHERE unique_id = ? AND status = 'active'"
+ARCHIVE_PENDING_SQL = (
+    "UPDATE products SET status = 'archived', archived_at = ? WHERE unique_id = ? AND status = 'pending_response' "
+    "RETURNING channel_message_id, user_id"
+)
+DELETE_PENDING_SQL = (
+    "DELETE FROM requests WHERE unique_id = ? AND status = 'pending_response' "
+    "RETURNING channel_message_id, user_id"
+)
+MARK_FINAL_PRICE_DUE_SQL = (
+    "INSERT OR IGNORE INTO final_price_due (unique_id, user_id, due_ts) "
+    "SELECT unique_id, user_id, created_ts + ? FROM products "
+    "WHERE status = 'active' AND final_price IS NULL AND created_ts <= ? "
+    "RETURNING unique_id, user_id"
+)
+FINAL_PRICE_DUE_SQL = "SELECT unique_id FROM final_price_due WHERE user_id = ? ORDER BY due_ts"
+FIND_DUPLICATE_SQL = (
+    "SELECT unique_id FROM requests "
+    "WHERE user_id = ? AND category = ? AND sort = ? AND region = ? AND status = 'active'"
+)
+USER_GET_SQL = (
+    "SELECT u.id, u.phone_number, u.role, u.region, u.district, u.company_name, u.unique_id, "
+    "(SELECT COUNT(*) FROM pending_items pi WHERE pi.user_id = u.id), "
+    "EXISTS (SELECT 1 FROM final_price_due d WHERE d.user_id = u.id) "
+    "FROM users u WHERE u.id = ?"
+)
+USER_ROLE_SQL = "SELECT role FROM users WHERE id = ?"
+USER_IDS_SQL = "SELECT id FROM users"
+USER_OTHER_IDS_SQL = "SELECT id FROM users WHERE id != ?"
+USER_ROLE_COUNTS_SQL = "SELECT role, COUNT(*) FROM users GROUP BY role"
+USER_CREATED_SINCE_SQL = "SELECT COUNT(*) FROM users WHERE created_ts > ?"
+USER_ADMIN_LIST_SQL = (
+    "SELECT u.id, u.phone_number, u.role, u.unique_id, p.bot_expires, p.trial_used "
+    "FROM users u LEFT JOIN payments p ON u.id = p.user_id"
+)
+USER_BLOCKED_SQL = "SELECT blocked FROM deleted_users WHERE user_id = ? AND blocked = 1"
+USER_DELETED_COUNT_SQL = "SELECT COUNT(*) FROM deleted_users"
+USER_MOVE_TO_DELETED_SQL = (
+    "INSERT INTO deleted_users "
+    "(user_id, phone_number, role, region, district, company_name, unique_id, deleted_at, blocked) "
+    "SELECT id, phone_number, role, region, district, company_name, unique_id, ?, 0 FROM users WHERE id = ?"
+)
+USER_DELETE_SQL = "DELETE FROM users WHERE id = ?"
+PAYMENT_GET_SQL = "SELECT user_id, bot_expires, channel_expires, trial_used, bot_expires_ts FROM payments WHERE user_id = ?"
+ACTIVE_SUBSCRIPTIONS_SQL = (
+    "SELECT p.user_id, p.bot_expires, u.phone_number, u.role, p.trial_used "
+    "FROM payments p JOIN users u ON p.user_id = u.id WHERE p.bot_expires_ts > ?"
+)
+ACTIVE_SUBSCRIPTIONS_COUNT_SQL = "SELECT COUNT(*) FROM payments WHERE bot_expires_ts > ?"
+PAYMENT_SET_BOT_EXPIRES_SQL = "INSERT OR REPLACE INTO payments (user_id, bot_expires) VALUES (?, ?)"
+PAYMENT_DELETE_SQL = "DELETE FROM payments WHERE user_id = ?"
+
+class _Row:
+    """Компактная строка результата: значения в __slots__, порядок полей задаёт FIELDS."""
+    __slots__ = ()
+    FIELDS: tuple = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.FIELDS, values):
+            setattr(self, name, value)
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.FIELDS)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.FIELDS)})"
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+class ItemRow(_Row):
+    """Эълон или сўров в списках пользователя."""
+    __slots__ = FIELDS = ("id", "unique_id", "category", "region", "sort", "volume_ton", "price", "photos", "created_at", "created_ts")
+
+class BoardItem(_Row):
+    """Элемент доски объявлений WebApp вместе с контактами автора."""
+    __slots__ = FIELDS = (
+        "id", "user_id", "category", "sort", "volume_ton", "price", "photos", "unique_id", "status",
+        "created_at", "channel_message_id", "final_price", "archived_at", "region", "phone_number", "created_ts",
+    )
+
+class UserRow(_Row):
+    """Профиль пользователя вместе с флагами, которые middleware проверяет на каждом апдейте:
+    число pending_items и наличие эълонов, ждущих final_price."""
+    __slots__ = FIELDS = (
+        "id", "phone_number", "role", "region", "district", "company_name", "unique_id",
+        "pending_count", "has_expired_products",
+    )
+
+class UserContext(_Row):
+    """Неизменяемый снимок пользователя на время обработки одного апдейта."""
+    __slots__ = FIELDS = (
+        "user_id", "registered", "role", "phone_number", "region",
+        "subscribed", "pending_count", "has_expired_products",
+    )
+
+    def __init__(self, *values):
+        for name, value in zip(self.FIELDS, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"UserContext неизменяем: {name}")
+
+    @property
+    def has_pending(self) -> bool:
+        return self.pending_count > 0
+
+class PaymentRow(_Row):
+    __slots__ = FIELDS = ("user_id", "bot_expires", "channel_expires", "trial_used", "bot_expires_ts")
+
+class SubscriptionRow(_Row):
+    __slots__ = FIELDS = ("user_id", "bot_expires", "phone_number", "role", "trial_used")
+
+class _ItemRepo:
+    """Общие запросы к products/requests; SQL постоянный, поэтому sqlite3 переиспользует подготовленные выражения."""
+    table = ""
+    photos_column = "NULL"
+    expiring_filter = ""
+
+    @classmethod
+    def _item_columns(cls, alias: str = "") -> str:
+        prefix = f"{alias}." if alias else ""
+        return (
+            f"{prefix}id, {prefix}unique_id, {prefix}category, {prefix}region, {prefix}sort, "
+            f"{prefix}volume_ton, {prefix}price, {cls.photos_column}, {prefix}created_at, {prefix}created_ts"
+        )
+
+    @classmethod
+    def _board_columns(cls) -> str:
+        photos = f"p.{cls.photos_column}" if cls.photos_column != "NULL" else "NULL"
+        return (
+            f"p.id, p.user_id, p.category, p.sort, p.volume_ton, p.price, {photos}, p.unique_id, p.status, "
+            f"p.created_at, p.channel_message_id, p.final_price, p.archived_at, u.region, u.phone_number, p.created_ts"
+        )
+
+    @classmethod
+    def sql(cls, template: str, category_filter: str = "") -> str:
+        """Подставляет в шаблон SQL таблицу и колонки этого репозитория."""
+        return template.format(
+            table=cls.table, item_columns=cls._item_columns(), board_columns=cls._board_columns(),
+            expiring_filter=cls.expiring_filter, category_filter=category_filter,
+        )
+
+    @classmethod
+    async def list_user_active(cls, conn: aiosqlite.Connection, user_id: int) -> list[ItemRow]:
+        """Активные элементы пользователя в порядке создания."""
+        async with _timed(f"{cls.table}.list_user_active"):
+            async with conn.execute(cls.sql(ITEM_USER_ACTIVE_SQL), (user_id,)) as cursor:
+                return [ItemRow(*row) for row in await cursor.fetchall()]
+
+    @classmethod
+    async def board_active(cls, conn: aiosqlite.Connection) -> list[BoardItem]:
+        """Все активные элементы доски, новые первыми."""
+        async with _timed(f"{cls.table}.board_active"):
+            async with conn.execute(cls.sql(BOARD_ACTIVE_SQL)) as cursor:
+                return [BoardItem(*row) for row in await cursor.fetchall()]
+
+    @classmethod
+    def _board_filter(
+            cls,
+            since_ts: int,
+            status: Optional[str],
+            category: Optional[str],
+            region: Optional[str],
+            match: Optional[str]
+    ) -> tuple[str, list]:
+        if match:
+            # Поиск идёт по индексу FTS5, строки таблицы берутся по rowid найденных документов
+            where = (
+                f"FROM {cls.table}_fts f JOIN {cls.table} p ON p.id = f.rowid JOIN users u ON p.user_id = u.id "
+                f"WHERE f.{cls.table}_fts MATCH ? AND p.status != 'hidden' AND p.created_ts >= ?"
+            )
+            params = [match, since_ts]
+        else:
+            where = f"FROM {cls.table} p JOIN users u ON p.user_id = u.id WHERE p.status != 'hidden' AND p.created_ts >= ?"
+            params = [since_ts]
+        if status:
+            where += " AND p.status = ?"
+            params.append(status)
+        if category:
+            where += " AND p.category = ?"
+            params.append(category)
+        if region:
+            where += " AND u.region = ?"
+            params.append(region)
+        return where, params
+
+    @classmethod
+    def board_page_query(
+            cls,
+            since_ts: int,
+            status: Optional[str] = None,
+            category: Optional[str] = None,
+            region: Optional[str] = None,
+            match: Optional[str] = None,
+            limit: int = 20,
+            after: Optional[BoardPosition] = None
+    ) -> tuple[str, list]:
+        """SQL и параметры страницы доски (limit + 1 строк: лишняя показывает, что есть следующая страница).
+        Последняя колонка — ключ сортировки для позиции следующей страницы."""
+        where, params = cls._board_filter(since_ts, status, category, region, match)
+        if match:
+            sort_key, order = "f.rank", "f.rank, p.id DESC"
+            if after is not None:
+                where += " AND (f.rank > ? OR (f.rank = ? AND p.id < ?))"
+                params.extend([after[0], after[0], after[1]])
+        else:
+            sort_key, order = "p.created_ts", "p.created_ts DESC, p.id DESC"
+            if after is not None:
+                # Сравнение пар идёт по индексу (status, created_ts), в котором id — rowid: глубина страницы не влияет на цену
+                where += " AND (p.created_ts, p.id) < (?, ?)"
+                params.extend(after)
+        return f"SELECT {cls._board_columns()}, {sort_key} {where} ORDER BY {order} LIMIT ?", params + [limit + 1]
+
+    @classmethod
+    async def board_page(
+            cls,
+            conn: aiosqlite.Connection,
+            since_ts: int,
+            status: Optional[str] = None,
+            category: Optional[str] = None,
+            region: Optional[str] = None,
+            match: Optional[str] = None,
+            limit: int = 20,
+            after: Optional[BoardPosition] = None
+    ) -> tuple[list[BoardItem], Optional[BoardPosition]]:
+        """Страница доски после позиции after и позиция следующей страницы. Без поиска — новые первыми по (created_ts, id),
+        с выражением FTS5 match — по релевантности bm25, при равной релевантности новые первыми."""
+        query, params = cls.board_page_query(since_ts, status, category, region, match, limit, after)
+        async with _timed(f"{cls.table}.board_search" if match else f"{cls.table}.board_page"):
+            async with conn.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+        if len(rows) <= limit:
+            return [BoardItem(*row[:-1]) for row in rows], None
+        rows = rows[:limit]
+        return [BoardItem(*row[:-1]) for row in rows], (rows[-1][-1], rows[-1][0])
+
+    @classmethod
+    async def board_count(
+            cls,
+            conn: aiosqlite.Connection,
+            since_ts: int,
+            status: Optional[str] = None,
+            category: Optional[str] = None,
+            region: Optional[str] = None,
+            match: Optional[str] = None
+    ) -> int:
+        """Число элементов доски с фильтрами. Активные без фильтра по региону и поиску считаются по item_counts
+        за вычетом активных старше since_ts (их единицы, выборка идёт по индексу status, created_ts),
+        остальные — COUNT(*) по выборке."""
+        if status == "active" and not region and not match:
+            query = ITEM_COUNTS_SQL
+            params = [cls.table, status]
+            stale_filter, stale_extra = (" AND category = ?", [category]) if category else ("", [])
+            stale_query = cls.sql(BOARD_STALE_COUNT_SQL, stale_filter)
+            stale_params = [status, since_ts, *stale_extra, status, *stale_extra]
+            if category:
+                query += " AND category = ?"
+                params.append(category)
+            async with _timed(f"{cls.table}.board_count_cached"):
+                async with conn.execute(query, params) as cursor:
+                    total = (await cursor.fetchone())[0]
+                async with conn.execute(stale_query, stale_params) as cursor:
+                    return total - (await cursor.fetchone())[0]
+        where, params = cls._board_filter(since_ts, status, category, region, match)
+        async with _timed(f"{cls.table}.board_count"):
+            async with conn.execute(f"SELECT COUNT(*) {where}", params) as cursor:
+                return (await cursor.fetchone())[0]
+
+    @classmethod
+    async def board_version(cls, conn: aiosqlite.Connection) -> tuple[int, int]:
+        """Поколение доски (растёт при каждой записи в таблицу, входит в ключи кэша и ETag) и время его смены."""
+        async with _timed(f"{cls.table}.board_version"):
+            async with conn.execute(BOARD_VERSION_SQL, (cls.table,)) as cursor:
+                row = await cursor.fetchone()
+        return (row[0], row[1]) if row else (0, 0)
+
+    @classmethod
+    async def pending_expired(cls, conn: aiosqlite.Connection, cutoff_ts: int) -> list[str]:
+        """unique_id элементов в pending_response, созданных не позже cutoff_ts."""
+        async with _timed(f"{cls.table}.pending_expired"):
+            async with conn.execute(cls.sql(PENDING_EXPIRED_SQL), (cutoff_ts,)) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    @classmethod
+    async def expiring_window(
+            cls, conn: aiosqlite.Connection, start_ts: int, end_ts: int, after_id: int, limit: int
+    ) -> list[tuple]:
+        """Активные элементы (id, user_id, unique_id, created_ts), созданные в окне [start_ts, end_ts], по возрастанию id."""
+        async with _timed(f"{cls.table}.expiring_window"):
+            async with conn.execute(cls.sql(EXPIRING_WINDOW_SQL), (start_ts, end_ts, after_id, limit)) as cursor:
+                return await cursor.fetchall()
+
+    @classmethod
+    async def active_ids(cls, conn: aiosqlite.Connection) -> list[str]:
+        """unique_id всех активных элементов (кнопки админ-панели)."""
+        async with _timed(f"{cls.table}.active_ids"):
+            async with conn.execute(cls.sql(ITEM_ACTIVE_IDS_SQL)) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    @classmethod
+    async def archived(cls, conn: aiosqlite.Connection) -> list[tuple]:
+        """Архивные элементы (unique_id, category, sort, user_id)."""
+        async with _timed(f"{cls.table}.archived"):
+            async with conn.execute(cls.sql(ITEM_ARCHIVED_SQL)) as cursor:
+                return await cursor.fetchall()
+
+    @classmethod
+    async def admin_list(cls, conn: aiosqlite.Connection) -> list[tuple]:
+        """Строки списка элементов в админ-панели."""
+        async with _timed(f"{cls.table}.admin_list"):
+            async with conn.execute(cls.admin_list_sql) as cursor:
+                return await cursor.fetchall()
+
+    @classmethod
+    async def status_counts(cls, conn: aiosqlite.Connection) -> dict[str, int]:
+        """Число элементов по статусам из счётчиков item_counts, без COUNT(*) по таблице."""
+        async with _timed(f"{cls.table}.status_counts"):
+            async with conn.execute(ITEM_STATUS_COUNTS_SQL, (cls.table,)) as cursor:
+                return {row[0]: row[1] for row in await cursor.fetchall()}
+
+    @classmethod
+    async def created_since(cls, conn: aiosqlite.Connection, since_ts: int) -> int:
+        async with _timed(f"{cls.table}.created_since"):
+            async with conn.execute(cls.sql(ITEM_CREATED_SINCE_SQL), (since_ts,)) as cursor:
+                return (await cursor.fetchone())[0]
+
+    @classmethod
+    async def delete(cls, conn: aiosqlite.Connection, unique_id: str) -> Optional[tuple]:
+        """Помечает элемент удалённым; (channel_message_id, user_id) или None, если его нет."""
+        async with _timed(f"{cls.table}.delete"):
+            async with conn.execute(cls.sql(ITEM_DELETE_SQL), (unique_id,)) as cursor:
+                return await cursor.fetchone()
+
+    @classmethod
+    async def archive_active(cls, conn: aiosqlite.Connection, unique_id: str, archived_at: str) -> Optional[tuple]:
+        """Архивирует активный элемент; (channel_message_id, user_id) или None, если активного нет."""
+        async with _timed(f"{cls.table}.archive_active"):
+            async with conn.execute(cls.sql(ITEM_ARCHIVE_ACTIVE_SQL), (archived_at, unique_id)) as cursor:
+                return await cursor.fetchone()
+
+    @classmethod
+    async def delete_archived(cls, conn: aiosqlite.Connection, unique_id: str) -> Optional[tuple]:
+        """Удаляет архивный элемент из таблицы; (channel_message_id, user_id) или None, если его нет в архиве."""
+        async with _timed(f"{cls.table}.delete_archived"):
+            async with conn.execute(cls.sql(ITEM_DELETE_ARCHIVED_SQL), (unique_id,)) as cursor:
+                return await cursor.fetchone()
+
+    @classmethod
+    async def mark_pending_response(cls, conn: aiosqlite.Connection, unique_ids: list[str]) -> list[str]:
+        """Переводит активные элементы в pending_response; возвращает unique_id тех, что ещё были активны."""
+        marked = []
+        async with _timed(f"{cls.table}.mark_pending_response"):
+            for unique_id in unique_ids:
+                async with conn.execute(cls.sql(MARK_PENDING_RESPONSE_SQL), (unique_id,)) as cursor:
+                    if cursor.rowcount:
+                        marked.append(unique_id)
+        return marked
+
+class ProductRepo(_ItemRepo):
+    table = "products"
+    photos_column = "photos"
+    expiring_filter = " AND p.final_price IS NULL"
+    admin_list_sql = PRODUCT_ADMIN_LIST_SQL
+
+    @classmethod
+    async def mark_final_price_due(cls, conn: aiosqlite.Connection, cutoff_ts: int, deadline: int) -> list[tuple[str, int]]:
+        """Отмечает активные эълоны без final_price, созданные не позже cutoff_ts; возвращает только новые (unique_id, user_id)."""
+        async with _timed("products.mark_final_price_due"):
+            async with conn.execute(MARK_FINAL_PRICE_DUE_SQL, (deadline, cutoff_ts)) as cursor:
+                return await cursor.fetchall()
+
+    @classmethod
+    async def archive_pending(cls, conn: aiosqlite.Connection, unique_id: str, archived_at: str) -> Optional[tuple]:
+        """Архивирует эълон в pending_response; (channel_message_id, user_id) или None, если он уже не ждёт ответа."""
+        async with _timed("products.archive_pending"):
+            async with conn.execute(ARCHIVE_PENDING_SQL, (archived_at, unique_id)) as cursor:
+                return await cursor.fetchone()
+
+    @classmethod
+    async def complete(cls, conn: aiosqlite.Connection, unique_id: str, final_price: float, completed_at: str) -> None:
+        """Закрывает эълон с final_price."""
+        async with _timed("products.complete"):
+            await conn.execute(PRODUCT_COMPLETE_SQL, (final_price, completed_at, unique_id))
+
+    @classmethod
+    async def final_price_due(cls, conn: aiosqlite.Connection, user_id: int) -> list[str]:
+        """unique_id эълонов пользователя, ждущих final_price."""
+        async with _timed("products.final_price_due"):
+            async with conn.execute(FINAL_PRICE_DUE_SQL, (user_id,)) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+class RequestRepo(_ItemRepo):
+    table = "requests"
+    admin_list_sql = REQUEST_ADMIN_LIST_SQL
+
+    @classmethod
+    async def delete_pending(cls, conn: aiosqlite.Connection, unique_id: str) -> Optional[tuple]:
+        """Удаляет сўров в pending_response; (channel_message_id, user_id) или None, если он уже не ждёт ответа."""
+        async with _timed("requests.delete_pending"):
+            async with conn.execute(DELETE_PENDING_SQL, (unique_id,)) as cursor:
+                return await cursor.fetchone()
+
+    @classmethod
+    async def find_duplicate(
+            cls, conn: aiosqlite.Connection, user_id: int, category: str, sort: str, region: str
+    ) -> Optional[str]:
+        """unique_id активного сўрова пользователя с теми же категорией, сортом и вилоятом."""
+        async with _timed("requests.find_duplicate"):
+            async with conn.execute(FIND_DUPLICATE_SQL, (user_id, category, sort, region)) as cursor:
+                row = await cursor.fetchone()
+        return row[0] if row else None
+
+class UserRepo:
+    @staticmethod
+    async def get(conn: aiosqlite.Connection, user_id: int) -> Optional[UserRow]:
+        async with _timed("users.get"):
+            async with conn.execute(USER_GET_SQL, (user_id,)) as cursor:
+                row = await cursor.fetchone()
+        return UserRow(*row) if row else None
+
+    @staticmethod
+    async def get_role(conn: aiosqlite.Connection, user_id: int) -> tuple[bool, Optional[str]]:
+        """(найден ли пользователь, его роль)."""
+        async with _timed("users.get_role"):
+            async with conn.execute(USER_ROLE_SQL, (user_id,)) as cursor:
+                row = await cursor.fetchone()
+        return (True, row[0]) if row else (False, None)
+
+    @staticmethod
+    async def ids(conn: aiosqlite.Connection, exclude_id: Optional[int] = None) -> list[int]:
+        """id всех пользователей, кроме exclude_id."""
+        query, params = (USER_IDS_SQL, ()) if exclude_id is None else (USER_OTHER_IDS_SQL, (exclude_id,))
+        async with _timed("users.ids"):
+            async with conn.execute(query, params) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    @staticmethod
+    async def role_counts(conn: aiosqlite.Connection) -> dict[str, int]:
+        async with _timed("users.role_counts"):
+            async with conn.execute(USER_ROLE_COUNTS_SQL) as cursor:
+                return {row[0]: row[1] for row in await cursor.fetchall()}
+
+    @staticmethod
+    async def created_since(conn: aiosqlite.Connection, since_ts: int) -> int:
+        async with _timed("users.created_since"):
+            async with conn.execute(USER_CREATED_SINCE_SQL, (since_ts,)) as cursor:
+                return (await cursor.fetchone())[0]
+
+    @staticmethod
+    async def admin_list(conn: aiosqlite.Connection) -> list[tuple]:
+        """Пользователи с подпиской: (id, phone_number, role, unique_id, bot_expires, trial_used)."""
+        async with _timed("users.admin_list"):
+            async with conn.execute(USER_ADMIN_LIST_SQL) as cursor:
+                return await cursor.fetchall()
+
+    @staticmethod
+    async def is_blocked(conn: aiosqlite.Connection, user_id: int) -> bool:
+        async with _timed("users.is_blocked"):
+            async with conn.execute(USER_BLOCKED_SQL, (user_id,)) as cursor:
+                return await cursor.fetchone() is not None
+
+    @staticmethod
+    async def deleted_count(conn: aiosqlite.Connection) -> int:
+        async with _timed("users.deleted_count"):
+            async with conn.execute(USER_DELETED_COUNT_SQL) as cursor:
+                return (await cursor.fetchone())[0]
+
+    @staticmethod
+    async def delete(conn: aiosqlite.Connection, user_id: int, deleted_at: str) -> None:
+        """Копирует профиль в deleted_users и удаляет пользователя; commit делает вызывающий."""
+        async with _timed("users.delete"):
+            await conn.execute(USER_MOVE_TO_DELETED_SQL, (deleted_at, user_id))
+            await conn.execute(USER_DELETE_SQL, (user_id,))
+
+class PaymentRepo:
+    @staticmethod
+    async def get(conn: aiosqlite.Connection, user_id: int) -> Optional[PaymentRow]:
+        async with _timed("payments.get"):
+            async with conn.execute(PAYMENT_GET_SQL, (user_id,)) as cursor:
+                row = await cursor.fetchone()
+        return PaymentRow(*row) if row else None
+
+    @staticmethod
+    async def active_subscriptions(conn: aiosqlite.Connection, now_ts: int) -> list[SubscriptionRow]:
+        async with _timed("payments.active_subscriptions"):
+            async with conn.execute(ACTIVE_SUBSCRIPTIONS_SQL, (now_ts,)) as cursor:
+                return [SubscriptionRow(*row) for row in await cursor.fetchall()]
+
+    @staticmethod
+    async def active_count(conn: aiosqlite.Connection, now_ts: int) -> int:
+        async with _timed("payments.active_count"):
+            async with conn.execute(ACTIVE_SUBSCRIPTIONS_COUNT_SQL, (now_ts,)) as cursor:
+                return (await cursor.fetchone())[0]
+
+    @staticmethod
+    async def set_bot_expires(conn: aiosqlite.Connection, user_id: int, bot_expires: str) -> None:
+        async with _timed("payments.set_bot_expires"):
+            await conn.execute(PAYMENT_SET_BOT_EXPIRES_SQL, (user_id, bot_expires))
+
+    @staticmethod
+    async def delete(conn: aiosqlite.Connection, user_id: int) -> None:
+        async with _timed("payments.delete"):
+            await conn.execute(PAYMENT_DELETE_SQL, (user_id,))
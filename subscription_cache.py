@@ -0,0 +1,72 @@
+import logging
+import time
+from typing import Optional
+
+import json_codec
+from config import SUB_CACHE_MAX_TTL, SUB_CACHE_NEGATIVE_TTL
+
+logger = logging.getLogger(__name__)
+
+class SubscriptionCache:
+    """Кэш результата check_subscription в Redis: активная подписка живёт до bot_expires, отказ — negative_ttl."""
+
+    def __init__(self, max_ttl: int, negative_ttl: int):
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.redis = None
+        self._stats = {"hits": 0, "negative_hits": 0, "misses": 0, "invalidated": 0}
+
+    def attach_redis(self, redis) -> None:
+        """Подключает клиент Redis (storage.redis); без него кэш отключён."""
+        self.redis = redis
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"sub:{user_id}"
+
+    async def get(self, user_id: int) -> Optional[tuple[bool, bool, bool]]:
+        """Закэшированный (success, bot_active, is_subscribed) или None."""
+        if self.redis is None:
+            return None
+        try:
+            cached = await self.redis.get(self._key(user_id))
+        except Exception as e:
+            logger.warning(f"Redis error in SubscriptionCache.get for user_id={user_id}: {e}")
+            return None
+        if not cached:
+            self._stats["misses"] += 1
+            return None
+        response = tuple(json_codec.loads(cached))
+        self._stats["hits" if response[2] else "negative_hits"] += 1
+        return response
+
+    async def put(self, user_id: int, response: tuple[bool, bool, bool], expires_ts: Optional[int]) -> None:
+        """Сохраняет результат: до момента истечения подписки либо на negative_ttl."""
+        if self.redis is None:
+            return
+        if response[2] and expires_ts:
+            ttl = min(expires_ts - int(time.time()), self.max_ttl)
+            if ttl <= 0:
+                return
+        else:
+            ttl = self.negative_ttl
+        try:
+            await self.redis.set(self._key(user_id), json_codec.dumps_bytes(response), ex=ttl)
+        except Exception as e:
+            logger.warning(f"Redis error caching subscription for user_id={user_id}: {e}")
+
+    async def invalidate(self, user_id: int) -> None:
+        """Удаляет запись после изменения payments."""
+        if self.redis is None:
+            return
+        try:
+            await self.redis.delete(self._key(user_id))
+            self._stats["invalidated"] += 1
+        except Exception as e:
+            logger.warning(f"Redis error invalidating subscription for user_id={user_id}: {e}")
+
+    def stats(self) -> dict:
+        """Возвращает попадания (положительные и отрицательные), промахи и инвалидации."""
+        return dict(self._stats)
+
+subscription_cache = SubscriptionCache(SUB_CACHE_MAX_TTL, SUB_CACHE_NEGATIVE_TTL)
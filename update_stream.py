@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import socket
+from typing import Optional
+
+import json_codec
+from config import UPDATE_STREAM_KEY, UPDATE_STREAM_GROUP, UPDATE_STREAM_MAXLEN, UPDATE_STREAM_CLAIM_IDLE
+from update_workers import UpdateWorkerPool
+
+logger = logging.getLogger(__name__)
+
+# Сколько записей читать за раз и сколько ждать новых (мс)
+READ_COUNT = 50
+READ_BLOCK_MS = 5000
+# Как часто проверять зависшие у других потребителей записи (секунды)
+CLAIM_INTERVAL = 30
+# Во сколько раз чаще claim_idle_ms продлевать простой записей, которые ещё обрабатываются в этом процессе
+HEARTBEAT_DIVISOR = 3
+
+class UpdateStream:
+    """Redis Stream с обновлениями Telegram: вебхук добавляет запись, процессы бота читают её через группу потребителей.
+
+    Порядок обновлений одного пользователя сохраняется только внутри процесса (UpdateWorkerPool);
+    между процессами группа раздаёт записи независимо, и два обновления пользователя могут
+    обрабатываться параллельно в разных процессах."""
+
+    def __init__(self, key: str, group: str, maxlen: int, claim_idle_ms: int):
+        self.key = key
+        self.group = group
+        self.maxlen = maxlen
+        self.claim_idle_ms = claim_idle_ms
+        self.consumer = f"{socket.gethostname()}:{os.getpid()}"
+        self.redis = None
+        self._task: Optional[asyncio.Task] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        # Записи, уже переданные обработчикам этого процесса: повторный XAUTOCLAIM их не дублирует
+        self._inflight: set = set()
+        self._stats = {"published": 0, "consumed": 0, "claimed": 0, "acked": 0}
+
+    def attach_redis(self, redis) -> None:
+        """Подключает клиент Redis (storage.redis)."""
+        self.redis = redis
+
+    async def ensure_group(self) -> None:
+        """Создаёт поток и группу потребителей, если их ещё нет."""
+        try:
+            await self.redis.xgroup_create(self.key, self.group, id="0", mkstream=True)
+            logger.info(f"Создана группа потребителей {self.group} для {self.key}")
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def publish(self, raw_update: bytes) -> None:
+        """Добавляет тело вебхука в поток как есть; старые записи обрезаются по maxlen."""
+        await self.redis.xadd(self.key, {"update": raw_update}, maxlen=self.maxlen, approximate=True)
+        self._stats["published"] += 1
+
+    async def _ack(self, entry_id) -> None:
+        try:
+            await self.redis.xack(self.key, self.group, entry_id)
+            self._stats["acked"] += 1
+        finally:
+            self._inflight.discard(entry_id)
+
+    async def _dispatch(self, workers: UpdateWorkerPool, entries: list) -> None:
+        for entry_id, fields in entries:
+            if entry_id in self._inflight:
+                continue
+            self._inflight.add(entry_id)
+            if not fields:
+                # Запись удалена обрезкой потока, пока висела в pending
+                await self._ack(entry_id)
+                continue
+            raw = fields.get(b"update") or fields.get("update")
+            try:
+                update = json_codec.loads(raw)
+            except (TypeError, ValueError) as e:
+                logger.error(f"Некорректная запись {entry_id} в {self.key}: {e}")
+                await self._ack(entry_id)
+                continue
+            await workers.put(update, lambda entry_id=entry_id: self._ack(entry_id))
+
+    async def _claim_stale(self, workers: UpdateWorkerPool) -> None:
+        """Забирает записи, которые другие потребители прочитали, но не подтвердили дольше claim_idle_ms."""
+        start_id = "0-0"
+        while True:
+            result = await self.redis.xautoclaim(
+                self.key, self.group, self.consumer, self.claim_idle_ms, start_id=start_id, count=READ_COUNT
+            )
+            start_id, entries = result[0], result[1]
+            if entries:
+                self._stats["claimed"] += len(entries)
+                logger.warning(f"Забрано {len(entries)} неподтверждённых обновлений из {self.key}")
+                await self._dispatch(workers, entries)
+            if start_id in (b"0-0", "0-0"):
+                return
+
+    async def _heartbeat(self) -> None:
+        """Пока обработчик работает (рассылка может идти минутами), сбрасывает простой его записи через
+        XCLAIM JUSTID, чтобы другие потребители не забрали её по claim_idle_ms и не выполнили повторно."""
+        interval = self.claim_idle_ms / 1000 / HEARTBEAT_DIVISOR
+        while True:
+            await asyncio.sleep(interval)
+            if not self._inflight:
+                continue
+            try:
+                await self.redis.xclaim(self.key, self.group, self.consumer, 0, list(self._inflight), justid=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка продления записей {self.key} в обработке: {e}")
+
+    async def consume(self, workers: UpdateWorkerPool) -> None:
+        """Читает поток через группу и передаёт обновления обработчикам; XACK после обработки."""
+        await self.ensure_group()
+        logger.info(f"Потребитель {self.consumer} читает {self.key} (группа {self.group})")
+        loop = asyncio.get_running_loop()
+        next_claim = 0.0
+        while True:
+            try:
+                if loop.time() >= next_claim:
+                    await self._claim_stale(workers)
+                    next_claim = loop.time() + CLAIM_INTERVAL
+                response = await self.redis.xreadgroup(
+                    self.group, self.consumer, {self.key: ">"}, count=READ_COUNT, block=READ_BLOCK_MS
+                )
+                for _, entries in response or []:
+                    self._stats["consumed"] += len(entries)
+                    await self._dispatch(workers, entries)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка чтения потока {self.key}: {e}", exc_info=True)
+                await asyncio.sleep(1)
+
+    def start(self, workers: UpdateWorkerPool) -> None:
+        """Запускает чтение потока в фоне."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.consume(workers), name="update_stream_consumer")
+            self._heartbeat_task = asyncio.create_task(self._heartbeat(), name="update_stream_heartbeat")
+
+    async def wait(self) -> None:
+        """Ждёт завершения чтения потока (используется процессом без вебхука)."""
+        if self._task is not None:
+            await self._task
+
+    async def stop(self) -> None:
+        """Останавливает чтение; непрочитанные и неподтверждённые записи остаются в Redis."""
+        if self._task is None:
+            return
+        for task in (self._task, self._heartbeat_task):
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._heartbeat_task = None
+        logger.info(f"Потребитель {self.consumer} остановлен, статистика: {self.stats()}")
+
+    def stats(self) -> dict:
+        """Возвращает счётчики опубликованных, прочитанных, забранных и подтверждённых записей."""
+        return {**self._stats, "inflight": len(self._inflight)}
+
+update_stream = UpdateStream(UPDATE_STREAM_KEY, UPDATE_STREAM_GROUP, UPDATE_STREAM_MAXLEN, UPDATE_STREAM_CLAIM_IDLE)
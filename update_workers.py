@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from aiogram import Bot, Dispatcher
+
+from config import UPDATE_WORKERS, UPDATE_QUEUE_SIZE
+from fsm_storage import fsm_scope
+from utils import notify_admin
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать обработки очередей при остановке, прежде чем отменить обработчики
+DRAIN_TIMEOUT = 10
+
+def update_user_id(update: dict) -> int:
+    """user_id автора обновления (или chat_id), по которому выбирается обработчик; 0, если его нет."""
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        for field in ("from", "user", "chat"):
+            entity = value.get(field)
+            if isinstance(entity, dict) and "id" in entity:
+                return entity["id"]
+    return 0
+
+class UpdateWorkerPool:
+    """Обработчики обновлений, разделённые по user_id: порядок внутри пользователя сохраняется,
+    разные пользователи обрабатываются параллельно, очереди ограничены."""
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.shard_size = max(1, queue_size // workers)
+        self._queues: list[asyncio.Queue] = []
+        self._tasks: list[asyncio.Task] = []
+        self._bot: Optional[Bot] = None
+        self._dp: Optional[Dispatcher] = None
+        self._stats = {"accepted": 0, "rejected": 0, "processed": 0, "failed": 0, "max_depth": 0}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self, bot: Bot, dp: Dispatcher) -> None:
+        """Запускает обработчики; каждый читает свою очередь."""
+        if self.running:
+            return
+        self._bot, self._dp = bot, dp
+        self._queues = [asyncio.Queue(maxsize=self.shard_size) for _ in range(self.workers)]
+        self._tasks = [
+            asyncio.create_task(self._worker(index, queue), name=f"update_worker_{index}")
+            for index, queue in enumerate(self._queues)
+        ]
+        logger.info(f"Запущено {self.workers} обработчиков обновлений, очередь {self.shard_size} на обработчик")
+
+    def _queue_for(self, update: dict) -> asyncio.Queue:
+        return self._queues[update_user_id(update) % self.workers]
+
+    def submit(self, update: dict) -> bool:
+        """Ставит обновление в очередь его пользователя; False, если очередь переполнена."""
+        queue = self._queue_for(update)
+        try:
+            queue.put_nowait((update, None))
+        except asyncio.QueueFull:
+            self._stats["rejected"] += 1
+            logger.warning(f"Очередь обработчика переполнена ({queue.qsize()}), update_id={update.get('update_id')} отклонён")
+            return False
+        self._stats["accepted"] += 1
+        self._stats["max_depth"] = max(self._stats["max_depth"], queue.qsize())
+        return True
+
+    async def put(self, update: dict, on_done: Callable[[], Awaitable[None]]) -> None:
+        """Ставит обновление в очередь, дожидаясь места; on_done вызывается после обработки."""
+        queue = self._queue_for(update)
+        await queue.put((update, on_done))
+        self._stats["accepted"] += 1
+        self._stats["max_depth"] = max(self._stats["max_depth"], queue.qsize())
+
+    async def _worker(self, index: int, queue: asyncio.Queue) -> None:
+        while True:
+            update, on_done = await queue.get()
+            update_id = update.get("update_id")
+            try:
+                async with fsm_scope(self._dp.storage):
+                    await self._dp.feed_raw_update(self._bot, update)
+                self._stats["processed"] += 1
+                logger.info(f"Обработан update_id={update_id} (обработчик {index})")
+            except Exception as e:
+                self._stats["failed"] += 1
+                logger.error(f"Ошибка обработки update_id={update_id} в обработчике {index}: {e}", exc_info=True)
+                await notify_admin(f"Ошибка обработки update_id={update_id}: {str(e)}", bot=self._bot)
+            finally:
+                if on_done is not None:
+                    try:
+                        await on_done()
+                    except Exception as e:
+                        logger.error(f"Ошибка подтверждения update_id={update_id}: {e}")
+                queue.task_done()
+
+    async def stop(self) -> None:
+        """Дожидается обработки принятых обновлений (не дольше DRAIN_TIMEOUT) и останавливает обработчики."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout=DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            pending = sum(queue.qsize() for queue in self._queues)
+            logger.warning(f"Очереди обновлений не опустели за {DRAIN_TIMEOUT} сек, потеряно {pending} обновлений")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info(f"Обработчики обновлений остановлены, статистика: {self.stats()}")
+
+    def stats(self) -> dict:
+        """Возвращает счётчики принятых, отклонённых и обработанных обновлений и глубину очередей."""
+        return {**self._stats, "queued": sum(queue.qsize() for queue in self._queues)}
+
+update_workers = UpdateWorkerPool(UPDATE_WORKERS, UPDATE_QUEUE_SIZE)
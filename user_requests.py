@@ -5,9 +5,12 @@ from aiogram import types, Dispatcher, F
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.exceptions import TelegramBadRequest
-from config import DB_NAME, BUYER_ROLE, CATEGORIES, MAX_SORT_LENGTH, MAX_VOLUME_TON, CHANNEL_ID, ADMIN_IDS, SELLER_ROLE, ADMIN_ROLE, DB_TIMEOUT
-from utils import check_role, make_keyboard, validate_number_minimal, validate_sort, check_subscription, format_uz_datetime, parse_uz_datetime, has_pending_items, get_requests_menu, get_ads_menu, get_main_menu, notify_admin
+from config import BUYER_ROLE, CATEGORIES, MAX_SORT_LENGTH, MAX_VOLUME_TON, CHANNEL_ID, ADMIN_IDS, SELLER_ROLE, ADMIN_ROLE
+from utils import make_keyboard, validate_number_minimal, validate_sort, format_uz_datetime, parse_uz_datetime, get_user_context, get_requests_menu, get_ads_menu, get_main_menu, notify_admin
 from database import generate_item_id
+from db_pool import pool
+from profile_cache import user_profiles
+from repositories import RequestRepo
 from regions import get_all_regions
 from datetime import datetime, timedelta
 from functools import wraps
@@ -38,24 +41,14 @@ def buyer_only(handler):
         current_state = await state.get_state()
         logger.info(f"buyer_only: user_id={user_id}, text='{message.text}', state={current_state}")
         try:
-            logger.debug(f"Проверка незавершённых элементов для user_id={user_id}")
-            has_pending = await has_pending_items(user_id)
-            if has_pending:
+            user_ctx = await get_user_context(user_id)
+            if user_ctx.has_pending:
                 await notify_next_pending_item(message, state)
                 logger.info(f"Пользователь {user_id} имеет незавершённые элементы")
                 return
 
-            logger.debug(f"Очистка кэша подписки для user_id={user_id}")
-            try:
-                await state.storage.redis.delete(f"sub:{user_id}")
-                logger.debug(f"Очищен кэш подписки для user_id={user_id}")
-            except Exception as e:
-                logger.warning(f"Ошибка очистки кэша подписки для user_id={user_id}: {e}")
-
-            logger.debug(f"Проверка подписки для user_id={user_id}")
-            success, bot_active, is_subscribed = await check_subscription(message.bot, user_id, state.storage)
-            logger.debug(f"check_subscription: user_id={user_id}, success={success}, bot_active={bot_active}, is_subscribed={is_subscribed}")
-            if not is_subscribed:
+            logger.debug(f"Подписка: user_id={user_id}, is_subscribed={user_ctx.subscribed}")
+            if not user_ctx.subscribed:
                 await message.answer(
                     "Сизда фаол обуна мавжуд эмас. Админ билан боғланинг (@ad_mbozor).",
                     reply_markup=get_main_menu(BUYER_ROLE)
@@ -64,14 +57,7 @@ def buyer_only(handler):
                 logger.info(f"Пользователь {user_id} перенаправлен на подписку")
                 return
 
-            logger.debug(f"Проверка регистрации для user_id={user_id}")
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute(
-                    "SELECT id FROM users WHERE id = ?",
-                    (user_id,)
-                ) as cursor:
-                    user_exists = await cursor.fetchone()
-            if not user_exists:
+            if not user_ctx.registered:
                 await message.answer(
                     "Сиз рўйхатдан ўтмагансиз. Илтимос, рўйхатдан ўтинг.",
                     reply_markup=get_main_menu(None)
@@ -80,10 +66,9 @@ def buyer_only(handler):
                 logger.warning(f"Пользователь {user_id} не зарегистрирован")
                 return
 
-            logger.debug(f"Проверка роли для user_id={user_id}")
-            allowed, role = await check_role(message, allow_unregistered=True)
-            logger.debug(f"check_role: user_id={user_id}, allowed={allowed}, role={role}")
-            if not allowed or (role != BUYER_ROLE and role != ADMIN_ROLE):
+            role = user_ctx.role
+            logger.debug(f"Роль: user_id={user_id}, role={role}")
+            if role != BUYER_ROLE and role != ADMIN_ROLE:
                 await message.answer(
                     "Бу буйруқ фақат харидорлар учун!",
                     reply_markup=get_main_menu(BUYER_ROLE)
@@ -160,8 +145,7 @@ async def handle_requests_back_button(message: types.Message, state: FSMContext,
         logger.debug(f"Пропущен handle_requests_back_button: text='{message.text}'")
         return
     try:
-        success, bot_active, is_subscribed = await check_subscription(message.bot, user_id, state.storage)
-        logger.debug(f"check_subscription в handle_requests_back_button: user_id={user_id}, success={success}, is_subscribed={is_subscribed}")
+        is_subscribed = (await get_user_context(user_id)).subscribed
         if not is_subscribed and role != ADMIN_ROLE:
             await message.answer(
                 "Сизда фаол обуна мавжуд эмас. Админ билан боғланинг (@ad_mbozor).",
@@ -410,23 +394,16 @@ async def process_price(message: types.Message, state: FSMContext, role: str):
             logger.warning(f"Некорректная цена от user_id={user_id}: {price}")
             return
         data = await state.get_data()
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND name='requests'"
-            ) as cursor:
-                if not await cursor.fetchone():
-                    raise aiosqlite.Error("Table 'requests' does not exist")
-            async with conn.execute(
-                "SELECT unique_id FROM requests WHERE user_id = ? AND category = ? AND sort = ? AND region = ? AND status = 'active'",
-                (user_id, data["category"], data["sort"], data["region"])
-            ) as cursor:
-                if await cursor.fetchone():
-                    await message.answer("Бундай сўров аллақачон мавжуд!", reply_markup=finish_menu)
-                    await state.clear()
-                    logger.warning(f"Дубликат запроса для user_id={user_id}: category={data['category']}, sort={data['sort']}, region={data['region']}")
-                    return
-            item_id = await generate_item_id("requests", "S")
-            created_at = format_uz_datetime(datetime.now(pytz.UTC))
+        async with pool.reader() as conn:
+            duplicate = await RequestRepo.find_duplicate(conn, user_id, data["category"], data["sort"], data["region"])
+        if duplicate:
+            await message.answer("Бундай сўров аллақачон мавжуд!", reply_markup=finish_menu)
+            await state.clear()
+            logger.warning(f"Дубликат запроса для user_id={user_id}: category={data['category']}, sort={data['sort']}, region={data['region']}")
+            return
+        item_id = await generate_item_id("requests", "S")
+        created_at = format_uz_datetime(datetime.now(pytz.UTC))
+        async with pool.writer() as conn:
             await conn.execute(
                 "INSERT INTO requests (unique_id, user_id, category, region, sort, volume_ton, price, status, created_at) "
                 "VALUES (?, ?, ?, ?, ?, ?, ?, 'active', ?)",
@@ -443,7 +420,7 @@ async def process_price(message: types.Message, state: FSMContext, role: str):
         )
         try:
             channel_msg = await message.bot.send_message(chat_id=CHANNEL_ID, text=info)
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
+            async with pool.writer() as conn:
                 await conn.execute(
                     "UPDATE requests SET channel_message_id = ? WHERE unique_id = ?",
                     (channel_msg.message_id, item_id)
@@ -488,38 +465,29 @@ async def requests_list(message: types.Message, state: FSMContext, role: str):
     user_id = message.from_user.id
     logger.debug(f"requests_list: user_id={user_id}, text='{message.text}'")
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND name='requests'"
-            ) as cursor:
-                if not await cursor.fetchone():
-                    raise aiosqlite.Error("Table 'requests' does not exist")
-            async with conn.execute(
-                "SELECT unique_id, category, region, sort, volume_ton, price, created_at "
-                "FROM requests WHERE user_id = ? AND status = 'active'",
-                (user_id,)
-            ) as cursor:
-                requests = await cursor.fetchall()
+        async with pool.reader() as conn:
+            requests = await RequestRepo.list_user_active(conn, user_id)
         if not requests:
             await message.answer("Сизда сўровлар йўқ.", reply_markup=get_requests_menu())
             await state.set_state(RequestsMenu.menu)
             logger.info(f"Пользователь {user_id} не имеет активных запросов")
             return
         now = datetime.now(pytz.UTC)
-        for unique_id, category, region, sort, volume_ton, price, created_at in requests:
-            created_at_dt = parse_uz_datetime(created_at)
+        for req in requests:
+            unique_id = req.unique_id
+            created_at_dt = parse_uz_datetime(req.created_at)
             if not created_at_dt:
-                logger.warning(f"Некорректный формат created_at для запроса {unique_id}: {created_at}")
+                logger.warning(f"Некорректный формат created_at для запроса {unique_id}: {req.created_at}")
                 continue
             expiration = created_at_dt + timedelta(hours=24)
             status = "Фаол" if now < expiration else "Муддати тугаган"
             info = (
                 f"Сўров {unique_id}\n"
-                f"Категория: {category}\n"
-                f"Сорт: {sort}\n"
-                f"Вилоят: {region}\n"
-                f"Ҳажм: {volume_ton} тонна\n"
-                f"Нарх: {price:,.0f} сўм\n"
+                f"Категория: {req.category}\n"
+                f"Сорт: {req.sort}\n"
+                f"Вилоят: {req.region}\n"
+                f"Ҳажм: {req.volume_ton} тонна\n"
+                f"Нарх: {req.price:,.0f} сўм\n"
                 f"Ҳолат: {status} ({format_uz_datetime(expiration)} гача)"
             )
             await message.answer(info)
@@ -547,23 +515,14 @@ async def requests_delete_start(message: types.Message, state: FSMContext, role:
     user_id = message.from_user.id
     logger.debug(f"requests_delete_start: user_id={user_id}, text='{message.text}'")
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND name='requests'"
-            ) as cursor:
-                if not await cursor.fetchone():
-                    raise aiosqlite.Error("Table 'requests' does not exist")
-            async with conn.execute(
-                "SELECT unique_id FROM requests WHERE user_id = ? AND status = 'active'",
-                (user_id,)
-            ) as cursor:
-                requests = await cursor.fetchall()
+        async with pool.reader() as conn:
+            requests = await RequestRepo.list_user_active(conn, user_id)
         if not requests:
             await message.answer("Ўчириш учун сўровлар йўқ.", reply_markup=get_requests_menu())
             await state.set_state(RequestsMenu.menu)
             logger.info(f"Пользователь {user_id} не имеет запросов для удаления")
             return
-        request_ids = [r[0] for r in requests]
+        request_ids = [r.unique_id for r in requests]
         await message.answer(
             "Ўчириш учун сўров танланг:",
             reply_markup=make_keyboard(request_ids, columns=2, with_back=True)
@@ -593,12 +552,8 @@ async def process_delete_request(message: types.Message, state: FSMContext, role
     item_id = message.text
     logger.debug(f"process_delete_request: user_id={user_id}, text='{item_id}'")
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                "SELECT unique_id FROM requests WHERE user_id = ? AND status = 'active'",
-                (user_id,)
-            ) as cursor:
-                requests = [row[0] for row in await cursor.fetchall()]
+        async with pool.reader() as conn:
+            requests = [r.unique_id for r in await RequestRepo.list_user_active(conn, user_id)]
         if item_id == "Орқага":
             await message.answer("Менинг сўровларим:", reply_markup=get_requests_menu())
             await state.set_state(RequestsMenu.menu)
@@ -611,39 +566,42 @@ async def process_delete_request(message: types.Message, state: FSMContext, role
             )
             logger.warning(f"Некорректный выбор запроса для удаления: {item_id}")
             return
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
+        async with pool.reader() as conn:
             async with conn.execute(
                 "SELECT channel_message_id FROM requests WHERE unique_id = ? AND user_id = ? AND status = 'active'",
                 (item_id, user_id)
             ) as cursor:
                 request = await cursor.fetchone()
-            if not request:
-                await message.answer(
-                    f"Сўров {item_id} топилмади ёки у сизга тегишли эмас!",
-                    reply_markup=get_requests_menu()
-                )
-                await state.set_state(RequestsMenu.menu)
-                logger.warning(f"Запрос {item_id} не найден для user_id={user_id}")
-                return
-            if request[0]:
-                try:
-                    await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=request[0])
-                    logger.debug(f"Сообщение {request[0]} удалено из канала")
-                except TelegramBadRequest as e:
-                    if "message can't be deleted" in str(e) or "message to delete not found" in str(e):
-                        logger.warning(f"Сообщение {request[0]} для запроса {item_id} уже удалено или не найдено: {e}")
-                        await conn.execute(
-                            "UPDATE requests SET channel_message_id = NULL WHERE unique_id = ? AND user_id = ?",
-                            (item_id, user_id)
-                        )
-                        await conn.commit()
-                        logger.info(f"Сброшено channel_message_id для запроса {item_id}")
-                    else:
-                        logger.error(f"Не удалось удалить сообщение {request[0]} для запроса {item_id}: {e}", exc_info=True)
-                        await notify_admin(f"Не удалось удалить сообщение {request[0]} для запроса {item_id}: {str(e)}", bot=message.bot)
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить сообщение {request[0]}: {e}", exc_info=True)
+        if not request:
+            await message.answer(
+                f"Сўров {item_id} топилмади ёки у сизга тегишли эмас!",
+                reply_markup=get_requests_menu()
+            )
+            await state.set_state(RequestsMenu.menu)
+            logger.warning(f"Запрос {item_id} не найден для user_id={user_id}")
+            return
+        reset_channel_message = False
+        if request[0]:
+            try:
+                await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=request[0])
+                logger.debug(f"Сообщение {request[0]} удалено из канала")
+            except TelegramBadRequest as e:
+                if "message can't be deleted" in str(e) or "message to delete not found" in str(e):
+                    logger.warning(f"Сообщение {request[0]} для запроса {item_id} уже удалено или не найдено: {e}")
+                    reset_channel_message = True
+                else:
+                    logger.error(f"Не удалось удалить сообщение {request[0]} для запроса {item_id}: {e}", exc_info=True)
                     await notify_admin(f"Не удалось удалить сообщение {request[0]} для запроса {item_id}: {str(e)}", bot=message.bot)
+            except Exception as e:
+                logger.warning(f"Не удалось удалить сообщение {request[0]}: {e}", exc_info=True)
+                await notify_admin(f"Не удалось удалить сообщение {request[0]} для запроса {item_id}: {str(e)}", bot=message.bot)
+        async with pool.writer() as conn:
+            if reset_channel_message:
+                await conn.execute(
+                    "UPDATE requests SET channel_message_id = NULL WHERE unique_id = ? AND user_id = ?",
+                    (item_id, user_id)
+                )
+                logger.info(f"Сброшено channel_message_id для запроса {item_id}")
             await conn.execute(
                 "UPDATE requests SET status = 'deleted' WHERE unique_id = ? AND user_id = ?",
                 (item_id, user_id)
@@ -674,17 +632,11 @@ async def close_request_start(message: types.Message, state: FSMContext, role: s
     user_id = message.from_user.id
     logger.debug(f"close_request_start: user_id={user_id}, text='{message.text}'")
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND name='requests'"
-            ) as cursor:
-                if not await cursor.fetchone():
-                    raise aiosqlite.Error("Table 'requests' does not exist")
-            async with conn.execute(
-                "SELECT id, unique_id, category, sort, volume_ton, price FROM requests WHERE user_id = ? AND status = 'active'",
-                (user_id,)
-            ) as cursor:
-                requests = await cursor.fetchall()
+        async with pool.reader() as conn:
+            requests = [
+                (r.id, r.unique_id, r.category, r.sort, r.volume_ton, r.price)
+                for r in await RequestRepo.list_user_active(conn, user_id)
+            ]
         if not requests:
             await message.answer("Ёпиш учун сўровлар йўқ.", reply_markup=get_requests_menu())
             await state.set_state(RequestsMenu.menu)
@@ -762,12 +714,11 @@ async def process_final_price(message: types.Message, state: FSMContext, role: s
     logger.debug(f"process_final_price: user_id={user_id}, text='{final_price_str}'")
     try:
         if final_price_str == "Орқага":
-            async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-                async with conn.execute(
-                    "SELECT id, unique_id, category, sort, volume_ton, price FROM requests WHERE user_id = ? AND status = 'active'",
-                    (user_id,)
-                ) as cursor:
-                    requests = await cursor.fetchall()
+            async with pool.reader() as conn:
+                requests = [
+                    (r.id, r.unique_id, r.category, r.sort, r.volume_ton, r.price)
+                    for r in await RequestRepo.list_user_active(conn, user_id)
+                ]
             if not requests:
                 await message.answer("Ёпиш учун сўровлар йўқ.", reply_markup=get_requests_menu())
                 await state.set_state(RequestsMenu.menu)
@@ -805,39 +756,42 @@ async def process_final_price(message: types.Message, state: FSMContext, role: s
             logger.warning(f"Отсутствует request_id или unique_id для user_id={user_id}")
             return
         archived_at = format_uz_datetime(datetime.now(pytz.UTC))
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
+        async with pool.reader() as conn:
             async with conn.execute(
                 "SELECT channel_message_id FROM requests WHERE id = ? AND user_id = ? AND status = 'active'",
                 (request_id, user_id)
             ) as cursor:
                 request = await cursor.fetchone()
-            if not request:
-                await message.answer(
-                    f"Сўров {unique_id} топилмади!",
-                    reply_markup=get_requests_menu()
-                )
-                await state.set_state(RequestsMenu.menu)
-                logger.warning(f"Запрос {unique_id} не найден для user_id={user_id}")
-                return
-            if request[0]:
-                try:
-                    await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=request[0])
-                    logger.debug(f"Сообщение {request[0]} удалено из канала")
-                except TelegramBadRequest as e:
-                    if "message can't be deleted" in str(e) or "message to delete not found" in str(e):
-                        logger.warning(f"Сообщение {request[0]} для запроса {unique_id} уже удалено или не найдено: {e}")
-                        await conn.execute(
-                            "UPDATE requests SET channel_message_id = NULL WHERE unique_id = ? AND user_id = ?",
-                            (unique_id, user_id)
-                        )
-                        await conn.commit()
-                        logger.info(f"Сброшено channel_message_id для запроса {unique_id}")
-                    else:
-                        logger.error(f"Не удалось удалить сообщение {request[0]} для запроса {unique_id}: {e}", exc_info=True)
-                        await notify_admin(f"Не удалось удалить сообщение {request[0]} для запроса {unique_id}: {str(e)}", bot=message.bot)
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить сообщение {request[0]}: {e}", exc_info=True)
+        if not request:
+            await message.answer(
+                f"Сўров {unique_id} топилмади!",
+                reply_markup=get_requests_menu()
+            )
+            await state.set_state(RequestsMenu.menu)
+            logger.warning(f"Запрос {unique_id} не найден для user_id={user_id}")
+            return
+        reset_channel_message = False
+        if request[0]:
+            try:
+                await message.bot.delete_message(chat_id=CHANNEL_ID, message_id=request[0])
+                logger.debug(f"Сообщение {request[0]} удалено из канала")
+            except TelegramBadRequest as e:
+                if "message can't be deleted" in str(e) or "message to delete not found" in str(e):
+                    logger.warning(f"Сообщение {request[0]} для запроса {unique_id} уже удалено или не найдено: {e}")
+                    reset_channel_message = True
+                else:
+                    logger.error(f"Не удалось удалить сообщение {request[0]} для запроса {unique_id}: {e}", exc_info=True)
                     await notify_admin(f"Не удалось удалить сообщение {request[0]} для запроса {unique_id}: {str(e)}", bot=message.bot)
+            except Exception as e:
+                logger.warning(f"Не удалось удалить сообщение {request[0]}: {e}", exc_info=True)
+                await notify_admin(f"Не удалось удалить сообщение {request[0]} для запроса {unique_id}: {str(e)}", bot=message.bot)
+        async with pool.writer() as conn:
+            if reset_channel_message:
+                await conn.execute(
+                    "UPDATE requests SET channel_message_id = NULL WHERE unique_id = ? AND user_id = ?",
+                    (unique_id, user_id)
+                )
+                logger.info(f"Сброшено channel_message_id для запроса {unique_id}")
             await conn.execute(
                 "UPDATE requests SET status = 'archived', final_price = ?, archived_at = ? WHERE id = ? AND user_id = ?",
                 (final_price, archived_at, request_id, user_id)
@@ -870,7 +824,7 @@ async def notify_next_pending_item(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     logger.debug(f"notify_next_pending_item: user_id={user_id}")
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
+        async with pool.reader() as conn:
             async with conn.execute(
                 "SELECT unique_id, type FROM pending_items WHERE user_id = ? ORDER BY created_at LIMIT 1",
                 (user_id,)
@@ -887,20 +841,22 @@ async def notify_next_pending_item(message: types.Message, state: FSMContext):
                 (unique_id,)
             ) as cursor:
                 details = await cursor.fetchone()
-            if details:
-                category, region = details
-                await message.answer(
-                    f"Сизда тасдиқланмаган {item_type} мавжуд: {unique_id}\n"
-                    f"Категория: {category}\n"
-                    f"Вилоят: {region}\n"
-                    f"Тасдиқлашни кутмоқда...",
-                    reply_markup=menu_func()
-                )
+        if details:
+            category, region = details
+            await message.answer(
+                f"Сизда тасдиқланмаган {item_type} мавжуд: {unique_id}\n"
+                f"Категория: {category}\n"
+                f"Вилоят: {region}\n"
+                f"Тасдиқлашни кутмоқда...",
+                reply_markup=menu_func()
+            )
+        async with pool.writer() as conn:
             await conn.execute(
                 "DELETE FROM pending_items WHERE unique_id = ? AND user_id = ?",
                 (unique_id, user_id)
             )
             await conn.commit()
+        await user_profiles.invalidate(user_id)
         logger.info(f"Уведомление о незавершённом {item_type} {unique_id} отправлено пользователю {user_id}")
     except aiosqlite.Error as e:
         logger.error(f"Ошибка базы данных в notify_next_pending_item для user_id={user_id}: {e}", exc_info=True)
@@ -2,7 +2,7 @@ import asyncio
 import logging
 import re
 import unicodedata
-import json
+from contextvars import ContextVar
 from datetime import datetime
 from typing import Optional, List, Union
 
@@ -14,7 +14,12 @@ from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
 from aiogram.utils.markdown import hcode
 from aiogram.fsm.storage.base import BaseStorage
 
-from config import ADMIN_IDS, CHANNEL_ID, DB_NAME, DB_TIMEOUT, ROLES, MAX_SORT_LENGTH, WEBAPP_URL
+import json_codec
+from config import ADMIN_IDS, CHANNEL_ID, DB_TIMEOUT, ROLES, MAX_SORT_LENGTH, WEBAPP_URL
+from db_pool import pool
+from profile_cache import user_profiles
+from subscription_cache import subscription_cache
+from repositories import PaymentRepo, UserContext
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +30,9 @@ MONTHS_UZ = {
     "October": "Октябр", "November": "Ноябр", "December": "Декабр"
 }
 
+# Asia/Tashkent не переходит на летнее время, смещение постоянно (UTC+5)
+TASHKENT_UTC_OFFSET = 5 * 3600
+
 def normalize_text(text: str) -> str:
     """Нормализует текст для ручного ввода (например, сорт), убирая эмодзи и пробелы."""
     if not isinstance(text, str):
@@ -80,20 +88,18 @@ async def check_role(event: types.Message | types.CallbackQuery, allow_unregiste
     """Проверяет роль пользователя."""
     user_id = event.from_user.id
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute("SELECT role FROM users WHERE id = ?", (user_id,)) as cursor:
-                result = await asyncio.wait_for(cursor.fetchone(), timeout=DB_TIMEOUT)
-                if result:
-                    role = result[0]
-                    logger.debug(f"check_role: user_id={user_id}, role={role}")
-                    if role in ROLES:
-                        return True, role
-                    logger.warning(f"check_role: user_id={user_id} имеет некорректную роль: {role}")
-                    return False, None
-                logger.debug(f"check_role: user_id={user_id} не найден в базе")
-                if allow_unregistered:
-                    return False, None
-                return False, None
+        profile = await asyncio.wait_for(user_profiles.get(user_id), timeout=DB_TIMEOUT)
+        if profile is not None:
+            role = profile.role
+            logger.debug(f"check_role: user_id={user_id}, role={role}")
+            if role in ROLES:
+                return True, role
+            logger.warning(f"check_role: user_id={user_id} имеет некорректную роль: {role}")
+            return False, None
+        logger.debug(f"check_role: user_id={user_id} не найден в базе")
+        if allow_unregistered:
+            return False, None
+        return False, None
     except asyncio.TimeoutError:
         logger.error(f"Timeout in check_role for user_id={user_id}")
         return False, None
@@ -105,50 +111,30 @@ async def check_subscription(bot: Bot, user_id: int, storage: BaseStorage) -> tu
     """Проверяет подписку пользователя, освобождая админов."""
     if user_id in ADMIN_IDS:
         return True, True, True
-    cache_key = f"sub:{user_id}"
-    if hasattr(storage, 'redis'):
-        try:
-            cached = await storage.redis.get(cache_key)
-            if cached:
-                return json.loads(cached)
-        except Exception as e:
-            logger.warning(f"Redis error in check_subscription for user_id={user_id}: {e}")
+    if subscription_cache.redis is None and hasattr(storage, 'redis'):
+        subscription_cache.attach_redis(storage.redis)
+    return await subscription_status(user_id)
 
-    try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
-            async with conn.execute(
-                "SELECT bot_expires FROM payments WHERE user_id = ?",
-                (user_id,)
-            ) as cursor:
-                result = await cursor.fetchone()
-        bot_expires = result[0] if result else None
+async def subscription_status(user_id: int) -> tuple[bool, bool, bool]:
+    """(success, bot_active, is_subscribed) из subscription_cache; payments читается только при промахе."""
+    cached = await subscription_cache.get(user_id)
+    if cached is not None:
+        return cached
 
-        if bot_expires:
-            expires_dt = parse_uz_datetime(bot_expires)
-            if expires_dt is None:
-                bot_active = False
-                is_subscribed = False
-            else:
-                now = datetime.now(pytz.timezone('Asia/Tashkent'))
-                if expires_dt > now:
-                    bot_active = True
-                    is_subscribed = True
-                else:
-                    bot_active = False
-                    is_subscribed = False
-        else:
-            bot_active = False
-            is_subscribed = False
+    try:
+        async with pool.reader() as conn:
+            payment = await PaymentRepo.get(conn, user_id)
+        expires_ts = None
+        if payment and payment.bot_expires:
+            expires_ts = payment.bot_expires_ts
+            if expires_ts is None:
+                expires_dt = parse_uz_datetime(payment.bot_expires)
+                expires_ts = to_epoch(expires_dt) if expires_dt else None
+        is_subscribed = bool(expires_ts and expires_ts > to_epoch(datetime.now(pytz.UTC)))
+        bot_active = is_subscribed
 
         response = (False, bot_active, is_subscribed)
-        if hasattr(storage, 'redis'):
-            try:
-                if not is_subscribed:
-                    await storage.redis.delete(cache_key)
-                else:
-                    await storage.redis.setex(cache_key, 60, json.dumps(response))
-            except Exception as e:
-                logger.warning(f"Redis error caching subscription for user_id={user_id}: {e}")
+        await subscription_cache.put(user_id, response, expires_ts)
         return response
     except asyncio.TimeoutError:
         logger.error(f"Timeout in check_subscription for user_id={user_id}")
@@ -157,15 +143,6 @@ async def check_subscription(bot: Bot, user_id: int, storage: BaseStorage) -> tu
         logger.error(f"Database error in check_subscription for user_id={user_id}: {e}", exc_info=True)
         return False, False, False
 
-async def invalidate_cache(storage, table: str) -> None:
-    """Инвалидирует кэш для указанной таблицы."""
-    if hasattr(storage, 'redis'):
-        try:
-            await storage.redis.publish(f'cache_invalidate:{table}', 'invalidate')
-            logger.debug(f"Cache invalidated for table: {table}")
-        except Exception as e:
-            logger.warning(f"Redis error in invalidate_cache for table {table}: {e}")
-
 def validate_number(value: str, min_value: float = 0) -> tuple[bool, Optional[float]]:
     """Проверяет, является ли строка числом, и возвращает его."""
     try:
@@ -188,10 +165,37 @@ async def validate_sort(sort: str) -> bool:
     """Проверяет длину строки сорта."""
     return len(sort) <= MAX_SORT_LENGTH
 
+# UserContext текущего апдейта; устанавливается SubscriptionCheckMiddleware
+current_user_context: ContextVar[Optional[UserContext]] = ContextVar("current_user_context", default=None)
+
+async def load_user_context(user_id: int) -> UserContext:
+    """Собирает UserContext из кэша профилей (роль, контакты, pending_items, final_price_due) и кэша подписок;
+    SQLite читается только при промахе кэша."""
+    profile = await asyncio.wait_for(user_profiles.get(user_id), timeout=DB_TIMEOUT)
+    if profile is None:
+        logger.debug(f"load_user_context: user_id={user_id} не найден в базе")
+        return UserContext(user_id, False, None, None, None, user_id in ADMIN_IDS, 0, False)
+    role = profile.role
+    if role not in ROLES:
+        logger.warning(f"load_user_context: user_id={user_id} имеет некорректную роль: {role}")
+        role = None
+    subscribed = user_id in ADMIN_IDS or (await subscription_status(user_id))[2]
+    return UserContext(
+        user_id, True, role, profile.phone_number, profile.region,
+        subscribed, profile.pending_count, bool(profile.has_expired_products)
+    )
+
+async def get_user_context(user_id: int) -> UserContext:
+    """Возвращает UserContext текущего апдейта или загружает его, если middleware не отработал."""
+    ctx = current_user_context.get()
+    if ctx is not None and ctx.user_id == user_id:
+        return ctx
+    return await load_user_context(user_id)
+
 async def has_pending_items(user_id: int) -> bool:
     """Проверяет наличие незавершённых элементов у пользователя."""
     try:
-        async with aiosqlite.connect(DB_NAME, timeout=DB_TIMEOUT) as conn:
+        async with pool.reader() as conn:
             async with conn.execute(
                     "SELECT COUNT(*) FROM pending_items WHERE user_id = ?", (user_id,)
             ) as cursor:
@@ -215,6 +219,12 @@ def format_uz_datetime(dt: datetime) -> str:
     dt_local = dt.astimezone(tz)
     return dt_local.strftime("%d.%m.%Y %H:%M:%S")
 
+def to_epoch(dt: datetime) -> int:
+    """Переводит дату в Unix epoch (секунды); дата без часового пояса считается UTC."""
+    if dt.tzinfo is None:
+        dt = pytz.UTC.localize(dt)
+    return int(dt.timestamp())
+
 def parse_uz_datetime(date_str: str) -> Optional[datetime]:
     """Парсит дату в узбекском формате или других форматах, возвращая время в Asia/Tashkent."""
     if not date_str or not isinstance(date_str, str):
@@ -311,7 +321,7 @@ async def save_registration_state(storage, user_id: int, data: dict):
     """Сохраняет промежуточное состояние регистрации в Redis."""
     if hasattr(storage, 'redis'):
         try:
-            await storage.redis.setex(f"reg:{user_id}", 3600, json.dumps(data))
+            await storage.redis.setex(f"reg:{user_id}", 3600, json_codec.dumps_bytes(data))
             logger.debug(f"Registration state saved for user_id={user_id}")
         except Exception as e:
             logger.warning(f"Redis error saving registration state for user_id={user_id}: {e}")
\ No newline at end of file